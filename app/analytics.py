@@ -0,0 +1,327 @@
+# Analytics snapshot
+#
+# The publication and staffing reports read columnar copies of the core
+# tables that are kept in memory as DataFrames. IDs and other low-cardinality
+# text are pandas categoricals, dates are datetime64, and each report is a few
+# vectorized groupbys and merges over them instead of a join in SQLite.
+#
+# Every frame remembers the ChangeLog version of its table
+# (changes.table_versions) as of its last load. Reading the snapshot first
+# refreshes the tables whose version has moved. When the ChangeLog still
+# holds every change since that version and there are at most REFRESH_LIMIT
+# of them, only the changed keys are read back from the table and spliced
+# into a copy of the frame. Otherwise the table is loaded again in full. The
+# frames are replaced, never changed in place, so a report that is already
+# running keeps a consistent view. There is one snapshot per database engine.
+#
+# Rows loaded by init_db.py --scale bypass the ChangeLog, so restart the app
+# after a bulk load, as for the other version-keyed caches.
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from . import changes
+from .metrics import metrics
+from .models import db
+
+REFRESH_LIMIT = 2000   # changes per table applied as a patch; more means a full reload
+KEY_CHUNK = 400        # keys per IN (...) when reading changed rows back
+TOP_AUTHORS = 10
+TOP_FOR_GRANT = 3
+
+# key follows the table's primary key, in the order ChangeLog.pk lists it
+Spec = namedtuple('Spec', 'table key columns categories dates')
+SPECS = {
+    'members': Spec('LabMember', ('member_id',), ('member_id', 'name', 'member_type', 'join_date'),
+                    ('member_id', 'member_type'), ('join_date',)),
+    'students': Spec('Student', ('member_id',), ('member_id', 'academic_level', 'major'),
+                     ('member_id', 'academic_level', 'major'), ()),
+    'projects': Spec('Project', ('project_id',), ('project_id', 'title', 'start_date', 'end_date', 'status', 'leader_id'),
+                     ('project_id', 'status', 'leader_id'), ('start_date', 'end_date')),
+    'grants': Spec('GrantFund', ('grant_id',), ('grant_id', 'source', 'budget', 'start_date', 'duration'),
+                   ('grant_id', 'source'), ('start_date',)),
+    'project_grants': Spec('ProjectGrant', ('project_id', 'grant_id'), ('project_id', 'grant_id', 'amount_allocated'),
+                           ('project_id', 'grant_id'), ()),
+    'works_on': Spec('WorksOn', ('member_id', 'project_id'), ('member_id', 'project_id', 'role', 'weekly_hours'),
+                     ('member_id', 'project_id', 'role'), ()),
+    'publications': Spec('Publication', ('pub_id',), ('pub_id', 'pub_date', 'venue', 'status'),
+                         ('pub_id', 'venue', 'status'), ('pub_date',)),
+    'authorships': Spec('Authorship', ('pub_id', 'member_id'), ('pub_id', 'member_id', 'author_order', 'author_role'),
+                        ('pub_id', 'member_id', 'author_role'), ()),
+}
+
+# dimensions of the publication breakdown -> column of the authorship fact frame
+DIMENSIONS = {
+    'year': 'year', 'venue': 'venue', 'pub_status': 'pub_status', 'author_role': 'author_role',
+    'member_type': 'member_type', 'major': 'major', 'academic_level': 'academic_level',
+}
+MEASURES = ('publications', 'authorships', 'authors')
+MAX_DIMENSIONS = 3
+FACT_FRAMES = ('authorships', 'publications', 'members', 'students')
+
+
+# ---- loading -----------------------------------------------------------------------
+
+def _typed(df, spec):
+    for c in spec.categories:
+        df[c] = df[c].astype('category')
+    for c in spec.dates:
+        df[c] = pd.to_datetime(df[c], errors='coerce')
+    return df
+
+
+def _select(spec):
+    return f'SELECT {", ".join(spec.columns)} FROM {spec.table}'
+
+
+def _load(spec):
+    df = pd.read_sql_query(text(_select(spec)), db.session.connection())
+    return _typed(df, spec)
+
+
+def _load_keys(spec, keys):
+    # the current rows of the given keys (tuples); keys that were deleted are simply absent
+    conn = db.session.connection()
+    frames = []
+    for i in range(0, len(keys), KEY_CHUNK):
+        chunk = keys[i:i + KEY_CHUNK]
+        if len(spec.key) == 1:
+            stmt = text(f'{_select(spec)} WHERE {spec.key[0]} IN :ids').bindparams(bindparam('ids', expanding=True))
+            params = {'ids': [k[0] for k in chunk]}
+        else:
+            # row values: (a, b) IN (VALUES (?, ?), ...)
+            values = ', '.join('(' + ', '.join(f':k{j}_{n}' for n in range(len(spec.key))) + ')' for j in range(len(chunk)))
+            stmt = text(f'{_select(spec)} WHERE ({", ".join(spec.key)}) IN (VALUES {values})')
+            params = {f'k{j}_{n}': v for j, k in enumerate(chunk) for n, v in enumerate(k)}
+        frames.append(pd.read_sql_query(stmt, conn, params=params))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(spec.columns))
+
+
+def _key_mask(df, spec, keys):
+    # rows of df whose key is one of keys; the first key column narrows it down vectorized
+    first = df[spec.key[0]].isin({k[0] for k in keys}).to_numpy()
+    if len(spec.key) == 1 or not first.any():
+        return first
+    wanted = set(keys)
+    candidates = df.loc[first, list(spec.key)].astype(object).itertuples(index=False, name=None)
+    first[first] = [k in wanted for k in candidates]
+    return first
+
+
+def _splice(df, spec, keys, fresh):
+    # df without the changed keys plus their current rows, keeping the categorical dtypes
+    kept = df[~_key_mask(df, spec, keys)]
+    if not len(fresh):
+        return kept.reset_index(drop=True)
+    fresh = fresh.copy()
+    for c in spec.categories:
+        new = pd.Index(fresh[c].dropna().unique()).difference(kept[c].cat.categories)
+        if len(new):
+            kept = kept.assign(**{c: kept[c].cat.add_categories(new)})
+        fresh[c] = pd.Categorical(fresh[c], categories=kept[c].cat.categories)
+    for c in spec.dates:
+        fresh[c] = pd.to_datetime(fresh[c], errors='coerce')
+    return pd.concat([kept, fresh[list(spec.columns)]], ignore_index=True)
+
+
+class Snapshot:
+    def __init__(self):
+        self.frames = {}
+        self.versions = {}
+        self.head = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # bring every stale frame up to date; returns {name: DataFrame}
+        with self._lock:
+            # every logged write moves the head, so an unchanged head means nothing to do
+            head = changes.head()
+            if head == self.head:
+                return dict(self.frames)
+            current = changes.table_versions([s.table for s in SPECS.values()])
+            floor = None
+            for name, spec in SPECS.items():
+                version = current[spec.table]
+                if name in self.frames and self.versions[name] == version:
+                    continue
+                if floor is None:
+                    floor = changes.pruned_through()
+                self.frames[name] = self._refreshed(name, spec, version, floor)
+                self.versions[name] = version
+            self.head = head
+            return dict(self.frames)
+
+    def _refreshed(self, name, spec, version, floor):
+        old = self.frames.get(name)
+        since = self.versions.get(name)
+        if old is not None and since >= floor:
+            entries = list(changes.changes_since(since, REFRESH_LIMIT + 1, [spec.table]))
+            if len(entries) <= REFRESH_LIMIT:
+                keys = list(dict.fromkeys(tuple(json.loads(e.pk)) for e in entries if e.seq <= version))
+                metrics.incr('analytics.patches')
+                metrics.incr('analytics.rows_patched', len(keys))
+                return _splice(old, spec, keys, _load_keys(spec, keys))
+        metrics.incr('analytics.loads')
+        return _load(spec)
+
+
+_snapshots = {}
+_results = OrderedDict()
+_lock = threading.Lock()
+CACHE_SIZE = 64
+
+
+def snapshot():
+    # the refreshed frames of the current app's database
+    engine = db.engine
+    with _lock:
+        snap = _snapshots.get(engine)
+        if snap is None:
+            snap = _snapshots[engine] = Snapshot()
+    return snap.refresh()
+
+
+def _memo(key, frames, build):
+    # build() once per key and set of frames, so a result (or a derived frame) is
+    # only computed again after one of the frames it reads was refreshed
+    key = (db.engine, key)
+    with _lock:
+        hit = _results.get(key)
+        if hit is not None:
+            _results.move_to_end(key)
+    if hit is not None and all(a is b for a, b in zip(hit[0], frames)):
+        metrics.incr('analytics.cache_hits')
+        return hit[1]
+    metrics.incr('analytics.cache_misses')
+    value = build()
+    with _lock:
+        _results[key] = (frames, value)
+        while len(_results) > CACHE_SIZE:
+            _results.popitem(last=False)
+    return value
+
+
+# ---- reports -------------------------------------------------------------------------
+
+def _names(f):
+    m = f['members']
+    return pd.Series(m['name'].to_numpy(), index=m['member_id'].astype(object))
+
+
+def _ranked(counts, names, n):
+    # top n member ids by count (ties by id), as rows of (member_id, name, pubs)
+    counts = counts.sort_index().sort_values(ascending=False, kind='stable').head(n)
+    return [{'member_id': m, 'name': names.get(m), 'pubs': int(c)} for m, c in counts.items()]
+
+
+def _pub_counts(authorships):
+    # authorships per member id; counted over the category codes
+    counts = authorships['member_id'].value_counts(sort=False)
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+def top_authors(n=TOP_AUTHORS):
+    # members with the most authorships
+    f = snapshot()
+    return _memo(('top_authors', n), (f['authorships'], f['members']),
+                 lambda: _ranked(_pub_counts(f['authorships']), _names(f), n))
+
+
+def avg_student_pubs():
+    # mean publications per student, by major (students without a major form one group)
+    f = snapshot()
+
+    def build():
+        students = f['students']
+        per_student = _pub_counts(f['authorships']).reindex(students['member_id'].astype(object), fill_value=0).to_numpy()
+        by_major = pd.Series(per_student).groupby(students['major'].astype(object).to_numpy(), dropna=False).mean()
+        return [{'major': None if pd.isna(m) else m, 'avg_pubs': float(v)} for m, v in by_major.sort_index().items()]
+    return _memo(('avg_student_pubs',), (f['authorships'], f['students']), build)
+
+
+def _day(value, name):
+    try:
+        return pd.Timestamp(value).normalize()
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must look like YYYY-MM-DD') from None
+
+
+def projects_active(start, end):
+    # grant-funded projects whose [start_date, end_date] meets [start, end]; no end date means ongoing
+    first, last = _day(start, 'start'), _day(end, 'end')
+    f = snapshot()
+
+    def build():
+        p = f['projects']
+        funded = p['project_id'].isin(f['project_grants']['project_id'].astype(object).unique())
+        active = funded & (p['start_date'] <= last) & (p['end_date'].isna() | (p['end_date'] >= first))
+        by_status = p.loc[active, 'status'].astype(object).value_counts().sort_index()
+        return {'start': first.date().isoformat(), 'end': last.date().isoformat(), 'count': int(active.sum()),
+                'by_status': {s: int(c) for s, c in by_status.items()}}
+    return _memo(('projects_active', first, last), (f['projects'], f['project_grants']), build)
+
+
+def top_for_grant(grant_id, n=TOP_FOR_GRANT):
+    # members working on a project the grant funds, ranked by their publications (all of them)
+    f = snapshot()
+
+    def build():
+        pg = f['project_grants']
+        projects = pg.loc[pg['grant_id'] == grant_id, 'project_id'].astype(object).unique()
+        w = f['works_on']
+        members = w.loc[w['project_id'].isin(projects), 'member_id'].astype(object).unique()
+        a = f['authorships']
+        a = a[a['member_id'].isin(members)]
+        counts = a.groupby(a['member_id'].astype(object))['pub_id'].nunique().reindex(members, fill_value=0)
+        return _ranked(counts, _names(f), n)
+    return _memo(('top_for_grant', grant_id, n), (f['project_grants'], f['works_on'], f['authorships'], f['members']), build)
+
+
+def _facts(f):
+    # one row per authorship with the publication's and the author's attributes
+    pubs = f['publications'].rename(columns={'status': 'pub_status'})
+    facts = f['authorships'].merge(pubs, on='pub_id', how='left')
+    facts = facts.merge(f['members'][['member_id', 'member_type']], on='member_id', how='left')
+    facts = facts.merge(f['students'][['member_id', 'major', 'academic_level']], on='member_id', how='left')
+    facts['year'] = facts['pub_date'].dt.year.astype('Int64')
+    return facts
+
+
+def breakdown(dims, measure='publications'):
+    # publications, authorships or distinct authors for every combination of the dimensions
+    dims = list(dict.fromkeys(dims))
+    if not dims:
+        raise ValueError(f'choose at least one of {", ".join(DIMENSIONS)}')
+    if len(dims) > MAX_DIMENSIONS:
+        raise ValueError(f'at most {MAX_DIMENSIONS} dimensions')
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f'unknown dimensions: {", ".join(unknown)} (one of {", ".join(DIMENSIONS)})')
+    if measure not in MEASURES:
+        raise ValueError(f'measure must be one of {", ".join(MEASURES)}')
+    f = snapshot()
+    frames = tuple(f[n] for n in FACT_FRAMES)
+
+    def build():
+        facts = _memo(('facts',), frames, lambda: _facts(f))
+        groups = facts.groupby([DIMENSIONS[d] for d in dims], observed=True, dropna=False, sort=True)
+        if measure == 'publications':
+            values = groups['pub_id'].nunique()
+        elif measure == 'authors':
+            values = groups['member_id'].nunique()
+        else:
+            values = groups.size()
+        values = values[values > 0]
+        rows = []
+        for key, v in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            rows.append([None if pd.isna(k) else (int(k) if d == 'year' else k) for d, k in zip(dims, key)] + [int(v)])
+        return {'dimensions': dims, 'measure': measure, 'columns': dims + [measure], 'rows': rows,
+                'total': int(facts['pub_id'].nunique() if measure == 'publications'
+                             else facts['member_id'].nunique() if measure == 'authors' else len(facts))}
+    return _memo(('breakdown', tuple(dims), measure), frames, build)
@@ -0,0 +1,261 @@
+# Read API (/api/v1)
+#
+# One generic read endpoint per model, for integrations that used to scrape
+# the HTML pages:
+#
+#   GET /api/v1/members?member_type=student&fields=name&limit=500
+#   GET /api/v1/members?after=<next from the previous page>
+#   GET /api/v1/projects?ids=P1,P2,P3&include=works_on,leader
+#   GET /api/v1/works_on?ids=S1:P1,S2:P1            (composite keys joined by ':')
+#
+# Rows are read with Core selects (no ORM objects) and sent as a column list
+# plus row arrays, with dates as the ISO text SQLite stores. Pages are keyset
+# paginated on the primary key, so page N costs the same as page 1.
+# Filters are equality (comma-separated values mean IN) and are only offered
+# on columns that lead an index, so none of them scan. include= fetches each
+# related resource with one IN query over the page's keys and returns it
+# alongside the page. Responses carry an ETag from the change log
+# (changes.data_version); a poller that sends it back gets a 304 without the
+# query being run.
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from sqlalchemy import Date, DateTime, String, bindparam, select, text, tuple_, type_coerce
+
+from . import changes
+from .models import (db, LabMember, Faculty, Student, Collaborator, Project, GrantFund, ProjectGrant, WorksOn,
+                     Equipment, EquipmentUse, EquipmentUseArchive, Publication, Authorship, Mentorship)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_IDS = 1000
+MAX_INCLUDED = 10000
+KEY_SEP = ':'
+RESERVED = ('fields', 'include', 'ids', 'after', 'limit')
+
+# relation: rows of `resource` whose `remote` column equals this row's `local` column
+Relation = namedtuple('Relation', 'resource local remote')
+Resource = namedtuple('Resource', 'model relations')
+
+RESOURCES = {
+    'members': Resource(LabMember, {
+        'faculty': Relation('faculty', 'member_id', 'member_id'),
+        'student': Relation('students', 'member_id', 'member_id'),
+        'collaborator': Relation('collaborators', 'member_id', 'member_id'),
+        'works_on': Relation('works_on', 'member_id', 'member_id'),
+        'authorships': Relation('authorships', 'member_id', 'member_id'),
+        'led_projects': Relation('projects', 'member_id', 'leader_id'),
+        'mentors': Relation('mentorships', 'member_id', 'mentee_id'),
+        'mentees': Relation('mentorships', 'member_id', 'mentor_id'),
+        'equipment_uses': Relation('equipment_uses', 'member_id', 'member_id'),
+    }),
+    'faculty': Resource(Faculty, {'member': Relation('members', 'member_id', 'member_id')}),
+    'students': Resource(Student, {'member': Relation('members', 'member_id', 'member_id')}),
+    'collaborators': Resource(Collaborator, {'member': Relation('members', 'member_id', 'member_id')}),
+    'projects': Resource(Project, {
+        'leader': Relation('members', 'leader_id', 'member_id'),
+        'works_on': Relation('works_on', 'project_id', 'project_id'),
+        'grants': Relation('project_grants', 'project_id', 'project_id'),
+    }),
+    'grants': Resource(GrantFund, {'allocations': Relation('project_grants', 'grant_id', 'grant_id')}),
+    'project_grants': Resource(ProjectGrant, {
+        'project': Relation('projects', 'project_id', 'project_id'),
+        'grant': Relation('grants', 'grant_id', 'grant_id'),
+    }),
+    'works_on': Resource(WorksOn, {
+        'member': Relation('members', 'member_id', 'member_id'),
+        'project': Relation('projects', 'project_id', 'project_id'),
+    }),
+    'equipment': Resource(Equipment, {'uses': Relation('equipment_uses', 'equip_id', 'equip_id')}),
+    'equipment_uses': Resource(EquipmentUse, {
+        'equipment': Relation('equipment', 'equip_id', 'equip_id'),
+        'member': Relation('members', 'member_id', 'member_id'),
+    }),
+    'equipment_use_archive': Resource(EquipmentUseArchive, {
+        'equipment': Relation('equipment', 'equip_id', 'equip_id'),
+        'member': Relation('members', 'member_id', 'member_id'),
+    }),
+    'publications': Resource(Publication, {'authorships': Relation('authorships', 'pub_id', 'pub_id')}),
+    'authorships': Resource(Authorship, {
+        'publication': Relation('publications', 'pub_id', 'pub_id'),
+        'member': Relation('members', 'member_id', 'member_id'),
+    }),
+    'mentorships': Resource(Mentorship, {
+        'mentor': Relation('members', 'mentor_id', 'member_id'),
+        'mentee': Relation('members', 'mentee_id', 'member_id'),
+    }),
+}
+
+_indexed = {}
+
+
+def _table(resource):
+    return RESOURCES[resource].model.__table__
+
+
+def columns(resource):
+    # exposed columns: everything but the generated *_ts helpers
+    return [c.name for c in _table(resource).columns if c.computed is None]
+
+
+def key(resource):
+    return [c.name for c in _table(resource).primary_key.columns]
+
+
+def filterable(resource):
+    # exposed columns that lead an index of the table (the primary key's included), per engine
+    table = _table(resource).name
+    cache_key = (db.engine, table)
+    if cache_key not in _indexed:
+        leading = set()
+        for idx in db.session.execute(text(f'PRAGMA index_list("{table}")')).all():
+            first = db.session.execute(text(f'PRAGMA index_info("{idx.name}")')).first()
+            if first is not None:
+                leading.add(first.name)
+        _indexed[cache_key] = leading
+    return [c for c in columns(resource) if c in _indexed[cache_key]]
+
+
+def describe():
+    return {name: {'key': key(name), 'columns': columns(name), 'filters': filterable(name),
+                   'include': sorted(RESOURCES[name].relations)} for name in RESOURCES}
+
+
+def _split(value):
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+def _col(table, name):
+    # raw column value: dates come back as the stored ISO text instead of being parsed
+    c = table.c[name]
+    return type_coerce(c, String).label(name) if isinstance(c.type, (Date, DateTime)) else c
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values), separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, n):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError('after is not a cursor from this API') from None
+    if not isinstance(values, list) or len(values) != n:
+        raise ValueError('after is not a cursor from this API')
+    return values
+
+
+def _parse_ids(values, n):
+    if len(values) > MAX_IDS:
+        raise ValueError(f'at most {MAX_IDS} ids per request')
+    if n == 1:
+        return [(v,) for v in values]
+    out = []
+    for v in values:
+        parts = v.split(KEY_SEP)
+        if len(parts) != n:
+            raise ValueError(f'ids of this resource have {n} parts joined by "{KEY_SEP}": {v}')
+        out.append(tuple(parts))
+    return out
+
+
+def _key_clause(table, keys, values):
+    cols = [table.c[k] for k in keys]
+    if len(cols) == 1:
+        return cols[0].in_([v[0] for v in values])
+    return tuple_(*cols).in_(values)
+
+
+def _includes(resource, names):
+    relations = RESOURCES[resource].relations
+    unknown = [n for n in names if n not in relations]
+    if unknown:
+        raise ValueError(f'unknown include for {resource}: {", ".join(unknown)} (one of {", ".join(sorted(relations))})')
+    return {n: relations[n] for n in names}
+
+
+def tables(resource, args):
+    # tables a request reads, for its ETag; unknown includes are left to query() to reject
+    relations = RESOURCES[resource].relations
+    names = [_table(resource).name]
+    names += [_table(relations[n].resource).name for n in _split(args.get('include')) if n in relations]
+    return sorted(set(names))
+
+
+def etag(resource, args):
+    return f'{resource}-{changes.data_version(tables(resource, args))}'
+
+
+def query(resource, args):
+    # args: a mapping of query-string parameters; raises ValueError on bad input
+    table = _table(resource)
+    keys = key(resource)
+    available = columns(resource)
+    includes = _includes(resource, _split(args.get('include')))
+
+    fields = _split(args.get('fields'))
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise ValueError(f'unknown fields for {resource}: {", ".join(unknown)}')
+    # key first, then the requested fields (all when none), then what include= joins on
+    wanted = keys + (fields or available) + [r.local for r in includes.values()]
+    out_cols = list(dict.fromkeys(wanted))
+
+    stmt = select(*[_col(table, c) for c in out_cols])
+    allowed = filterable(resource)
+    for name in args:
+        if name in RESERVED:
+            continue
+        if name not in allowed:
+            raise ValueError(f'{resource} can be filtered on {", ".join(allowed)}; not {name}')
+        values = _split(args.get(name))
+        stmt = stmt.where(table.c[name].in_(values) if len(values) > 1 else table.c[name] == (values[0] if values else ''))
+
+    ids = _parse_ids(_split(args.get('ids')), len(keys)) if args.get('ids') else None
+    order = [table.c[k] for k in keys]
+    if ids is not None:
+        stmt = stmt.where(_key_clause(table, keys, ids)).order_by(*order)
+        rows = db.session.execute(stmt).all() if ids else []
+        more = False
+    else:
+        try:
+            limit = int(args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError('limit must be an integer') from None
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+        if args.get('after'):
+            after = decode_cursor(args['after'], len(keys))
+            stmt = stmt.where(tuple_(*order) > tuple_(*after) if len(order) > 1 else order[0] > after[0])
+        rows = db.session.execute(stmt.order_by(*order).limit(limit + 1)).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+    result = {'resource': resource, 'columns': out_cols, 'rows': [list(r) for r in rows]}
+    if ids is not None:
+        found = {tuple(r[:len(keys)]) for r in rows}
+        result['missing'] = [KEY_SEP.join(i) for i in ids if i not in found]
+    else:
+        result['next'] = encode_cursor(rows[-1][:len(keys)]) if more else None
+    if includes:
+        result['included'] = {name: _related(rel, {r[out_cols.index(rel.local)] for r in rows})
+                              for name, rel in includes.items()}
+    return result
+
+
+def _related(rel, values):
+    # every row of rel.resource whose rel.remote is one of values, in one query
+    table = _table(rel.resource)
+    cols = columns(rel.resource)
+    values = sorted(v for v in values if v is not None)
+    rows = []
+    if values:
+        stmt = (select(*[_col(table, c) for c in cols])
+                .where(table.c[rel.remote].in_(bindparam('values', expanding=True)))
+                .order_by(*[table.c[k] for k in key(rel.resource)])
+                .limit(MAX_INCLUDED + 1))
+        rows = db.session.execute(stmt, {'values': values}).all()
+    return {'resource': rel.resource, 'columns': cols, 'rows': [list(r) for r in rows[:MAX_INCLUDED]],
+            'truncated': len(rows) > MAX_INCLUDED}
@@ -1,12 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
 import os
-from .models import db, LabMember, Faculty, Student, Collaborator, Project, Equipment, EquipmentUse, Publication, Authorship, GrantFund, ProjectGrant, WorksOn, Mentorship
+from .models import db, LabMember, Faculty, Student, Collaborator, Project, Equipment, EquipmentUse, Publication, Authorship, GrantFund, ProjectGrant, WorksOn, Mentorship, EquipmentUseArchive, equipment_use_history, OPEN_END_TS, DAY_SECONDS, to_epoch
+from .metrics import metrics
+from .refcache import refcache
+from .writes import mark_read_only, read_only, writes
+from .events import events, TooManySubscribers
+from .occupancy import sweeper
+from .jobs import jobs, KINDS as JOB_KINDS
+from . import occupancy
+from . import utilization
+from . import lineage
+from . import collaboration
+from . import timeline
+from . import burndown
+from . import analytics
+from . import constraints
+from . import api
+from . import batch
+from . import ledger
+from . import changes
+from .readpath import fetch_rows, iter_rows
+from .streaming import stream_page
 from datetime import datetime, date
-from sqlalchemy import text
+from sqlalchemy import func, select, text
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
 from typing import Optional
+import itertools
+import json
 import re
 
 def _parse_date(s: Optional[str]):
@@ -25,15 +49,85 @@ def _parse_datetime(s: Optional[str]):
     except Exception:
         return None
 
+def _member_booking_conflicts(equip_id, member_id, start_ts, end_ts):
+    # (overlapping, same_day) counts of a member's bookings on one equipment, from the epoch columns
+    start_day = start_ts // DAY_SECONDS if start_ts is not None else None
+    end_day = end_ts // DAY_SECONDS if end_ts is not None else None
+    sql = '''SELECT
+                 COALESCE(SUM(:s IS NOT NULL AND :e IS NOT NULL AND use_end_ts >= :s AND use_start_ts <= :e), 0),
+                 COALESCE(SUM(use_start_ts / :day = :sd OR (use_end IS NOT NULL AND use_end_ts / :day = :ed)), 0),
+                 COALESCE(SUM((:s IS NOT NULL AND :e IS NOT NULL AND use_end_ts >= :s AND use_start_ts <= :e)
+                              OR use_start_ts / :day = :sd OR (use_end IS NOT NULL AND use_end_ts / :day = :ed)), 0)
+             FROM EquipmentUse WHERE member_id = :mid AND equip_id = :eid'''
+    row = db.session.execute(text(sql), {'s': start_ts, 'e': end_ts, 'sd': start_day, 'ed': end_day,
+                                         'day': DAY_SECONDS, 'mid': member_id, 'eid': equip_id}).one()
+    return int(row[0]), int(row[1]), int(row[2])
+
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'labmanager.db')
 
-def create_app():
+
+def compile_templates(app):
+    # load every page template now instead of on its first request; with the
+    # bytecode cache this mostly reads compiled code back from disk
+    env = app.jinja_env
+    names = [n for n in env.list_templates() if n.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'dev'
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', f'sqlite:///{DB_PATH}')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # optional mmap'd file so reference-cache invalidations reach every worker process
+    app.config['REFCACHE_SHARED_PATH'] = os.environ.get('REFCACHE_SHARED_PATH')
+    # write transactions: BEGIN IMMEDIATE with busy retries, see writes.py
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 100))
+    app.config['SQLITE_WRITE_DEADLINE'] = float(os.environ.get('SQLITE_WRITE_DEADLINE', 10))
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE')
+    app.config['SQLITE_SERIALIZE_WRITES'] = os.environ.get('SQLITE_SERIALIZE_WRITES', '') not in ('', '0')
+    # live equipment pages over Server-Sent Events, see events.py
+    app.config['EVENTS_QUEUE_SIZE'] = int(os.environ.get('EVENTS_QUEUE_SIZE', 64))
+    app.config['EVENTS_MAX_SUBSCRIBERS'] = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 64))
+    app.config['EVENTS_HEARTBEAT'] = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+    app.config['EVENTS_CHANGELOG_POLL'] = float(os.environ.get('EVENTS_CHANGELOG_POLL', 0))
+    # expire bookings from EquipmentOccupancy as they end, see occupancy.py
+    app.config['OCCUPANCY_SWEEPER'] = os.environ.get('OCCUPANCY_SWEEPER', '1') not in ('', '0')
+    app.config['OCCUPANCY_SWEEP_TICK'] = int(os.environ.get('OCCUPANCY_SWEEP_TICK', 1))
+    app.config['OCCUPANCY_RESYNC'] = float(os.environ.get('OCCUPANCY_RESYNC', 300))
+    # long reports and exports in worker processes, see jobs.py. The pool is per
+    # web process, so under app.wsgi there are --workers x JOBS_WORKERS of them
+    app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 2))
+    app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR', os.path.join(BASE_DIR, 'jobs'))
+    app.config['JOBS_START_METHOD'] = os.environ.get('JOBS_START_METHOD', 'spawn')
+    # compiled templates kept on disk across restarts ('' turns it off), and
+    # optionally compiled while the app is built; see bench/startup.py
+    app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR', os.path.join(BASE_DIR, '.jinja_cache'))
+    app.config['JINJA_PRECOMPILE'] = os.environ.get('JINJA_PRECOMPILE', '') not in ('', '0')
+    if config:
+        app.config.update(config)
+    if app.config['JINJA_CACHE_DIR']:
+        # before anything creates app.jinja_env
+        os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])}
     db.init_app(app)
+    writes.init_app(app, db)
+    refcache.init_app(app, db)
+    events.init_app(app, db)
+    events.watch('EquipmentUse', 'equip_id', 'equipment')
+    events.watch('Equipment', 'equip_id', 'equipment')
+    sweeper.init_app(app, db)
+    jobs.init_app(app, db)
+    # small reference sets re-read by nearly every form; see refcache.py
+    refcache.register('faculty', Faculty, order_by=Faculty.member_id)
+    refcache.register('grants', GrantFund, order_by=GrantFund.grant_id)
+    refcache.register('projects', Project, order_by=Project.project_id)
+    refcache.register('members', LabMember, order_by=LabMember.member_id)
+    refcache.register('equipment', Equipment, order_by=Equipment.equip_id)
+    refcache.register('publications', Publication, order_by=Publication.pub_id)
 
     def _get_next_id(prefix, model, id_attr):
         q = model.query.filter(getattr(model, id_attr).like(f"{prefix}%")).all()
@@ -75,7 +169,7 @@ def create_app():
 
     @app.route('/members')
     def members():
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = fetch_rows(LabMember, order_by=LabMember.member_id)
         return render_template('members.html', members=members)
 
     @app.route('/projects')
@@ -110,24 +204,17 @@ def create_app():
                 grants = db.session.query(ProjectGrant, GrantFund).join(GrantFund, ProjectGrant.grant_id==GrantFund.grant_id).filter(ProjectGrant.project_id==project.project_id).all()
                 # members working on project
                 members = db.session.query(WorksOn, LabMember).join(LabMember, WorksOn.member_id==LabMember.member_id).filter(WorksOn.project_id==project.project_id).all()
-                # mentorships where both mentor and mentee work on the same project
-                mentorships = []
-                try:
-                    member_ids = {m.member_id for wo, m in members}
-                    if member_ids:
-                        ms = Mentorship.query.filter(Mentorship.mentor_id.in_(member_ids), Mentorship.mentee_id.in_(member_ids)).all()
-                        for mt in ms:
-                            try:
-                                mentor = db.session.get(LabMember, mt.mentor_id)
-                            except Exception:
-                                mentor = None
-                            try:
-                                mentee = db.session.get(LabMember, mt.mentee_id)
-                            except Exception:
-                                mentee = None
-                            mentorships.append({'mentor': mentor, 'mentee': mentee, 'start_date': mt.start_date, 'end_date': mt.end_date, 'notes': mt.notes})
-                except Exception:
-                    mentorships = []
+                # mentorships where both mentor and mentee work on the same project, in one query
+                mentor, mentee = aliased(LabMember), aliased(LabMember)
+                mentor_wo, mentee_wo = aliased(WorksOn), aliased(WorksOn)
+                rows = (db.session.query(Mentorship, mentor, mentee)
+                        .join(mentor_wo, (mentor_wo.member_id == Mentorship.mentor_id) & (mentor_wo.project_id == project.project_id))
+                        .join(mentee_wo, (mentee_wo.member_id == Mentorship.mentee_id) & (mentee_wo.project_id == project.project_id))
+                        .outerjoin(mentor, mentor.member_id == Mentorship.mentor_id)
+                        .outerjoin(mentee, mentee.member_id == Mentorship.mentee_id)
+                        .order_by(Mentorship.mentor_id, Mentorship.mentee_id).all())
+                mentorships = [{'mentor': mr, 'mentee': me, 'start_date': mt.start_date, 'end_date': mt.end_date, 'notes': mt.notes}
+                               for mt, mr, me in rows]
         return render_template('project_status.html', project=project, grants=grants, members=members, mentorships=mentorships)
 
     @app.route('/project/status')
@@ -156,6 +243,22 @@ def create_app():
             active = (p.status == 'active')
         return jsonify({'project_id': p.project_id, 'status': p.status, 'active': bool(active)})
 
+    @app.route('/project/status/batch', methods=['GET', 'POST'])
+    @read_only
+    def project_status_batch():
+        # many projects x many instants in one request; see timeline.py
+        body = request.get_json(silent=True) if request.method == 'POST' else None
+        if body is None:
+            body = request.args
+        elif not isinstance(body, dict):
+            return jsonify({'error': 'JSON body must be an object'}), 400
+        get = body.get
+        try:
+            return jsonify(timeline.batch(project_ids=get('project_ids'), status=get('status'), leader_id=get('leader_id'),
+                                          when=get('when'), start=get('start'), end=get('end'), step=get('step')))
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+
     @app.route('/pm/mentorship_relations')
     def pm_mentorship_relations():
         # Render the same mentorship listing as /view/mentorship so content matches
@@ -174,8 +277,8 @@ def create_app():
     # --- Project CRUD ---
     @app.route('/projects/new', methods=['GET', 'POST'])
     def project_new():
-        faculties = Faculty.query.all()
-        grants = GrantFund.query.order_by(GrantFund.grant_id).all()
+        faculties = refcache.get('faculty')
+        grants = refcache.get('grants')
         if request.method == 'POST':
             title = request.form.get('title')
             start_date = _parse_date(request.form.get('start_date') or None)
@@ -229,22 +332,15 @@ def create_app():
                     if amt < 0:
                         flash(f'Allocation amount for grant {gid} must be non-negative.', 'error')
                         return redirect(url_for('project_new'))
-                    # check against grant budget
-                    grant = db.session.get(GrantFund, gid)
-                    if grant and grant.budget is not None:
-                        # sum existing allocations for this grant
-                        existing = ProjectGrant.query.filter_by(grant_id=gid).all()
-                        existing_sum = sum([pg.amount_allocated or 0 for pg in existing])
-                        new_total = existing_sum + amt
-                        if new_total > grant.budget:
-                            flash(f'Allocation for grant {gid} would exceed its budget (budget={grant.budget}, would be {new_total}).', 'error')
-                            return redirect(url_for('project_new'))
                     pg_rows.append((gid, amt))
-                # all validations passed; persist project and ProjectGrant rows
+                # persist project and allocations; the ledger checks each grant's budget as it debits
                 db.session.add(p)
-                for gid, amt in pg_rows:
-                    pg = ProjectGrant(project_id=p.project_id, grant_id=gid, amount_allocated=amt)
-                    db.session.add(pg)
+                try:
+                    ledger.apply_allocations(project_id=p.project_id, allocations=pg_rows)
+                except ledger.BudgetExceeded as ex:
+                    db.session.rollback()
+                    flash(str(ex), 'error')
+                    return redirect(url_for('project_new'))
                 db.session.commit()
                 # ensure leader is recorded in WorksOn as leader
                 try:
@@ -266,8 +362,8 @@ def create_app():
     @app.route('/projects/<pid>/edit', methods=['GET', 'POST'])
     def project_edit(pid):
         p = Project.query.get_or_404(pid)
-        faculties = Faculty.query.all()
-        grants = GrantFund.query.order_by(GrantFund.grant_id).all()
+        faculties = refcache.get('faculty')
+        grants = refcache.get('grants')
         if request.method == 'POST':
             p.title = request.form.get('title')
             p.start_date = _parse_date(request.form.get('start_date') or None)
@@ -320,35 +416,14 @@ def create_app():
                     if amt < 0:
                         flash(f'Allocation amount for grant {gid} must be non-negative.', 'error')
                         return redirect(url_for('project_edit', pid=pid))
-                    # check against grant budget: sum of allocations excluding this project
-                    grant = db.session.get(GrantFund, gid)
-                    if grant and grant.budget is not None:
-                        existing = ProjectGrant.query.filter_by(grant_id=gid).all()
-                        existing_sum = sum([pg.amount_allocated or 0 for pg in existing if pg.project_id != p.project_id])
-                        new_total = existing_sum + amt
-                        if new_total > grant.budget:
-                            flash(f'Allocation for grant {gid} would exceed its budget (budget={grant.budget}, would be {new_total}).', 'error')
-                            return redirect(url_for('project_edit', pid=pid))
                     sel_amounts[gid] = amt
-                # persist base project changes
-                db.session.commit()
-                # synchronize ProjectGrant rows
-                existing = {pg.grant_id: pg for pg in ProjectGrant.query.filter_by(project_id=p.project_id).all()}
-                # remove unselected
-                for gid, pg in existing.items():
-                    if gid not in selected:
-                        try:
-                            db.session.delete(pg)
-                        except Exception:
-                            db.session.rollback()
-                # add/update selected
-                for gid in selected:
-                    if gid in existing:
-                        ew = existing[gid]
-                        ew.amount_allocated = sel_amounts.get(gid)
-                    else:
-                        newpg = ProjectGrant(project_id=p.project_id, grant_id=gid, amount_allocated=sel_amounts.get(gid))
-                        db.session.add(newpg)
+                # synchronize ProjectGrant rows with the project changes in one transaction
+                try:
+                    ledger.apply_allocations(project_id=p.project_id, allocations=sel_amounts.items())
+                except ledger.BudgetExceeded as ex:
+                    db.session.rollback()
+                    flash(str(ex), 'error')
+                    return redirect(url_for('project_edit', pid=pid))
                 db.session.commit()
             except Exception as ex:
                 db.session.rollback()
@@ -436,7 +511,7 @@ def create_app():
     @app.route('/grants/<string:gid>/edit', methods=['GET', 'POST'])
     def grant_edit(gid):
         g = GrantFund.query.get_or_404(gid)
-        projects = Project.query.order_by(Project.project_id).all()
+        projects = refcache.get('projects')
         if request.method == 'POST':
             source = request.form.get('source')
             budget = request.form.get('budget')
@@ -481,29 +556,17 @@ def create_app():
                 if budget_f is not None and total_alloc > budget_f:
                     flash(f'Total allocation to projects ({total_alloc}) exceeds grant budget ({budget_f}).', 'error')
                     return redirect(url_for('grant_edit', gid=gid))
-                # persist changes
+                # persist changes and synchronize ProjectGrant rows in one transaction
                 g.source = source
                 g.budget = budget_f
                 g.start_date = start_date
                 g.duration = duration_i
-                db.session.commit()
-                # synchronize ProjectGrant rows
-                existing = {pg.project_id: pg for pg in ProjectGrant.query.filter_by(grant_id=g.grant_id).all()}
-                selected = set(project_ids)
-                # remove unselected
-                for pid, pg in existing.items():
-                    if pid not in selected:
-                        try:
-                            db.session.delete(pg)
-                        except Exception:
-                            db.session.rollback()
-                # add/update selected
-                for pid, amt in allocs:
-                    if pid in existing:
-                        existing[pid].amount_allocated = amt
-                    else:
-                        newpg = ProjectGrant(project_id=pid, grant_id=g.grant_id, amount_allocated=amt)
-                        db.session.add(newpg)
+                try:
+                    ledger.apply_allocations(grant_id=g.grant_id, allocations=allocs)
+                except ledger.BudgetExceeded as ex:
+                    db.session.rollback()
+                    flash(str(ex), 'error')
+                    return redirect(url_for('grant_edit', gid=gid))
                 db.session.commit()
                 flash('Grant updated.', 'success')
                 return redirect(url_for('grants'))
@@ -533,7 +596,7 @@ def create_app():
 
     @app.route('/grants/new', methods=['GET', 'POST'])
     def grant_new():
-        projects = Project.query.order_by(Project.project_id).all()
+        projects = refcache.get('projects')
         if request.method == 'POST':
             source = request.form.get('source')
             budget = request.form.get('budget')
@@ -583,9 +646,7 @@ def create_app():
                 gid = _get_next_id('G', GrantFund, 'grant_id')
                 g = GrantFund(grant_id=gid, source=source, budget=budget_f, start_date=start_date, duration=duration_i)
                 db.session.add(g)
-                for pid, amt in allocs:
-                    pg = ProjectGrant(project_id=pid, grant_id=gid, amount_allocated=amt)
-                    db.session.add(pg)
+                ledger.apply_allocations(grant_id=gid, allocations=allocs)
                 db.session.commit()
                 flash('Grant created and assigned to projects.', 'success')
                 return redirect(url_for('grants'))
@@ -597,12 +658,12 @@ def create_app():
 
     @app.route('/publications')
     def publications():
-        pubs = Publication.query.order_by(Publication.pub_id).all()
+        pubs = fetch_rows(Publication, order_by=Publication.pub_id)
         return render_template('publications.html', pubs=pubs)
 
     @app.route('/publications/new', methods=['GET', 'POST'])
     def publication_new():
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = refcache.get('members')
         if request.method == 'POST':
             title = request.form.get('title')
             pub_date = _parse_date(request.form.get('pub_date') or None)
@@ -645,7 +706,7 @@ def create_app():
     @app.route('/publications/<string:pid>/edit', methods=['GET', 'POST'])
     def publication_edit(pid):
         p = Publication.query.get_or_404(pid)
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = refcache.get('members')
         # load existing authorship to prefill
         existing = Authorship.query.filter_by(pub_id=pid).order_by(Authorship.author_order).all()
         existing_ids = [a.member_id for a in existing]
@@ -706,7 +767,7 @@ def create_app():
     # --- Member CRUD ---
     @app.route('/members/new', methods=['GET', 'POST'])
     def member_new():
-        projects = Project.query.order_by(Project.project_id).all()
+        projects = refcache.get('projects')
         if request.method == 'POST':
             name = request.form.get('name')
             member_type = request.form.get('member_type')
@@ -956,7 +1017,7 @@ def create_app():
             subtype['organization'] = collaborator.organization
             subtype['contact_info'] = collaborator.contact_info
             subtype['biography'] = collaborator.biography
-        projects = Project.query.order_by(Project.project_id).all()
+        projects = refcache.get('projects')
         # prepare existing WorksOn mapping for template
         workson = {wo.project_id: {'role': wo.role, 'weekly_hours': wo.weekly_hours} for wo in WorksOn.query.filter_by(member_id=mid).all()}
         return render_template('member_form.html', member=m, subtype=subtype, projects=projects, workson=workson)
@@ -977,6 +1038,7 @@ def create_app():
             # delete works-on, equipment use, authorship, mentorship rows referencing this member
             WorksOn.query.filter_by(member_id=mid).delete()
             EquipmentUse.query.filter_by(member_id=mid).delete()
+            EquipmentUseArchive.query.filter_by(member_id=mid).delete()
             Authorship.query.filter_by(member_id=mid).delete()
             # mentorship: delete rows where member is mentor or mentee
             Mentorship.query.filter((Mentorship.mentor_id == mid) | (Mentorship.mentee_id == mid)).delete(synchronize_session=False)
@@ -997,8 +1059,8 @@ def create_app():
 
     @app.route('/equipmentuse/new', methods=['GET', 'POST'])
     def equipment_use_new():
-        members = LabMember.query.all()
-        equipment_list = Equipment.query.all()
+        members = refcache.get('members')
+        equipment_list = refcache.get('equipment')
         if request.method == 'POST':
             equip_id = request.form.get('equip_id')
             member_id = request.form.get('member_id')
@@ -1009,18 +1071,13 @@ def create_app():
             if not (equip_id and member_id and use_start and use_end and purpose):
                 flash('All equipment-use fields are required.', 'error')
                 return redirect(url_for('equipment_use_new'))
-            # check overlapping uses: max 3 concurrent users
+            start_ts = to_epoch(use_start)
+            end_ts = to_epoch(use_end)
+            # check overlapping uses: max 3 concurrent users (index range scan on the epoch columns)
             try:
-                from sqlalchemy import or_
-                cond1 = or_(EquipmentUse.use_end == None, EquipmentUse.use_end >= use_start) if use_start else True
-                cond2 = or_(use_end == None, EquipmentUse.use_start <= use_end) if use_end else True
-                # build query carefully depending on which dates provided
-                q = EquipmentUse.query.filter(EquipmentUse.equip_id == equip_id)
-                if use_start:
-                    q = q.filter(or_(EquipmentUse.use_end == None, EquipmentUse.use_end >= use_start))
-                if use_end:
-                    q = q.filter(EquipmentUse.use_start <= use_end)
-                overlapping = q.count()
+                overlapping = db.session.scalar(
+                    select(func.count()).select_from(EquipmentUse)
+                    .where(EquipmentUse.equip_id == equip_id, EquipmentUse.use_end_ts >= start_ts, EquipmentUse.use_start_ts <= end_ts))
             except Exception:
                 overlapping = 0
             if overlapping >= 3:
@@ -1028,29 +1085,16 @@ def create_app():
                 return redirect(url_for('equipment_use_new'))
             # prevent same member from having overlapping or multiple bookings on same day for same equipment
             try:
-                existing = EquipmentUse.query.filter_by(equip_id=equip_id, member_id=member_id).all()
-                for ex in existing:
-                    if ex.use_start is None:
-                        flash('You already have an open booking for this equipment.', 'error')
-                        return redirect(url_for('equipment_use_new'))
-                    # if both have start/end, check overlap
-                    if use_start and use_end and ex.use_start and ex.use_end:
-                        if not (ex.use_end < use_start or ex.use_start > use_end):
-                            flash('Conflict: you already have an overlapping booking for this equipment.', 'error')
-                            return redirect(url_for('equipment_use_new'))
-                    # same calendar day conflict (existing booking on same day)
-                    try:
-                        if use_start and ex.use_start and ex.use_start.date() == use_start.date():
-                            flash('Conflict: you already have a booking for this equipment on the same day.', 'error')
-                            return redirect(url_for('equipment_use_new'))
-                        if use_end and ex.use_end and ex.use_end.date() == use_end.date():
-                            flash('Conflict: you already have a booking for this equipment on the same day.', 'error')
-                            return redirect(url_for('equipment_use_new'))
-                    except Exception:
-                        pass
+                overlap_cnt, same_day_cnt, _ = _member_booking_conflicts(equip_id, member_id, start_ts, end_ts)
             except Exception:
-                pass
-            use_id = _get_next_id('U', EquipmentUse, 'use_id')
+                overlap_cnt, same_day_cnt = 0, 0
+            if overlap_cnt:
+                flash('Conflict: you already have an overlapping booking for this equipment.', 'error')
+                return redirect(url_for('equipment_use_new'))
+            if same_day_cnt:
+                flash('Conflict: you already have a booking for this equipment on the same day.', 'error')
+                return redirect(url_for('equipment_use_new'))
+            use_id = f'U{batch.next_use_number()}'
             eu = EquipmentUse(use_id=use_id, equip_id=equip_id, member_id=member_id, use_start=use_start, use_end=use_end, purpose=purpose)
             try:
                 db.session.add(eu)
@@ -1069,18 +1113,90 @@ def create_app():
         end = request.args.get('end')
         use_start = _parse_datetime(start)
         use_end = _parse_datetime(end)
+        if not (use_start or use_end):
+            # right now: one primary-key read of EquipmentOccupancy
+            occ = occupancy.current([equip_id]).get(equip_id) if equip_id else None
+            overlapping = occ.active_count if occ else 0
+            return jsonify({'equip_id': equip_id, 'overlapping': overlapping, 'available': overlapping < occupancy.LIMIT, 'limit': occupancy.LIMIT})
         try:
-            q = EquipmentUse.query.filter(EquipmentUse.equip_id == equip_id)
+            q = select(func.count()).select_from(EquipmentUse).where(EquipmentUse.equip_id == equip_id)
             if use_start:
-                q = q.filter((EquipmentUse.use_end == None) | (EquipmentUse.use_end >= use_start))
+                q = q.where(EquipmentUse.use_end_ts >= to_epoch(use_start))
             if use_end:
-                q = q.filter(EquipmentUse.use_start <= use_end)
-            overlapping = q.count()
+                q = q.where(EquipmentUse.use_start_ts <= to_epoch(use_end))
+            overlapping = db.session.scalar(q)
         except Exception:
             overlapping = 0
         available = overlapping < 3
         return jsonify({'equip_id': equip_id, 'overlapping': overlapping, 'available': available, 'limit': 3})
 
+    @app.route('/equipment/stream')
+    def equipment_stream():
+        # Server-Sent Events: a "snapshot" of every subscribed equipment on connect
+        # (and after a dropped event), then "occupancy" whenever one of them changes,
+        # either through a commit or because a booking starts or ends
+        equip_ids = [e for e in (request.args.get('ids') or '').split(',') if e]
+        try:
+            sub = events.subscribe('equipment', equip_ids)
+        except TooManySubscribers:
+            return 'Too many live connections, please retry shortly.', 503, {'Retry-After': '5'}
+        heartbeat = app.config['EVENTS_HEARTBEAT']
+
+        def read(ids):
+            try:
+                return occupancy.current(ids)
+            finally:
+                # don't hold a read transaction open between events
+                db.session.rollback()
+
+        def encode(kind, eid, occ):
+            data = {'equip_id': eid, 'status': occ.status, 'overlapping': occ.active_count,
+                    'available': occ.active_count < occupancy.LIMIT, 'limit': occupancy.LIMIT}
+            return f'event: {kind}\ndata: {json.dumps(data)}\n\n'
+
+        def next_change(state):
+            pending = [o.valid_until for o in state.values() if o.valid_until is not None]
+            return min(pending) if pending else None
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+                state = read(equip_ids)
+                for eid, st in state.items():
+                    yield encode('snapshot', eid, st)
+                while True:
+                    due = next_change(state)
+                    timeout = heartbeat if due is None else min(heartbeat, due - occupancy.now_ts())
+                    keys = sub.wait(timeout)
+                    if sub.overflowed:
+                        sub.overflowed = False
+                        state = read(equip_ids)
+                        for eid, st in state.items():
+                            yield encode('snapshot', eid, st)
+                        continue
+                    now_due = due is not None and occupancy.now_ts() >= due
+                    if not keys and not now_due:
+                        yield ': keepalive\n\n'
+                        continue
+                    # a booking boundary or a channel-wide event rereads everything subscribed
+                    ids = equip_ids if (now_due or None in keys) else sorted(keys)
+                    fresh = read(ids)
+                    for eid, st in fresh.items():
+                        old = state.get(eid)
+                        if old is None or (old.status, old.active_count) != (st.status, st.active_count):
+                            yield encode('occupancy', eid, st)
+                    if ids is equip_ids:
+                        state = fresh
+                    else:
+                        for eid in ids:
+                            state.pop(eid, None)
+                        state.update(fresh)
+            finally:
+                events.unsubscribe(sub)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     @app.route('/equipment/member_conflicts')
     def equipment_member_conflicts():
         equip_id = request.args.get('equip_id')
@@ -1089,26 +1205,8 @@ def create_app():
         end = request.args.get('end')
         use_start = _parse_datetime(start)
         use_end = _parse_datetime(end)
-        conflicts = 0
         try:
-            existing = EquipmentUse.query.filter_by(equip_id=equip_id, member_id=member_id).all()
-            for ex in existing:
-                if ex.use_start is None:
-                    conflicts += 1
-                    continue
-                if use_start and use_end and ex.use_start and ex.use_end:
-                    if not (ex.use_end < use_start or ex.use_start > use_end):
-                        conflicts += 1
-                        continue
-                try:
-                    if use_start and ex.use_start and ex.use_start.date() == use_start.date():
-                        conflicts += 1
-                        continue
-                    if use_end and ex.use_end and ex.use_end.date() == use_end.date():
-                        conflicts += 1
-                        continue
-                except Exception:
-                    pass
+            _, _, conflicts = _member_booking_conflicts(equip_id, member_id, to_epoch(use_start), to_epoch(use_end))
         except Exception:
             conflicts = 0
         return jsonify({'conflicts': conflicts, 'allowed': conflicts == 0})
@@ -1117,34 +1215,29 @@ def create_app():
     def equipment_users():
         # Return currently active users for a given equipment and their projects
         equip_id = request.args.get('equip_id')
-        now = datetime.now()
         users = []
         if not equip_id:
             return jsonify({'equip_id': None, 'users': []})
         try:
-            uses = EquipmentUse.query.filter_by(equip_id=equip_id).all()
-            for u in uses:
-                try:
-                    # consider active if no end or end >= now, and start is None or start <= now
-                    active = True
-                    if u.use_end is not None and u.use_end < now:
-                        active = False
-                    if u.use_start is not None and u.use_start > now:
-                        active = False
-                    if not active:
-                        continue
-                    member = db.session.get(LabMember, u.member_id)
-                    if not member:
-                        continue
-                    # collect projects for member (include role/hours)
-                    prows = WorksOn.query.filter_by(member_id=member.member_id).all()
-                    projects = []
-                    for p in prows:
-                        proj = db.session.get(Project, p.project_id)
-                        projects.append({'project_id': p.project_id, 'title': proj.title if proj else None, 'role': p.role, 'weekly_hours': p.weekly_hours})
-                    users.append({'member_id': member.member_id, 'name': member.name, 'type': member.member_type, 'projects': projects})
-                except Exception:
-                    continue
+            # the active bookings come from the occupancy row; the rest are primary-key lookups
+            occ = occupancy.current([equip_id]).get(equip_id)
+            active = []
+            if occ and occ.active_use_ids:
+                active = db.session.execute(
+                    select(LabMember.member_id, LabMember.name, LabMember.member_type)
+                    .join(EquipmentUse, EquipmentUse.member_id == LabMember.member_id)
+                    .where(EquipmentUse.use_id.in_(occ.active_use_ids))).all()
+            # collect projects for all active members (include role/hours) in one query
+            projects_by_member = {}
+            if active:
+                prows = db.session.execute(
+                    select(WorksOn.member_id, WorksOn.project_id, Project.title, WorksOn.role, WorksOn.weekly_hours)
+                    .outerjoin(Project, Project.project_id == WorksOn.project_id)
+                    .where(WorksOn.member_id.in_({r.member_id for r in active}))).all()
+                for p in prows:
+                    projects_by_member.setdefault(p.member_id, []).append({'project_id': p.project_id, 'title': p.title, 'role': p.role, 'weekly_hours': p.weekly_hours})
+            for r in active:
+                users.append({'member_id': r.member_id, 'name': r.name, 'type': r.member_type, 'projects': projects_by_member.get(r.member_id, [])})
         except Exception:
             return jsonify({'equip_id': equip_id, 'users': []}), 200
         return jsonify({'equip_id': equip_id, 'users': users})
@@ -1162,63 +1255,46 @@ def create_app():
         now = datetime.now()
         current_uses = []
         try:
-            uses = EquipmentUse.query.filter_by(member_id=mid).all()
+            wos = db.session.execute(
+                select(WorksOn.project_id, WorksOn.role, WorksOn.weekly_hours, Project.title, Project.start_ts, Project.end_ts)
+                .outerjoin(Project, Project.project_id == WorksOn.project_id)
+                .where(WorksOn.member_id == mid)).all()
+        except Exception:
+            wos = []
+        try:
+            now_ts = to_epoch(now)
+            uses = db.session.execute(
+                select(EquipmentUse.use_id, EquipmentUse.equip_id, EquipmentUse.use_start_ts, EquipmentUse.use_end_ts, Equipment.name)
+                .outerjoin(Equipment, Equipment.equip_id == EquipmentUse.equip_id)
+                .where(EquipmentUse.member_id == mid, EquipmentUse.use_end_ts >= now_ts, EquipmentUse.use_start_ts <= now_ts)).all()
             for u in uses:
-                active = True
-                if u.use_end is not None and u.use_end < now:
-                    active = False
-                if u.use_start is not None and u.use_start > now:
-                    active = False
-                if not active:
-                    continue
-                equip = db.session.get(Equipment, u.equip_id)
-                # try to match this use to one of the member's projects by overlapping dates
+                # match this use to the first of the member's projects whose dates overlap it (day granularity)
                 matched_proj_id = None
                 matched_proj_name = None
-                try:
-                    wos = WorksOn.query.filter_by(member_id=mid).all()
-                    for wo in wos:
-                        proj = db.session.get(Project, wo.project_id)
-                        if not proj:
-                            continue
-                        # if use has start/end, compare with project start/end
-                        try:
-                            use_s = u.use_start
-                            use_e = u.use_end
-                            p_s = proj.start_date
-                            p_e = proj.end_date
-                            overlap = False
-                            if use_s and p_s and use_s.date() < p_s:
-                                # use starts before project starts -> no overlap by this check
-                                pass
-                            # general overlap check using available dates
-                            if use_s and p_e and use_s.date() <= p_e:
-                                overlap = True
-                            if use_e and p_s and use_e.date() >= p_s:
-                                overlap = True
-                            # if project has no dates or use has no dates, accept as potential match
-                            if (p_s is None and p_e is None) or (use_s is None and use_e is None):
-                                overlap = True
-                            if overlap:
-                                matched_proj_id = wo.project_id
-                                matched_proj_name = proj.title
-                                break
-                        except Exception:
-                            continue
-                except Exception:
-                    pass
-                current_uses.append({'use_id': u.use_id, 'equip_id': u.equip_id, 'equip_name': equip.name if equip else None, 'project_id': matched_proj_id, 'project_name': matched_proj_name})
+                use_s_day = u.use_start_ts // DAY_SECONDS if u.use_start_ts is not None else None
+                use_e_day = u.use_end_ts // DAY_SECONDS if u.use_end_ts != OPEN_END_TS else None
+                for wo in wos:
+                    if wo.title is None:
+                        continue
+                    p_s_day = wo.start_ts // DAY_SECONDS if wo.start_ts is not None else None
+                    p_e_day = wo.end_ts // DAY_SECONDS if wo.end_ts != OPEN_END_TS else None
+                    overlap = False
+                    if use_s_day is not None and p_e_day is not None and use_s_day <= p_e_day:
+                        overlap = True
+                    if use_e_day is not None and p_s_day is not None and use_e_day >= p_s_day:
+                        overlap = True
+                    # if project has no dates or use has no dates, accept as potential match
+                    if (p_s_day is None and p_e_day is None) or (use_s_day is None and use_e_day is None):
+                        overlap = True
+                    if overlap:
+                        matched_proj_id = wo.project_id
+                        matched_proj_name = wo.title
+                        break
+                current_uses.append({'use_id': u.use_id, 'equip_id': u.equip_id, 'equip_name': u.name, 'project_id': matched_proj_id, 'project_name': matched_proj_name})
         except Exception:
             current_uses = []
         # include projects the member currently works on (WorksOn)
-        projects = []
-        try:
-            wos = WorksOn.query.filter_by(member_id=mid).all()
-            for wo in wos:
-                proj = db.session.get(Project, wo.project_id)
-                projects.append({'project_id': wo.project_id, 'title': proj.title if proj else None, 'role': wo.role, 'weekly_hours': wo.weekly_hours})
-        except Exception:
-            projects = []
+        projects = [{'project_id': wo.project_id, 'title': wo.title, 'role': wo.role, 'weekly_hours': wo.weekly_hours} for wo in wos]
         return jsonify({'member_id': m.member_id, 'name': m.name, 'type': m.member_type, 'current_uses': current_uses, 'projects': projects})
 
     @app.route('/equipmentuse/<uid>/delete', methods=['POST'])
@@ -1228,70 +1304,244 @@ def create_app():
         db.session.commit()
         return redirect(url_for('equipment'))
 
-    # Example report route: members with highest number of publications
+    # Publication and staffing reports read the in-memory analytics snapshot, see analytics.py
     @app.route('/reports/top_authors')
     def top_authors():
-        sql = '''SELECT lm.member_id, lm.name, COUNT(a.pub_id) AS pubs
-                 FROM LabMember lm
-                 JOIN Authorship a ON lm.member_id = a.member_id
-                 GROUP BY lm.member_id, lm.name
-                 ORDER BY pubs DESC
-                 LIMIT 10;'''
-        result = db.session.execute(text(sql)).fetchall()
-        return render_template('reports_top_authors.html', rows=result)
+        return render_template('reports_top_authors.html', rows=analytics.top_authors())
 
     # Average student publications per major
     @app.route('/reports/avg_student_pubs')
     def avg_student_pubs():
-        sql = '''SELECT t.major, AVG(t.cnt) as avg_pubs FROM (
-                    SELECT st.member_id as member_id, st.major as major, COUNT(a.pub_id) as cnt
-                    FROM Student st
-                    LEFT JOIN Authorship a ON st.member_id = a.member_id
-                    GROUP BY st.member_id, st.major
-                 ) as t GROUP BY t.major;'''
-        result = db.session.execute(text(sql)).fetchall()
-        return render_template('reports_avg_student_pubs.html', rows=result)
+        return render_template('reports_avg_student_pubs.html', rows=analytics.avg_student_pubs())
 
     @app.route('/reports/avg_student_pubs.json')
     def avg_student_pubs_json():
-        sql = '''SELECT t.major, AVG(t.cnt) as avg_pubs FROM (
-                    SELECT st.member_id as member_id, st.major as major, COUNT(a.pub_id) as cnt
-                    FROM Student st
-                    LEFT JOIN Authorship a ON st.member_id = a.member_id
-                    GROUP BY st.member_id, st.major
-                 ) as t GROUP BY t.major;'''
-        rows = db.session.execute(text(sql)).fetchall()
-        data = [{'major': r[0], 'avg_pubs': float(r[1]) if r[1] is not None else 0.0} for r in rows]
-        return jsonify({'rows': data})
+        return jsonify({'rows': analytics.avg_student_pubs()})
 
     # Number of projects funded by a grant and active during a given period (params: start, end)
     @app.route('/reports/projects_active')
     def projects_active():
         start = request.args.get('start') or '2022-01-01'
         end = request.args.get('end') or '2023-12-31'
-        sql = '''SELECT COUNT(DISTINCT p.project_id) AS count_projects
-                 FROM Project p
-                 JOIN ProjectGrant pg ON p.project_id = pg.project_id
-                 WHERE NOT (p.end_date < :start OR (p.start_date > :end))
-              '''
-        result = db.session.execute(text(sql), {'start': start, 'end': end}).fetchall()
-        return render_template('reports_projects_active.html', rows=result, start=start, end=end)
+        try:
+            report, error = analytics.projects_active(start, end), None
+        except ValueError as ex:
+            report, error = None, str(ex)
+        return render_template('reports_projects_active.html', report=report, error=error, start=start, end=end)
 
     # Three most prolific members who have worked on a project funded by a given grant (grant_id param)
     @app.route('/reports/top3_for_grant')
     def top3_for_grant():
         gid = request.args.get('grant_id') or '1'
-        sql = '''SELECT lm.member_id, lm.name, COUNT(DISTINCT a.pub_id) as pubs
-                 FROM LabMember lm
-                 JOIN WorksOn w ON lm.member_id = w.member_id
-                 JOIN ProjectGrant pg ON w.project_id = pg.project_id
-                 LEFT JOIN Authorship a ON lm.member_id = a.member_id
-                 WHERE pg.grant_id = :gid
-                 GROUP BY lm.member_id, lm.name
-                 ORDER BY pubs DESC
-                 LIMIT 3;'''
-        rows = db.session.execute(text(sql), {'gid': gid}).fetchall()
-        return render_template('reports_top3_for_grant.html', rows=rows, gid=gid)
+        return render_template('reports_top3_for_grant.html', rows=analytics.top_for_grant(gid), gid=gid)
+
+    # Publications, authorships or authors by up to three dimensions (params: by, measure)
+    def _breakdown_report():
+        dims = [d for d in (request.args.get('by') or 'year').split(',') if d]
+        return analytics.breakdown(dims, request.args.get('measure') or 'publications')
+
+    @app.route('/reports/breakdown')
+    def publication_breakdown():
+        try:
+            report, error = _breakdown_report(), None
+        except ValueError as ex:
+            report, error = None, str(ex)
+        return render_template('reports_breakdown.html', report=report, error=error,
+                               dimensions=list(analytics.DIMENSIONS), measures=analytics.MEASURES)
+
+    @app.route('/reports/breakdown.json')
+    def publication_breakdown_json():
+        try:
+            return jsonify(_breakdown_report())
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+
+    # The report pages queue a background job and show its progress page, which
+    # turns into the report when it is done (?inline=1 computes in the request
+    # instead). The .json routes compute inline unless given ?background=1. See jobs.py
+    REPORT_PAGES = {'equipment_utilization': 'reports_equipment_utilization.html',
+                    'collaboration': 'reports_collaboration.html',
+                    'grant_burndown': 'reports_grant_burndown.html'}
+
+    def _report_params():
+        return {k: v for k, v in request.args.items() if k not in ('background', 'inline')}
+
+    def _job_accepted(kind, params=None):
+        try:
+            job = jobs.submit(kind, _report_params() if params is None else params)
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+        resp = jsonify(job)
+        resp.status_code = 202
+        resp.headers['Location'] = url_for('job_status_json', job_id=job['job_id'])
+        return resp
+
+    def _job_page(kind):
+        try:
+            job = jobs.submit(kind, _report_params())
+        except ValueError as ex:
+            return render_template(REPORT_PAGES[kind], report=None, error=str(ex), limit=utilization.LIMIT)
+        return redirect(url_for('job_status', job_id=job['job_id']))
+
+    @app.route('/jobs')
+    def jobs_list():
+        return render_template('jobs.html', jobs=jobs.list(), kinds=sorted(JOB_KINDS))
+
+    @app.route('/jobs.json')
+    def jobs_list_json():
+        return jsonify({'jobs': jobs.list()})
+
+    @app.route('/jobs', methods=['POST'])
+    def job_submit():
+        # JSON {"kind": ..., "params": {...}}, or the form on /jobs
+        if request.is_json:
+            body = request.get_json(silent=True) or {}
+            if not isinstance(body, dict) or not isinstance(body.get('params', {}), dict):
+                return jsonify({'error': 'expected {"kind": ..., "params": {...}}'}), 400
+            return _job_accepted(body.get('kind'), body.get('params') or {})
+        params = {k: v for k, v in request.form.items() if k != 'kind' and v}
+        try:
+            job = jobs.submit(request.form.get('kind'), params)
+        except ValueError as ex:
+            flash(str(ex), 'error')
+            return redirect(url_for('jobs_list'))
+        return redirect(url_for('job_status', job_id=job['job_id']))
+
+    @app.route('/jobs/<string:job_id>')
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            flash('Job not found', 'error')
+            return redirect(url_for('jobs_list'))
+        page = REPORT_PAGES.get(job['kind'])
+        found = jobs.result(job) if page else None
+        if found is not None:
+            # a finished report is shown on its own page
+            with open(os.path.join(found[0], found[1])) as f:
+                report = json.load(f)
+            return render_template(page, report=report, error=None, job=job, limit=utilization.LIMIT)
+        return render_template('job_status.html', job=job)
+
+    @app.route('/jobs/<string:job_id>.json')
+    def job_status_json(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': f'unknown job {job_id}'}), 404
+        if job['has_result']:
+            job['result_url'] = url_for('job_result', job_id=job_id)
+        return jsonify(job)
+
+    @app.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+    def job_cancel(job_id):
+        if jobs.get(job_id) is None:
+            return jsonify({'error': f'unknown job {job_id}'}), 404
+        job = jobs.cancel(job_id)
+        if request.is_json or request.accept_mimetypes.best == 'application/json':
+            return jsonify(job)
+        return redirect(url_for('job_status', job_id=job_id))
+
+    @app.route('/jobs/<string:job_id>/result')
+    def job_result(job_id):
+        job = jobs.get(job_id)
+        found = jobs.result(job) if job is not None else None
+        if found is None:
+            return jsonify({'error': 'no result for this job'}), 404
+        directory, name, mimetype = found
+        return send_from_directory(directory, name, mimetype=mimetype, as_attachment=True,
+                                   download_name=f'{job["kind"]}_{job_id[:8]}.{name.rsplit(".", 1)[-1]}')
+
+    # Utilization, peak concurrency and idle time per equipment (params: start, end, equip_ids, bucket)
+    def _utilization_report():
+        equip_ids = [e for e in (request.args.get('equip_ids') or '').split(',') if e]
+        start_d, end_d = utilization.parse_range(request.args.get('start'), request.args.get('end'))
+        equipment = [(e.equip_id, e.name) for e in refcache.get('equipment')]
+        return utilization.report(start_d, end_d, equip_ids, request.args.get('bucket') or 'day', equipment=equipment)
+
+    @app.route('/reports/equipment_utilization')
+    def equipment_utilization():
+        if not request.args.get('inline'):
+            return _job_page('equipment_utilization')
+        try:
+            report, error = _utilization_report(), None
+        except ValueError as ex:
+            report, error = None, str(ex)
+        return render_template('reports_equipment_utilization.html', report=report, error=error, limit=utilization.LIMIT)
+
+    @app.route('/reports/equipment_utilization.json')
+    def equipment_utilization_json():
+        if request.args.get('background'):
+            return _job_accepted('equipment_utilization')
+        try:
+            return jsonify(_utilization_report())
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+
+    def _collaboration_report():
+        def year(name):
+            value = request.args.get(name)
+            if not value:
+                return None
+            if not value.isdigit():
+                raise ValueError(f'{name} must be a year')
+            return int(value)
+        names = {m.member_id: m.name for m in refcache.get('members')}
+        return collaboration.report(year('start'), year('end'), int(request.args.get('k') or 5), names=names)
+
+    @app.route('/reports/collaboration')
+    def collaboration_report():
+        if not request.args.get('inline'):
+            return _job_page('collaboration')
+        try:
+            report, error = _collaboration_report(), None
+        except ValueError as ex:
+            report, error = None, str(ex)
+        return render_template('reports_collaboration.html', report=report, error=error)
+
+    @app.route('/reports/collaboration.json')
+    def collaboration_report_json():
+        if request.args.get('background'):
+            return _job_accepted('collaboration')
+        try:
+            return jsonify(_collaboration_report())
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+
+    def _burndown_report():
+        first, last = burndown.parse_range(request.args.get('start'), request.args.get('end'))
+        grant_ids = [g if g.startswith('G') or not g.isdigit() else f'G{g}'
+                     for g in (request.args.get('grant_ids') or '').split(',') if g]
+        within = request.args.get('ending_within') or burndown.DEFAULT_ENDING_WITHIN
+        if not str(within).isdigit():
+            raise ValueError('ending_within must be a number of days')
+        return burndown.report(first, last, grant_ids, int(within))
+
+    @app.route('/reports/grant_burndown')
+    def grant_burndown():
+        if not request.args.get('inline'):
+            return _job_page('grant_burndown')
+        try:
+            report, error = _burndown_report(), None
+        except ValueError as ex:
+            report, error = None, str(ex)
+        return render_template('reports_grant_burndown.html', report=report, error=error)
+
+    @app.route('/reports/grant_burndown.json')
+    def grant_burndown_json():
+        if request.args.get('background'):
+            return _job_accepted('grant_burndown')
+        try:
+            return jsonify(_burndown_report())
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+
+    @app.route('/reports/grant_burndown.csv')
+    def grant_burndown_csv():
+        try:
+            report = _burndown_report()
+        except ValueError as ex:
+            return Response(f'error: {ex}\n', status=400, mimetype='text/plain')
+        return Response(burndown.to_csv(report), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename=grant_burndown_{report["start"]}_{report["end"]}.csv'})
 
     # --- Additional DF navigation and admin views ---
     @app.route('/member-project-manager')
@@ -1318,13 +1568,10 @@ def create_app():
 
     @app.route('/equipment-usage-tracking')
     def equipment_usage_tracking():
-        uses = EquipmentUse.query.order_by(EquipmentUse.use_start.desc()).all()
-        for u in uses:
-            try:
-                u.member = db.session.get(LabMember, u.member_id)
-            except Exception:
-                u.member = None
-        return render_template('equipment_usage_tracking.html', uses=uses)
+        # full history: hot bookings plus those moved to EquipmentUseArchive
+        h = equipment_use_history.c
+        uses = iter_rows(select(h.use_id, h.equip_id, h.member_id, h.use_start, h.use_end, h.purpose, h.archived).order_by(h.use_start.desc()))
+        return stream_page('equipment_usage_tracking.html', uses=uses)
 
     @app.route('/grant-publication-reporting')
     def grant_publication_reporting():
@@ -1346,40 +1593,29 @@ def create_app():
                 gid = f'G{gid}'
             grant = db.session.get(GrantFund, gid)
             if grant:
-                pgs = ProjectGrant.query.filter_by(grant_id=gid).all()
-                for pg in pgs:
-                    proj = db.session.get(Project, pg.project_id)
-                    # find members working on this project
-                    members = []
-                    wos = WorksOn.query.filter_by(project_id=pg.project_id).all()
-                    for wo in wos:
-                        member = db.session.get(LabMember, wo.member_id)
-                        members.append({'member': member, 'role': wo.role, 'weekly_hours': wo.weekly_hours})
-                    projects.append({'project': proj, 'amount': pg.amount_allocated, 'members': members})
-                # compute number of funded projects active in given period
+                pgs = db.session.query(ProjectGrant, Project).outerjoin(Project, Project.project_id == ProjectGrant.project_id).filter(ProjectGrant.grant_id == gid).all()
+                # members working on any of these projects, fetched in one query
+                members_by_project = {}
+                if pgs:
+                    rows = db.session.query(WorksOn, LabMember).outerjoin(LabMember, LabMember.member_id == WorksOn.member_id).filter(WorksOn.project_id.in_({pg.project_id for pg, _ in pgs})).all()
+                    for wo, member in rows:
+                        members_by_project.setdefault(wo.project_id, []).append({'member': member, 'role': wo.role, 'weekly_hours': wo.weekly_hours})
+                for pg, proj in pgs:
+                    projects.append({'project': proj, 'amount': pg.amount_allocated, 'members': members_by_project.get(pg.project_id, [])})
+                # compute number of funded projects active in given period (overlap on the epoch columns)
                 if start_date or end_date:
-                    cnt = 0
-                    for pg in pgs:
-                        proj = db.session.get(Project, pg.project_id)
-                        if not proj:
-                            continue
-                        # project active if NOT (proj.end_date < start OR proj.start_date > end)
-                        active = True
-                        try:
-                            if start_date and proj.end_date and proj.end_date < start_date:
-                                active = False
-                            if end_date and proj.start_date and proj.start_date > end_date:
-                                active = False
-                        except Exception:
-                            pass
-                        if active:
-                            cnt += 1
-                    active_count = cnt
-        return render_template('grant_status.html', grant=grant, projects=projects, query_gid=gid)
+                    q = select(func.count()).select_from(ProjectGrant).join(Project, Project.project_id == ProjectGrant.project_id).where(ProjectGrant.grant_id == gid)
+                    if start_date:
+                        q = q.where(Project.end_ts >= to_epoch(start_date))
+                    if end_date:
+                        q = q.where(Project.start_ts <= to_epoch(end_date))
+                    active_count = db.session.scalar(q)
+        return render_template('grant_status.html', grant=grant, projects=projects, query_gid=gid, active_count=active_count)
 
     @app.route('/admin/sql', methods=['GET', 'POST'])
     def sql_editor():
         result = None
+        has_rows = False
         columns = []
         message = None
         sql = ''
@@ -1393,10 +1629,13 @@ def create_app():
                     s = sql.strip()
                     # If SELECT statement (read), fetch rows and display
                     if s.lower().startswith('select'):
+                        # rows are streamed into the page as they come off the cursor
+                        mark_read_only()
                         res = db.session.execute(text(s))
-                        rows = res.fetchall()
-                        columns = res.keys()
-                        result = rows
+                        columns = list(res.keys())
+                        first = res.fetchone()
+                        has_rows = first is not None
+                        result = itertools.chain([first], res) if has_rows else iter(())
                     else:
                             # Intercept deletes of LabMember to perform cascading deletes safely
                             m = re.findall(r"delete\s+from\s+labmember\s+where\s+member_id\s*=\s*['\"]?([^'\"\s;]+)['\"]?", s, re.I)
@@ -1413,6 +1652,7 @@ def create_app():
                                         Collaborator.query.filter_by(member_id=mid).delete()
                                         WorksOn.query.filter_by(member_id=mid).delete()
                                         EquipmentUse.query.filter_by(member_id=mid).delete()
+                                        EquipmentUseArchive.query.filter_by(member_id=mid).delete()
                                         Authorship.query.filter_by(member_id=mid).delete()
                                         Mentorship.query.filter((Mentorship.mentor_id == mid) | (Mentorship.mentee_id == mid)).delete(synchronize_session=False)
                                         lm = db.session.get(LabMember, mid)
@@ -1434,6 +1674,8 @@ def create_app():
                                     cur = conn.cursor()
                                     cur.executescript(sql)
                                     conn.commit()
+                                    # raw SQL bypasses the session hooks; drop every cached reference set
+                                    refcache.invalidate()
                                     message = 'SQL executed successfully.'
                                 finally:
                                     if conn:
@@ -1445,7 +1687,7 @@ def create_app():
                     except Exception:
                         pass
                     error = str(ex)
-        return render_template('sql_editor.html', sql=sql, result=result, columns=columns, message=message, error=error)
+        return stream_page('sql_editor.html', sql=sql, result=result, has_rows=has_rows, columns=columns, message=message, error=error)
 
     @app.route('/all')
     def all_page():
@@ -1454,22 +1696,22 @@ def create_app():
     # All Tables View Routes (DF)
     @app.route('/view/members')
     def view_all_members():
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = fetch_rows(LabMember, order_by=LabMember.member_id)
         return render_template('members.html', members=members)
 
     @app.route('/view/faculty')
     def view_faculty():
-        faculty = Faculty.query.order_by(Faculty.member_id).all()
+        faculty = fetch_rows(Faculty, order_by=Faculty.member_id)
         return render_template('view_faculty.html', faculty=faculty)
 
     @app.route('/view/students')
     def view_students():
-        students = Student.query.order_by(Student.member_id).all()
+        students = fetch_rows(Student, order_by=Student.member_id)
         return render_template('view_students.html', students=students)
 
     @app.route('/view/collaborators')
     def view_collaborators():
-        collaborators = Collaborator.query.order_by(Collaborator.member_id).all()
+        collaborators = fetch_rows(Collaborator, order_by=Collaborator.member_id)
         return render_template('view_collaborators.html', collaborators=collaborators)
 
     @app.route('/view/projects')
@@ -1490,8 +1732,8 @@ def create_app():
     # WorksOn CRUD
     @app.route('/workson/new', methods=['GET', 'POST'])
     def workson_new():
-        members = LabMember.query.order_by(LabMember.member_id).all()
-        projects = Project.query.order_by(Project.project_id).all()
+        members = refcache.get('members')
+        projects = refcache.get('projects')
         if request.method == 'POST':
             member_id = request.form.get('member_id')
             project_id = request.form.get('project_id')
@@ -1511,8 +1753,8 @@ def create_app():
     @app.route('/workson/<string:member_id>/<string:project_id>/edit', methods=['GET', 'POST'])
     def workson_edit(member_id, project_id):
         wo = WorksOn.query.filter_by(member_id=member_id, project_id=project_id).first_or_404()
-        members = LabMember.query.order_by(LabMember.member_id).all()
-        projects = Project.query.order_by(Project.project_id).all()
+        members = refcache.get('members')
+        projects = refcache.get('projects')
         if request.method == 'POST':
             wo.role = request.form.get('role')
             wo.weekly_hours = request.form.get('weekly_hours')
@@ -1536,8 +1778,8 @@ def create_app():
 
     @app.route('/projectgrant/new', methods=['GET', 'POST'])
     def projectgrant_new():
-        projects = Project.query.order_by(Project.project_id).all()
-        grants = GrantFund.query.order_by(GrantFund.grant_id).all()
+        projects = refcache.get('projects')
+        grants = refcache.get('grants')
         if request.method == 'POST':
             project_id = request.form.get('project_id')
             grant_id = request.form.get('grant_id')
@@ -1546,8 +1788,12 @@ def create_app():
             if existing:
                 flash('This grant is already allocated to this project.', 'error')
                 return redirect(url_for('projectgrant_new'))
-            pg = ProjectGrant(project_id=project_id, grant_id=grant_id, amount_allocated=amount_allocated)
-            db.session.add(pg)
+            try:
+                ledger.reserve(project_id, grant_id, amount_allocated)
+            except ledger.BudgetExceeded as ex:
+                db.session.rollback()
+                flash(str(ex), 'error')
+                return redirect(url_for('projectgrant_new'))
             db.session.commit()
             flash(f'Grant {grant_id} allocated to project {project_id}.', 'success')
             return redirect(url_for('view_project_grant'))
@@ -1556,10 +1802,15 @@ def create_app():
     @app.route('/projectgrant/<string:project_id>/<string:grant_id>/edit', methods=['GET', 'POST'])
     def projectgrant_edit(project_id, grant_id):
         pg = ProjectGrant.query.filter_by(project_id=project_id, grant_id=grant_id).first_or_404()
-        projects = Project.query.order_by(Project.project_id).all()
-        grants = GrantFund.query.order_by(GrantFund.grant_id).all()
+        projects = refcache.get('projects')
+        grants = refcache.get('grants')
         if request.method == 'POST':
-            pg.amount_allocated = request.form.get('amount_allocated')
+            try:
+                ledger.reserve(project_id, grant_id, request.form.get('amount_allocated'))
+            except ledger.BudgetExceeded as ex:
+                db.session.rollback()
+                flash(str(ex), 'error')
+                return redirect(url_for('projectgrant_edit', project_id=project_id, grant_id=grant_id))
             db.session.commit()
             flash('Grant allocation updated.', 'success')
             return redirect(url_for('view_project_grant'))
@@ -1594,27 +1845,22 @@ def create_app():
 
     @app.route('/view/publications')
     def view_all_publications():
-        pubs = Publication.query.order_by(Publication.pub_id).all()
+        pubs = fetch_rows(Publication, order_by=Publication.pub_id)
         return render_template('publications.html', pubs=pubs)
 
     @app.route('/view/authorship')
     def view_authorship():
-        authorship = Authorship.query.order_by(Authorship.pub_id).all()
-        for a in authorship:
-            try:
-                a.member = db.session.get(LabMember, a.member_id)
-            except Exception:
-                a.member = None
-            try:
-                a.publication = db.session.get(Publication, a.pub_id)
-            except Exception:
-                a.publication = None
-        return render_template('view_authorship.html', authorship=authorship)
+        stmt = (select(Authorship.pub_id, Authorship.member_id, Authorship.author_order, Authorship.author_role,
+                       Publication.title, LabMember.name.label('member_name'))
+                .outerjoin(Publication, Publication.pub_id == Authorship.pub_id)
+                .outerjoin(LabMember, LabMember.member_id == Authorship.member_id)
+                .order_by(Authorship.pub_id))
+        return stream_page('view_authorship.html', authorship=iter_rows(stmt))
 
     @app.route('/authorship/new', methods=['GET', 'POST'])
     def authorship_new():
-        pubs = Publication.query.order_by(Publication.pub_id).all()
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        pubs = refcache.get('publications')
+        members = refcache.get('members')
         if request.method == 'POST':
             pub_id = request.form.get('pub_id')
             member_id = request.form.get('member_id')
@@ -1647,8 +1893,8 @@ def create_app():
     @app.route('/authorship/<string:pub_id>/<string:member_id>/edit', methods=['GET', 'POST'])
     def authorship_edit(pub_id, member_id):
         a = Authorship.query.filter_by(pub_id=pub_id, member_id=member_id).first_or_404()
-        pubs = Publication.query.order_by(Publication.pub_id).all()
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        pubs = refcache.get('publications')
+        members = refcache.get('members')
         if request.method == 'POST':
             try:
                 a.author_order = int(request.form.get('author_order')) if request.form.get('author_order') else None
@@ -1692,9 +1938,37 @@ def create_app():
                 m.mentee = None
         return render_template('view_mentorship.html', mentorships=mentorships)
 
+    def _lineage(member_id):
+        return {
+            'member_id': member_id,
+            'stats': lineage.stats(member_id),
+            'ancestors': [dict(r._mapping) for r in lineage.ancestors(member_id)],
+            'chains': lineage.chains(member_id),
+            'descendants': [dict(r._mapping) for r in lineage.descendants(member_id)],
+        }
+
+    @app.route('/mentorship/lineage/<string:member_id>')
+    def mentorship_lineage(member_id):
+        member = LabMember.query.get_or_404(member_id)
+        names = {m.member_id: m.name for m in refcache.get('members')}
+        return render_template('mentorship_lineage.html', member=member, lineage=_lineage(member_id), names=names)
+
+    @app.route('/mentorship/lineage/<string:member_id>.json')
+    def mentorship_lineage_json(member_id):
+        if db.session.get(LabMember, member_id) is None:
+            return jsonify({'error': f'member {member_id} not found'}), 404
+        return jsonify(_lineage(member_id))
+
+    def _mentorship_rejected(ex, back):
+        # 409 with the rule and conflicting rows for JSON clients, a flash message for the form
+        if request.is_json or request.accept_mimetypes.best == 'application/json':
+            return jsonify(ex.to_dict()), 409
+        flash(ex.message, 'error')
+        return redirect(back)
+
     @app.route('/mentorship/new', methods=['GET', 'POST'])
     def mentorship_new():
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = refcache.get('members')
         if request.method == 'POST':
             mentor_id = request.form.get('mentor_id')
             mentee_id = request.form.get('mentee_id')
@@ -1707,25 +1981,15 @@ def create_app():
             if mentor_id == mentee_id:
                 flash('Mentor and mentee cannot be the same person.', 'error')
                 return redirect(url_for('mentorship_new'))
-            existing = Mentorship.query.filter_by(mentee_id=mentee_id).all()
-            for ex in existing:
-                ex_end = ex.end_date
-                ex_start = ex.start_date
-                if not (ex_end is not None and ex_end < start_date) and not (end_date is not None and end_date < ex_start):
-                    flash(f'Mentee {mentee_id} already has a mentorship overlapping this time frame.', 'error')
-                    return redirect(url_for('mentorship_new'))
+            # overlap, cycle and mentor-type rules are checked by triggers inside the INSERT
             m = Mentorship(mentor_id=mentor_id, mentee_id=mentee_id, start_date=start_date, end_date=end_date, notes=notes)
             try:
                 db.session.add(m)
                 db.session.commit()
             except IntegrityError as ie:
                 db.session.rollback()
-                raw = str(ie.orig) if hasattr(ie, 'orig') else str(ie)
-                if 'Students cannot mentor faculty' in raw:
-                    flash(f'Students cannot mentor faculty: {mentor_id} → {mentee_id}', 'error')
-                else:
-                    flash(raw, 'error')
-                return redirect(url_for('mentorship_new'))
+                return _mentorship_rejected(constraints.mentorship_error(ie, mentor_id, mentee_id, start_date, end_date),
+                                            url_for('mentorship_new'))
             flash(f'Mentorship created: {mentor_id} → {mentee_id}.', 'success')
             return redirect(url_for('view_mentorship'))
         return render_template('mentorship_form.html', members=members, mentorship=None)
@@ -1734,7 +1998,7 @@ def create_app():
     @app.route('/mentorship/<string:mentor_id>/<string:mentee_id>/edit', methods=['GET', 'POST'])
     def mentorship_edit(mentor_id, mentee_id):
         m = Mentorship.query.filter_by(mentor_id=mentor_id, mentee_id=mentee_id).first_or_404()
-        members = LabMember.query.order_by(LabMember.member_id).all()
+        members = refcache.get('members')
         if request.method == 'POST':
             m.start_date = _parse_date(request.form.get('start_date'))
             # enforce start_date presence on edit
@@ -1747,27 +2011,15 @@ def create_app():
             if m.mentor_id == m.mentee_id:
                 flash('Mentor and mentee cannot be the same person.', 'error')
                 return redirect(url_for('mentorship_edit', mentor_id=mentor_id, mentee_id=mentee_id))
-
-            # server-side: ensure mentee doesn't have overlapping mentorships (exclude current record)
-            existing = Mentorship.query.filter(Mentorship.mentee_id == m.mentee_id).all()
-            for ex in existing:
-                if ex.mentor_id == mentor_id and ex.mentee_id == mentee_id:
-                    continue
-                ex_end = ex.end_date
-                ex_start = ex.start_date
-                if not (ex_end is not None and ex_end < m.start_date) and not (m.end_date is not None and m.end_date < ex_start):
-                    flash(f'Mentee {m.mentee_id} already has a mentorship overlapping this time frame.', 'error')
-                    return redirect(url_for('mentorship_edit', mentor_id=mentor_id, mentee_id=mentee_id))
+            # the rollback below expires m, so keep the submitted dates for the error
+            start_date, end_date = m.start_date, m.end_date
             try:
                 db.session.commit()
             except IntegrityError as ie:
                 db.session.rollback()
-                raw = str(ie.orig) if hasattr(ie, 'orig') else str(ie)
-                if 'Students cannot mentor faculty' in raw:
-                    flash(f'Students cannot mentor faculty: {m.mentor_id} → {m.mentee_id}', 'error')
-                else:
-                    flash(raw, 'error')
-                return redirect(url_for('mentorship_edit', mentor_id=mentor_id, mentee_id=mentee_id))
+                return _mentorship_rejected(
+                    constraints.mentorship_error(ie, mentor_id, mentee_id, start_date, end_date, exclude=mentor_id),
+                    url_for('mentorship_edit', mentor_id=mentor_id, mentee_id=mentee_id))
             flash('Mentorship updated.', 'success')
             return redirect(url_for('view_mentorship'))
         return render_template('mentorship_form.html', members=members, mentorship=m)
@@ -1781,7 +2033,91 @@ def create_app():
         flash('Mentorship removed.', 'success')
         return redirect(url_for('view_mentorship'))
 
-    
+    @app.route('/metrics')
+    def metrics_view():
+        data = metrics.snapshot()
+        data['refcache'] = refcache.stats()
+        return jsonify(data)
+
+    @app.route('/ready')
+    def ready():
+        # warmup state of the worker that answered, see wsgi.py; a process that was not warmed is ready
+        state = app.extensions.get('warmup')
+        body = {'ready': state is None or state['ready'], 'pid': os.getpid(), 'warmup': state}
+        return jsonify(body), 200 if body['ready'] else 503
+
+    @app.route('/changes')
+    def changes_feed():
+        # incremental sync feed over the ChangeLog, see changes.py
+        try:
+            since = int(request.args.get('since', 0))
+            limit = min(max(int(request.args.get('limit', 1000)), 1), changes.MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'since and limit must be integers'}), 400
+        tables = [t for t in (request.args.get('tables') or '').split(',') if t]
+        unknown = [t for t in tables if t not in db.metadata.tables]
+        if unknown:
+            return jsonify({'error': f'unknown tables: {", ".join(unknown)}'}), 400
+        head = changes.head()
+        pruned = changes.pruned_through()
+        if since < pruned:
+            # entries after `since` were pruned; the consumer has to resnapshot
+            return jsonify({'error': 'since is older than the retained change log', 'pruned_through': pruned, 'head': head}), 410
+
+        def generate():
+            yield f'{{"since":{since},"head":{head},"changes":['
+            last = since
+            n = 0
+            for row in changes.changes_since(since, limit, tables):
+                yield (',' if n else '') + changes.encode_change(row)
+                last = row.seq
+                n += 1
+            # a short page means the consumer has caught up to head (as of this request)
+            more = n == limit and last < head
+            yield f'],"next":{last},"more":{"true" if more else "false"}}}'
+
+        return Response(stream_with_context(generate()), mimetype='application/json', headers={'X-Change-Head': str(head)})
+
+    # Read API, see api.py
+    @app.route('/api/v1')
+    def api_index():
+        return jsonify({'resources': api.describe()})
+
+    @app.route('/api/v1/batch', methods=['POST'])
+    def api_batch():
+        # many writes in one transaction, see batch.py
+        try:
+            result, commit = batch.run(request.get_json(silent=True))
+        except ValueError as ex:
+            db.session.rollback()
+            return jsonify({'error': str(ex)}), 400
+        except IntegrityError as ie:
+            # a trigger refused a row that passed validation; nothing is written
+            db.session.rollback()
+            return jsonify({'error': str(ie.orig), 'rule': constraints.rule_of(ie)}), 409
+        if not commit:
+            db.session.rollback()
+            return jsonify(result), 409
+        db.session.commit()
+        return jsonify(result)
+
+    @app.route('/api/v1/<string:resource>')
+    def api_list(resource):
+        if resource not in api.RESOURCES:
+            return jsonify({'error': f'unknown resource {resource}'}), 404
+        # answered from the change log alone when the client already has this version
+        tag = api.etag(resource, request.args)
+        if tag in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(tag)
+            return resp
+        try:
+            resp = jsonify(api.query(resource, request.args))
+        except ValueError as ex:
+            return jsonify({'error': str(ex)}), 400
+        resp.set_etag(tag)
+        return resp
+
     @app.teardown_request
     def shutdown_session(exception=None):
         # ensure any pending changes are committed when request finishes successfully
@@ -1825,6 +2161,8 @@ def create_app():
             pass
         raise
 
+    if app.config['JINJA_PRECOMPILE']:
+        compile_templates(app)
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+# Hot/cold partitioning of EquipmentUse
+#
+# Completed bookings that ended more than `horizon_days` ago are moved in
+# small batches into EquipmentUseArchive. Each batch is its own short
+# BEGIN IMMEDIATE transaction so the app can keep writing between batches.
+# Reports that need the whole history read the EquipmentUseHistory view.
+#
+#   python -m app.archive --horizon-days 365 --batch-size 1000
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from .models import DAY_SECONDS, to_epoch
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'labmanager.db')
+DEFAULT_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', 365))
+
+_COLUMNS = 'use_id, equip_id, member_id, use_start, use_end, purpose'
+
+
+def archive_bookings(conn, horizon_days=DEFAULT_HORIZON_DAYS, batch_size=1000, now=None, max_batches=None):
+    # returns the number of bookings moved; `conn` is a sqlite3 connection
+    if horizon_days < 1:
+        raise ValueError('horizon_days must be at least 1 so archived rows cannot overlap new bookings')
+    cutoff = to_epoch(now or datetime.now()) - horizon_days * DAY_SECONDS
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # open bookings have use_end_ts = max INTEGER and are never picked
+            ids = [r[0] for r in conn.execute(
+                'SELECT use_id FROM EquipmentUse WHERE use_end_ts < ? ORDER BY use_end_ts LIMIT ?',
+                (cutoff, batch_size))]
+            if not ids:
+                conn.rollback()
+                break
+            batch = json.dumps(ids)
+            conn.execute(f'INSERT INTO EquipmentUseArchive({_COLUMNS}) '
+                         f'SELECT {_COLUMNS} FROM EquipmentUse WHERE use_id IN (SELECT value FROM json_each(?))', (batch,))
+            conn.execute('DELETE FROM EquipmentUse WHERE use_id IN (SELECT value FROM json_each(?))', (batch,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        batches += 1
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move completed EquipmentUse rows into EquipmentUseArchive')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--horizon-days', type=int, default=DEFAULT_HORIZON_DAYS,
+                        help='archive bookings that ended more than this many days ago (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    t0 = time.perf_counter()
+    moved = archive_bookings(conn, args.horizon_days, args.batch_size)
+    conn.close()
+    print(f'Archived {moved} bookings in {time.perf_counter() - t0:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+# Batch writes (POST /api/v1/batch)
+#
+# Assigning a team to a project or spreading a grant over projects used to
+# take one form post and one commit per row. A batch carries any number of
+# operations on WorksOn, ProjectGrant, Authorship and EquipmentUse, named as
+# in the read API:
+#
+#   {"mode": "atomic", "ops": [
+#     {"resource": "works_on", "op": "insert", "values": {"member_id": "S1", "project_id": "P9", "role": "member"}},
+#     {"resource": "project_grants", "op": "upsert", "values": {"project_id": "P9", "grant_id": "G2", "amount_allocated": 5000}},
+#     {"resource": "equipment_uses", "op": "delete", "values": {"use_id": "U17"}}]}
+#
+# The whole batch is validated before anything is written. The checks are:
+#   - the shape of each operation
+#   - duplicate keys, both within the batch and against the tables
+#   - references to rows in other tables
+#   - grant budgets, with every allocation of a grant summed
+#   - the 3-user equipment limit and the booking-form conflict rules,
+#     counting bookings made earlier in the same batch
+#   - the last-author rule
+# All reads are a few IN queries, made after the request's BEGIN IMMEDIATE,
+# so nothing changes between validation and the writes. Accepted operations
+# are then written in runs of one executemany each. Budget releases are
+# written before reservations, so the ledger triggers never see a transient
+# overrun.
+#
+# "atomic" (the default) writes nothing unless every operation is valid.
+# "best_effort" writes the valid ones and reports the others. The triggers
+# still check every row, and the result has one entry per operation.
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, delete, func, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+
+from .events import events
+from .metrics import metrics
+from .models import (db, to_epoch, DAY_SECONDS, LabMember, Project, GrantFund, Publication, Equipment,
+                     WorksOn, ProjectGrant, Authorship, EquipmentUse)
+from .refcache import refcache
+
+MAX_OPS = 1000
+MODES = ('atomic', 'best_effort')
+EQUIPMENT_LIMIT = 3  # as on the booking form
+BUDGET_SLACK = 1e-6  # as in check_grant_budget_insert
+
+Spec = namedtuple('Spec', 'model key fields ops refs')
+
+SPECS = {
+    'works_on': Spec(WorksOn, ('member_id', 'project_id'), ('role', 'weekly_hours'), ('insert', 'upsert', 'delete'),
+                     {'member_id': LabMember, 'project_id': Project}),
+    'project_grants': Spec(ProjectGrant, ('project_id', 'grant_id'), ('amount_allocated',), ('insert', 'upsert', 'delete'),
+                           {'project_id': Project, 'grant_id': GrantFund}),
+    'authorships': Spec(Authorship, ('pub_id', 'member_id'), ('author_order', 'author_role'), ('insert', 'upsert', 'delete'),
+                        {'pub_id': Publication, 'member_id': LabMember}),
+    # use_id is assigned here, as on the booking form
+    'equipment_uses': Spec(EquipmentUse, ('use_id',), ('equip_id', 'member_id', 'use_start', 'use_end', 'purpose'),
+                           ('insert', 'delete'), {'equip_id': Equipment, 'member_id': LabMember}),
+}
+
+
+class Item:
+    __slots__ = ('index', 'resource', 'op', 'values', 'error', 'status', 'old', 'delta')
+
+    def __init__(self, index, resource, op, values):
+        self.index = index
+        self.resource = resource
+        self.op = op
+        self.values = values
+        self.error = None
+        self.status = None
+        self.old = None    # the existing row, for updates and deletes
+        self.delta = 0.0   # change to the grant's allocated total
+
+    @property
+    def spec(self):
+        return SPECS.get(self.resource)
+
+    @property
+    def key(self):
+        return tuple(self.values.get(k) for k in self.spec.key) if self.spec else ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def reject(self, message):
+        if self.error is None:
+            self.error = message
+
+    def to_dict(self):
+        out = {'index': self.index, 'resource': self.resource, 'op': self.op,
+               'key': {k: self.values.get(k) for k in self.spec.key} if self.spec else {}, 'status': self.status}
+        if self.error is not None:
+            out['error'] = self.error
+        return out
+
+
+# ---- parsing ------------------------------------------------------------------
+
+def _number(value, name, cast=float):
+    if value is None or value == '':
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number') from None
+
+
+def _datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an ISO datetime') from None
+
+
+def _coerce(resource, op, values):
+    spec = SPECS[resource]
+    allowed = spec.key if op == 'delete' else spec.key + spec.fields
+    unknown = [k for k in values if k not in allowed]
+    if unknown:
+        raise ValueError(f'unknown fields for {op} on {resource}: {", ".join(unknown)}')
+    out = dict(values)
+    if resource == 'equipment_uses' and op == 'insert':
+        if 'use_id' in out:
+            raise ValueError('use_id is assigned by the server')
+        missing = [f for f in spec.fields if not out.get(f)]
+        if missing:
+            raise ValueError(f'missing {", ".join(missing)}')
+        out['use_start'] = _datetime(out['use_start'], 'use_start')
+        out['use_end'] = _datetime(out['use_end'], 'use_end')
+        if out['use_end'] < out['use_start']:
+            raise ValueError('use_end is before use_start')
+        return out
+    missing = [k for k in spec.key if not isinstance(out.get(k), str) or not out.get(k)]
+    if missing:
+        raise ValueError(f'missing {", ".join(missing)}')
+    if 'weekly_hours' in out:
+        out['weekly_hours'] = _number(out['weekly_hours'], 'weekly_hours')
+    if 'amount_allocated' in out:
+        out['amount_allocated'] = _number(out['amount_allocated'], 'amount_allocated')
+        if out['amount_allocated'] is not None and out['amount_allocated'] < 0:
+            raise ValueError('amount_allocated must not be negative')
+    if 'author_order' in out:
+        out['author_order'] = _number(out['author_order'], 'author_order', int)
+    return out
+
+
+def parse(payload):
+    # (mode, [Item]); raises ValueError when the request itself is malformed
+    if not isinstance(payload, dict):
+        raise ValueError('send a JSON object with "ops"')
+    mode = payload.get('mode', 'atomic')
+    if mode not in MODES:
+        raise ValueError(f'mode must be one of {", ".join(MODES)}')
+    ops = payload.get('ops')
+    if not isinstance(ops, list) or not ops:
+        raise ValueError('"ops" must be a non-empty list')
+    if len(ops) > MAX_OPS:
+        raise ValueError(f'at most {MAX_OPS} operations per batch')
+    items = []
+    for i, raw in enumerate(ops):
+        raw = raw if isinstance(raw, dict) else {}
+        resource, op, values = raw.get('resource'), raw.get('op'), raw.get('values')
+        item = Item(i, resource if isinstance(resource, str) else None, op if isinstance(op, str) else None, {})
+        if item.resource not in SPECS:
+            item.reject(f'resource must be one of {", ".join(SPECS)}')
+        elif op not in SPECS[resource].ops:
+            item.reject(f'op for {resource} must be one of {", ".join(SPECS[resource].ops)}')
+        elif not isinstance(values, dict):
+            item.reject('"values" must be an object')
+        else:
+            try:
+                item.values = _coerce(resource, op, values)
+            except ValueError as ex:
+                item.values = {k: v for k, v in values.items() if k in SPECS[resource].key}
+                item.reject(str(ex))
+        items.append(item)
+    return mode, items
+
+
+# ---- validation -----------------------------------------------------------------
+
+def _in(column, values):
+    return column.in_(bindparam(f'in_{column.name}', expanding=True)), {f'in_{column.name}': sorted(values)}
+
+
+def _existing(resource, keys):
+    # {key: row} of the rows of resource with these keys
+    spec = SPECS[resource]
+    table = spec.model.__table__
+    cols = [table.c[k] for k in spec.key]
+    stmt = select(*table.c).where(tuple_(*cols).in_(sorted(keys)) if len(cols) > 1 else cols[0].in_(sorted(k[0] for k in keys)))
+    return {tuple(getattr(r, k) for k in spec.key): r for r in db.session.execute(stmt)}
+
+
+def _check_keys(items):
+    seen = {}
+    for item in items:
+        if not item.ok or (item.resource == 'equipment_uses' and item.op == 'insert'):
+            continue
+        k = (item.resource, item.key)
+        if k in seen:
+            item.reject(f'the batch already has an operation on this key (#{seen[k]})')
+        else:
+            seen[k] = item.index
+    by_resource = defaultdict(list)
+    for item in items:
+        if item.ok and not (item.resource == 'equipment_uses' and item.op == 'insert'):
+            by_resource[item.resource].append(item)
+    for resource, group in by_resource.items():
+        rows = _existing(resource, {i.key for i in group})
+        for item in group:
+            item.old = rows.get(item.key)
+            if item.op == 'insert' and item.old is not None:
+                item.reject(f'{resource} {"/".join(item.key)} already exists')
+            elif item.op == 'delete' and item.old is None:
+                item.reject(f'{resource} {"/".join(item.key)} does not exist')
+
+
+def _check_refs(items):
+    wanted = defaultdict(set)
+    for item in items:
+        if item.ok and item.op != 'delete':
+            for field, model in item.spec.refs.items():
+                wanted[(model, field)].add(item.values[field])
+    found = {}
+    for (model, field), values in wanted.items():
+        pk = model.__table__.primary_key.columns[0]
+        clause, params = _in(pk, values)
+        found[(model, field)] = set(db.session.scalars(select(pk).where(clause), params))
+    for item in items:
+        if item.ok and item.op != 'delete':
+            for field, model in item.spec.refs.items():
+                if item.values[field] not in found[(model, field)]:
+                    item.reject(f'unknown {field} {item.values[field]}')
+
+
+def _check_budgets(items):
+    allocations = [i for i in items if i.ok and i.resource == 'project_grants']
+    if not allocations:
+        return
+    clause, params = _in(GrantFund.grant_id, {i.values['grant_id'] for i in allocations})
+    ledger = {r.grant_id: r for r in db.session.execute(
+        select(GrantFund.grant_id, GrantFund.budget, GrantFund.allocated_total).where(clause), params)}
+    for item in allocations:
+        old = (item.old.amount_allocated or 0) if item.old is not None else 0
+        new = 0 if item.op == 'delete' else (item.values.get('amount_allocated', old) or 0)
+        item.delta = new - old
+    # every release counts first (that is also the order they are written in), then increases in batch order
+    total = {g: r.allocated_total + sum(i.delta for i in allocations if i.values['grant_id'] == g and i.delta < 0)
+             for g, r in ledger.items()}
+    for item in allocations:
+        if item.delta <= 0:
+            continue
+        g = item.values['grant_id']
+        budget = ledger[g].budget
+        if budget is not None and total[g] + item.delta > budget + BUDGET_SLACK:
+            item.reject(f'grant {g} budget exceeded (budget={budget}, would be {round(total[g] + item.delta, 2)})')
+        else:
+            total[g] += item.delta
+
+
+def _check_authors(items):
+    # no delete may leave a publication without authors; inserts are written before deletes
+    authorships = [i for i in items if i.ok and i.resource == 'authorships']
+    deletes = [i for i in authorships if i.op == 'delete']
+    if not deletes:
+        return
+    clause, params = _in(Authorship.pub_id, {i.values['pub_id'] for i in deletes})
+    count = dict(db.session.execute(select(Authorship.pub_id, func.count()).where(clause).group_by(Authorship.pub_id), params).all())
+    for i in authorships:
+        if i.op == 'insert' or (i.op == 'upsert' and i.old is None):
+            count[i.values['pub_id']] = count.get(i.values['pub_id'], 0) + 1
+    for i in deletes:
+        pub = i.values['pub_id']
+        if count.get(pub, 0) <= 1:
+            i.reject(f'cannot remove the last author of publication {pub}')
+        else:
+            count[pub] -= 1
+
+
+def next_use_number():
+    # over hot and archived bookings, so an archived use_id is never handed out again
+    sql = "SELECT MAX(CAST(substr(use_id, 2) AS INTEGER)) FROM EquipmentUseHistory WHERE use_id GLOB 'U[0-9]*'"
+    return (db.session.scalar(text(sql)) or 0) + 1
+
+
+def _check_bookings(items):
+    # the booking form's rules, with earlier bookings of the batch counted as existing
+    new = [i for i in items if i.ok and i.resource == 'equipment_uses' and i.op == 'insert']
+    if not new:
+        return
+    removed = {i.values['use_id'] for i in items if i.ok and i.resource == 'equipment_uses' and i.op == 'delete'}
+    for i in new:
+        i.values['start_ts'] = to_epoch(i.values['use_start'])
+        i.values['end_ts'] = to_epoch(i.values['use_end'])
+    # whole days, so same-day bookings outside the time range are loaded too
+    lo = min(i.values['start_ts'] for i in new) // DAY_SECONDS * DAY_SECONDS
+    hi = (max(i.values['end_ts'] for i in new) // DAY_SECONDS + 1) * DAY_SECONDS
+    clause, params = _in(EquipmentUse.equip_id, {i.values['equip_id'] for i in new})
+    rows = db.session.execute(
+        select(EquipmentUse.use_id, EquipmentUse.equip_id, EquipmentUse.member_id, EquipmentUse.use_start_ts,
+               EquipmentUse.use_end_ts, EquipmentUse.use_end.isnot(None).label('has_end'))
+        .where(clause, EquipmentUse.use_end_ts >= lo, EquipmentUse.use_start_ts <= hi), dict(params)).all()
+    booked = defaultdict(list)  # equip_id -> [(member_id, start_ts, end_ts, has_end)]
+    for r in rows:
+        if r.use_id not in removed:
+            booked[r.equip_id].append((r.member_id, r.use_start_ts, r.use_end_ts, bool(r.has_end)))
+    number = next_use_number()
+    for i in new:
+        v = i.values
+        s, e = v['start_ts'], v['end_ts']
+        pool = booked[v['equip_id']]
+        overlapping = [b for b in pool if b[2] >= s and b[1] <= e]
+        if len(overlapping) >= EQUIPMENT_LIMIT:
+            i.reject(f'equipment {v["equip_id"]} already in use by {len(overlapping)} members during that time (limit {EQUIPMENT_LIMIT})')
+        elif any(b[0] == v['member_id'] for b in overlapping):
+            i.reject(f'{v["member_id"]} already has an overlapping booking for {v["equip_id"]}')
+        elif any(b[0] == v['member_id'] and (b[1] // DAY_SECONDS == s // DAY_SECONDS or (b[3] and b[2] // DAY_SECONDS == e // DAY_SECONDS))
+                 for b in pool):
+            i.reject(f'{v["member_id"]} already has a booking for {v["equip_id"]} on the same day')
+        else:
+            pool.append((v['member_id'], s, e, True))
+            v['use_id'] = f'U{number}'
+            number += 1
+
+
+def validate(items):
+    _check_keys(items)
+    _check_refs(items)
+    _check_budgets(items)
+    _check_authors(items)
+    _check_bookings(items)
+
+
+# ---- writing --------------------------------------------------------------------
+
+def _order(item):
+    # releases before reservations, authors added before authors removed
+    if item.resource == 'authorships':
+        return (item.resource, item.op == 'delete', 0.0)
+    return (item.resource, item.op != 'delete', item.delta)
+
+
+def _statement(resource, op, fields):
+    spec = SPECS[resource]
+    table = spec.model.__table__
+    if op == 'delete':
+        return delete(table).where(and_(*[table.c[k] == bindparam(f'k_{k}') for k in spec.key]))
+    stmt = insert(table)
+    if op == 'upsert':
+        # only the fields given are overwritten; with none it is an insert-if-missing
+        updates = {f: stmt.excluded[f] for f in fields if f not in spec.key}
+        stmt = (stmt.on_conflict_do_update(index_elements=list(spec.key), set_=updates) if updates
+                else stmt.on_conflict_do_nothing(index_elements=list(spec.key)))
+    return stmt
+
+
+def _params(item, fields):
+    if item.op == 'delete':
+        return {f'k_{k}': item.values[k] for k in item.spec.key}
+    return {f: item.values.get(f) for f in fields}
+
+
+def _runs(items):
+    # consecutive items that share one statement, so each run is one executemany
+    run, sig = [], None
+    for item in items:
+        fields = tuple(k for k in item.spec.key + item.spec.fields if k in item.values)
+        s = (item.resource, item.op, fields)
+        if run and s != sig:
+            yield sig, run
+            run = []
+        sig = s
+        run.append(item)
+    if run:
+        yield sig, run
+
+
+def write(items, best_effort):
+    accepted = sorted((i for i in items if i.ok), key=_order)
+    for (resource, op, fields), run in _runs(accepted):
+        stmt = _statement(resource, op, fields)
+        params = [_params(i, fields) for i in run]
+        if not best_effort:
+            db.session.execute(stmt, params)
+        else:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(stmt, params)
+            except IntegrityError:
+                # find the rows the triggers refused, one savepoint each
+                for i, p in zip(run, params):
+                    try:
+                        with db.session.begin_nested():
+                            db.session.execute(stmt, p)
+                    except IntegrityError as ex:
+                        i.reject(str(ex.orig))
+        metrics.incr('batch.statements')
+    written = [i for i in accepted if i.ok]
+    tables = {i.spec.model.__tablename__ for i in written}
+    if 'ProjectGrant' in tables:
+        tables.add('GrantFund')
+    refcache.touch(db.session, tables)
+    equip = {i.values['equip_id'] if i.op == 'insert' else i.old.equip_id for i in written if i.resource == 'equipment_uses'}
+    events.touch(db.session, 'EquipmentUse', equip)
+    return written
+
+
+def run(payload):
+    # validate and write a batch in the current transaction; the caller commits or rolls back.
+    # Returns the result and whether it should be committed.
+    mode, items = parse(payload)
+    validate(items)
+    atomic = mode == 'atomic'
+    rejected = [i for i in items if not i.ok]
+    if atomic and rejected:
+        for i in items:
+            i.status = 'rejected' if not i.ok else 'not_applied'
+        commit = False
+    else:
+        write(items, best_effort=not atomic)
+        for i in items:
+            i.status = 'applied' if i.ok else 'rejected'
+        commit = True
+    applied = sum(i.status == 'applied' for i in items)
+    metrics.incr('batch.applied', applied)
+    metrics.incr('batch.rejected', sum(i.status == 'rejected' for i in items))
+    return {'mode': mode, 'applied': applied, 'rejected': sum(i.status == 'rejected' for i in items),
+            'results': [i.to_dict() for i in items]}, commit
@@ -0,0 +1,232 @@
+# Grant burn-down
+#
+# ProjectGrant rows have no date of their own, so an allocation counts from
+# the month its project starts (or the grant starts, if that is later). One
+# query lays a grid of grants x months over the requested range, left-joins
+# the allocations grouped by month, and lets window functions run the
+# cumulative allocation, remaining budget and allocated share down each
+# grant's months. Allocations from before the range go into the first
+# month's cumulative total but not into its "allocated" column. Grants end
+# start_date + duration months.
+#
+# Results are cached per data version (changes.VersionedCache) and day, since
+# "ending soon" and the default range move with the calendar.
+import csv
+import io
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from . import changes
+from .metrics import metrics
+from .models import db
+
+TABLES = ('GrantFund', 'ProjectGrant', 'Project')
+DEFAULT_MONTHS = 24
+MAX_MONTHS = 240
+DEFAULT_ENDING_WITHIN = 90
+CSV_COLUMNS = ['grant_id', 'month', 'allocated', 'cumulative', 'remaining', 'pct_allocated', 'projects_funded', 'project_ids']
+
+_cache = changes.VersionedCache(TABLES)
+
+SERIES_SQL = '''
+WITH RECURSIVE months(month) AS (
+    SELECT :first
+    UNION ALL
+    SELECT strftime('%Y-%m', month || '-01', '+1 month') FROM months WHERE month < :last
+),
+grants AS (
+    SELECT grant_id, budget, strftime('%Y-%m', start_date) AS start_month,
+           strftime('%Y-%m', date(start_date, '+' || COALESCE(duration, 0) || ' months')) AS end_month
+    FROM GrantFund {grant_filter}
+),
+alloc AS (
+    -- undated allocations count as made before any range
+    SELECT pg.grant_id, pg.project_id, COALESCE(pg.amount_allocated, 0) AS amount,
+           COALESCE(strftime('%Y-%m', MAX(COALESCE(p.start_date, g.start_date), COALESCE(g.start_date, p.start_date))), '0000-01') AS month
+    FROM ProjectGrant pg
+    JOIN grants gr ON gr.grant_id = pg.grant_id
+    JOIN GrantFund g ON g.grant_id = pg.grant_id
+    LEFT JOIN Project p ON p.project_id = pg.project_id
+),
+monthly AS (
+    -- earlier allocations are folded into the first month as an opening balance
+    SELECT grant_id, MAX(month, :first) AS month,
+           SUM(amount) AS delta,
+           SUM(CASE WHEN month >= :first THEN amount ELSE 0 END) AS allocated,
+           SUM(month >= :first) AS projects_funded,
+           group_concat(CASE WHEN month >= :first THEN project_id END, ' ') AS project_ids
+    FROM alloc WHERE month <= :last
+    GROUP BY grant_id, MAX(month, :first)
+)
+SELECT grant_id, month, allocated, cumulative, budget - cumulative AS remaining,
+       100.0 * cumulative / NULLIF(budget, 0) AS pct_allocated, projects_funded, project_ids, grant_open
+FROM (
+    SELECT gr.grant_id, m.month, gr.budget,
+           COALESCE(a.allocated, 0) AS allocated,
+           SUM(COALESCE(a.delta, 0)) OVER (PARTITION BY gr.grant_id ORDER BY m.month ROWS UNBOUNDED PRECEDING) AS cumulative,
+           COALESCE(a.projects_funded, 0) AS projects_funded,
+           COALESCE(a.project_ids, '') AS project_ids,
+           m.month BETWEEN gr.start_month AND gr.end_month AS grant_open
+    FROM grants gr
+    CROSS JOIN months m
+    LEFT JOIN monthly a ON a.grant_id = gr.grant_id AND a.month = m.month
+)
+ORDER BY grant_id, month'''
+
+GRANTS_SQL = '''
+SELECT grant_id, source, budget, start_date, duration, allocated_total,
+       budget - allocated_total AS remaining,
+       date(start_date, '+' || COALESCE(duration, 0) || ' months') AS end_date,
+       CAST(julianday(date(start_date, '+' || COALESCE(duration, 0) || ' months')) - julianday(:today) AS INTEGER) AS days_left,
+       RANK() OVER (ORDER BY date(start_date, '+' || COALESCE(duration, 0) || ' months')) AS end_rank
+FROM GrantFund {grant_filter}
+ORDER BY grant_id'''
+
+
+def _month(value, name):
+    try:
+        d = date.fromisoformat(value + '-01')
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must look like YYYY-MM') from None
+    return d.year, d.month
+
+
+def parse_range(start, end, today=None):
+    # (first, last) as 'YYYY-MM'; defaults to the last 24 months through this one
+    today = today or date.today()
+    ly, lm = _month(end, 'end') if end else (today.year, today.month)
+    if start:
+        fy, fm = _month(start, 'start')
+    else:
+        n = ly * 12 + lm - 1 - (DEFAULT_MONTHS - 1)
+        fy, fm = divmod(n, 12)
+        fm += 1
+    span = (ly * 12 + lm) - (fy * 12 + fm) + 1
+    if span < 1:
+        raise ValueError('end is before start')
+    if span > MAX_MONTHS:
+        raise ValueError(f'range is limited to {MAX_MONTHS} months')
+    return f'{fy:04d}-{fm:02d}', f'{ly:04d}-{lm:02d}'
+
+
+def month_range(first, last):
+    fy, fm = map(int, first.split('-'))
+    ly, lm = map(int, last.split('-'))
+    return [f'{n // 12:04d}-{n % 12 + 1:02d}' for n in range(fy * 12 + fm - 1, ly * 12 + lm)]
+
+
+def _query(sql, params, grant_ids):
+    if grant_ids:
+        stmt = text(sql.format(grant_filter='WHERE grant_id IN :ids')).bindparams(bindparam('ids', expanding=True))
+        params = dict(params, ids=list(grant_ids))
+    else:
+        stmt = text(sql.format(grant_filter=''))
+    return stmt, params
+
+
+def load(first, last, grant_ids=None, today=None):
+    # (series DataFrame, grants DataFrame)
+    conn = db.session.connection()
+    stmt, params = _query(SERIES_SQL, {'first': first, 'last': last}, grant_ids)
+    series = pd.read_sql_query(stmt, conn, params=params)
+    stmt, params = _query(GRANTS_SQL, {'today': (today or date.today()).isoformat()}, grant_ids)
+    grants = pd.read_sql_query(stmt, conn, params=params)
+    return series, grants
+
+
+def _num(v, digits=2):
+    return None if v is None or pd.isna(v) else round(float(v), digits)
+
+
+def _grid(series, column, n_months, digits=None):
+    # the grid is dense and sorted by (grant, month), so each column reshapes to grants x months
+    values = series[column].to_numpy(dtype=float)
+    if digits is not None:
+        values = values.round(digits)
+    grid = values.reshape(-1, n_months).astype(object)
+    grid[pd.isna(grid)] = None
+    return grid.tolist()
+
+
+def compute(series, grants, first, last, ending_within):
+    months = month_range(first, last)
+    n = len(months)
+    rows = {}
+    if len(series):
+        ids = series['grant_id'].iloc[::n].tolist()
+        columns = {
+            'allocated': _grid(series, 'allocated', n, 2),
+            'cumulative': _grid(series, 'cumulative', n, 2),
+            'remaining': _grid(series, 'remaining', n, 2),
+            'pct_allocated': _grid(series, 'pct_allocated', n, 1),
+            'projects_funded': series['projects_funded'].to_numpy(dtype=int).reshape(-1, n).tolist(),
+            'open': series['grant_open'].fillna(0).to_numpy(dtype=bool).reshape(-1, n).tolist(),
+        }
+        rows = {gid: i for i, gid in enumerate(ids)}
+        funded = {}
+        for r in series[series['projects_funded'] > 0].itertuples():
+            funded.setdefault(r.grant_id, {})[r.month] = r.project_ids.split()
+    out = []
+    for g in grants.itertuples():
+        entry = {
+            'grant_id': g.grant_id, 'source': g.source, 'budget': _num(g.budget),
+            'start_date': g.start_date, 'end_date': g.end_date, 'duration': None if pd.isna(g.duration) else int(g.duration),
+            'allocated_total': _num(g.allocated_total), 'remaining': _num(g.remaining),
+            'days_left': None if pd.isna(g.days_left) else int(g.days_left),
+        }
+        i = rows.get(g.grant_id)
+        if i is not None:
+            entry['series'] = {name: col[i] for name, col in columns.items()}
+            entry['funded'] = funded.get(g.grant_id, {})
+        out.append(entry)
+    ending = grants[grants['days_left'].between(0, ending_within)].sort_values('end_rank')
+    totals = series.groupby('month', sort=False)[['allocated', 'cumulative']].sum().round(2) if len(series) else None
+    return {
+        'start': first, 'end': last, 'months': months, 'grants': out,
+        'ending_within_days': ending_within,
+        'ending_soon': [{'grant_id': g.grant_id, 'source': g.source, 'end_date': g.end_date, 'days_left': int(g.days_left),
+                         'remaining': _num(g.remaining)} for g in ending.itertuples()],
+        'totals': {
+            'allocated': totals['allocated'].tolist() if totals is not None else [],
+            'cumulative': totals['cumulative'].tolist() if totals is not None else [],
+        },
+    }
+
+
+def report(first, last, grant_ids=None, ending_within=DEFAULT_ENDING_WITHIN, today=None, progress=None):
+    # progress(fraction, message) is called between phases (background jobs, see jobs.py)
+    if ending_within < 0:
+        raise ValueError('ending_within must not be negative')
+    today = today or date.today()
+    key, version, hit = _cache.lookup(first, last, tuple(sorted(grant_ids or ())), ending_within, today)
+    if hit is not None:
+        metrics.incr('burndown.cache_hits')
+        return hit
+    metrics.incr('burndown.cache_misses')
+    if progress:
+        progress(0.1, 'loading allocations', force=True)
+    series, grants = load(first, last, grant_ids, today)
+    if progress:
+        progress(0.6, f'building {len(grants)} burn-downs', force=True)
+    result = compute(series, grants, first, last, ending_within)
+    result.update({'data_version': version, 'today': today.isoformat()})
+    _cache.store(key, result)
+    return result
+
+
+def to_csv(result):
+    # one row per grant and month
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(CSV_COLUMNS)
+    for g in result['grants']:
+        s = g.get('series')
+        if not s:
+            continue
+        funded = g.get('funded', {})
+        for i, month in enumerate(result['months']):
+            w.writerow([g['grant_id'], month, s['allocated'][i], s['cumulative'][i], s['remaining'][i],
+                        s['pct_allocated'][i], s['projects_funded'][i], ' '.join(funded.get(month, ()))])
+    return buf.getvalue()
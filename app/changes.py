@@ -0,0 +1,199 @@
+# Change-data capture feed
+#
+# Triggers (sql/migrations/004_change_log.sql) append one ChangeLog row per
+# inserted, updated or deleted row. Consumers remember the last seq they
+# applied and ask for what came after it, so a sync costs time proportional
+# to the number of changes instead of the size of the tables:
+#
+#   GET /changes?since=<seq>&limit=1000[&tables=EquipmentUse,Equipment]
+#
+# Inserts and updates should be applied as upserts of the row with that key
+# (read it back from the table), deletes as deletes. After compaction a key
+# may be reported once for several changes, with cols = null meaning "any".
+# When a consumer falls behind the retention window the feed answers 410 and
+# it has to take a fresh snapshot starting from `head`.
+#
+#   python -m app.changes compact --older-than-hours 24
+#   python -m app.changes prune --retention-days 30
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select, text
+
+from .models import db, ChangeLog, ChangeLogMeta
+from .readpath import iter_rows
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'labmanager.db')
+DEFAULT_RETENTION_DAYS = int(os.environ.get('CHANGELOG_RETENTION_DAYS', 30))
+MAX_LIMIT = 10000
+
+
+# ---- reading (app session) -------------------------------------------------
+
+def head():
+    # last seq handed out; survives pruning because of AUTOINCREMENT
+    return db.session.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'")) or 0
+
+
+def pruned_through():
+    return db.session.scalar(select(ChangeLogMeta.value).where(ChangeLogMeta.name == 'pruned_through')) or 0
+
+
+def table_versions(tables):
+    # {table: seq of its latest change}; each lookup is a single descent of idx_changelog_tbl_seq.
+    # A table whose entries were all pruned reports pruned_through, so versions never go back.
+    floor = pruned_through()
+    versions = {}
+    for t in tables:
+        versions[t] = db.session.scalar(select(func.max(ChangeLog.seq)).where(ChangeLog.tbl == t)) or floor
+    return versions
+
+
+def data_version(tables):
+    # one number that moves whenever any of `tables` changes; use as a cache key
+    return max(table_versions(tables).values(), default=0)
+
+
+class VersionedCache:
+    # LRU of computed results keyed by (database URL, data_version(tables), args),
+    # shared by the analytics reports. The URL keeps apps on different databases
+    # apart when they run in one process.
+    def __init__(self, tables, size=32):
+        self.tables = tables
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, *args):
+        # (key, version, result or None); after a miss, compute and store(key, result)
+        version = data_version(self.tables)
+        key = (str(db.engine.url), version) + args
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+        return key, version, hit
+
+    def store(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+_has_table = {}
+
+
+def has_table(name):
+    # whether the app's database has table `name`, e.g. one added by a later migration;
+    # checked once per engine
+    key = (db.engine, name)
+    if key not in _has_table:
+        _has_table[key] = db.session.scalar(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': name}) is not None
+    return _has_table[key]
+
+
+def changes_since(since, limit=1000, tables=None):
+    stmt = (select(ChangeLog.seq, ChangeLog.tbl, ChangeLog.op, ChangeLog.pk, ChangeLog.cols, ChangeLog.changed_at)
+            .where(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit))
+    if tables:
+        stmt = stmt.where(ChangeLog.tbl.in_(tables))
+    return iter_rows(stmt)
+
+
+def encode_change(row):
+    # pk is stored as a JSON array already and is copied through verbatim
+    cols = json.dumps(row.cols.split(',')) if row.cols else 'null'
+    return (f'{{"seq":{row.seq},"table":{json.dumps(row.tbl)},"op":"{row.op}",'
+            f'"key":{row.pk},"cols":{cols},"at":{row.changed_at}}}')
+
+
+# ---- maintenance (sqlite3 connection, like app/archive.py) ---------------------
+
+def _meta(conn, name):
+    row = conn.execute('SELECT value FROM ChangeLogMeta WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _set_meta(conn, name, value):
+    conn.execute('INSERT INTO ChangeLogMeta(name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value = excluded.value', (name, value))
+
+
+def compact(conn, older_than_hours=24, now=None):
+    # keep only the latest entry per (table, key) among entries older than the
+    # horizon that were not compacted yet; returns the number of entries removed
+    horizon = int(now or time.time()) - int(older_than_hours * 3600)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        lo = _meta(conn, 'compacted_through')
+        upto = conn.execute('SELECT MAX(seq) FROM ChangeLog WHERE seq > ? AND changed_at < ?', (lo, horizon)).fetchone()[0]
+        if upto is None:
+            conn.rollback()
+            return 0
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS changelog_keep (seq INTEGER PRIMARY KEY, n INTEGER)')
+        conn.execute('DELETE FROM changelog_keep')
+        conn.execute('INSERT INTO changelog_keep SELECT MAX(seq), COUNT(*) FROM ChangeLog '
+                     'WHERE seq > ? AND seq <= ? GROUP BY tbl, pk', (lo, upto))
+        # a surviving update stands for several, so its column list no longer applies
+        conn.execute("UPDATE ChangeLog SET cols = NULL WHERE op = 'U' AND seq IN (SELECT seq FROM changelog_keep WHERE n > 1)")
+        removed = conn.execute('DELETE FROM ChangeLog WHERE seq > ? AND seq <= ? AND seq NOT IN (SELECT seq FROM changelog_keep)',
+                               (lo, upto)).rowcount
+        _set_meta(conn, 'compacted_through', upto)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return removed
+
+
+def prune(conn, retention_days=DEFAULT_RETENTION_DAYS, batch_size=10000, now=None):
+    # drop entries older than the retention window in short write transactions
+    cutoff = int(now or time.time()) - retention_days * 86400
+    removed = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            upto = conn.execute('SELECT MAX(seq) FROM (SELECT seq FROM ChangeLog WHERE changed_at < ? ORDER BY seq LIMIT ?)',
+                                (cutoff, batch_size)).fetchone()[0]
+            if upto is None:
+                conn.rollback()
+                break
+            removed += conn.execute('DELETE FROM ChangeLog WHERE seq <= ?', (upto,)).rowcount
+            _set_meta(conn, 'pruned_through', max(upto, _meta(conn, 'pruned_through')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact or prune the ChangeLog')
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('compact', help='merge repeated changes to the same row')
+    p.add_argument('--older-than-hours', type=float, default=24)
+    p = sub.add_parser('prune', help='delete entries older than the retention window')
+    p.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION_DAYS)
+    p.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    t0 = time.perf_counter()
+    if args.cmd == 'compact':
+        removed = compact(conn, args.older_than_hours)
+    else:
+        removed = prune(conn, args.retention_days, args.batch_size)
+    conn.close()
+    print(f'{args.cmd}: removed {removed} change log entries in {time.perf_counter() - t0:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
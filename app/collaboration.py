@@ -0,0 +1,190 @@
+# Co-authorship network
+#
+# CoAuthorEdge (sql/migrations/007) holds, per publication year, every pair of
+# members who wrote a paper together and how many papers that was. Triggers
+# on Authorship and Publication keep it current, so loading the graph for a
+# range of years is one range read of its period index. On a database that
+# has not been migrated yet the same rows come from an Authorship self-join.
+#
+# The edges are turned into a compressed sparse row (CSR) adjacency: member i's
+# neighbours are indices[indptr[i]:indptr[i + 1]] with the paper counts in
+# weights. Weighted degree, connected components (min-label propagation) and
+# PageRank are all a few vectorized passes over these arrays.
+#
+# Results are cached per data version (changes.VersionedCache), like the
+# utilization report.
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from . import changes
+from .metrics import metrics
+from .models import db
+
+TABLES = ('Authorship', 'Publication', 'LabMember')
+UNDATED = 0
+MAX_K = 50
+TOP_PAIRS = 10
+TOP_COMPONENTS = 10
+COMPONENT_MEMBERS = 50
+DAMPING = 0.85
+
+Graph = namedtuple('Graph', 'ids indptr indices weights')
+
+_cache = changes.VersionedCache(TABLES)
+
+# the same rows as CoAuthorEdge, for databases without it
+_SELF_JOIN = '''SELECT a.member_id AS member_a, b.member_id AS member_b,
+                       COALESCE(CAST(strftime('%Y', p.pub_date) AS INTEGER), 0) AS period, COUNT(*) AS papers
+                FROM Authorship a
+                JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+                JOIN Publication p ON p.pub_id = a.pub_id
+                GROUP BY 1, 2, 3'''
+
+
+def has_edge_table():
+    return changes.has_table('CoAuthorEdge')
+
+
+def load_edges(first=None, last=None):
+    # DataFrame(member_a, member_b, period, papers) for periods in [first, last] (all when None)
+    source = 'CoAuthorEdge' if has_edge_table() else f'({_SELF_JOIN})'
+    sql = f'SELECT member_a, member_b, period, papers FROM {source} e WHERE period BETWEEN :first AND :last'
+    params = {'first': UNDATED if first is None else first, 'last': 9999 if last is None else last}
+    return pd.read_sql_query(text(sql), db.session.connection(), params=params,
+                             dtype={'period': 'int64', 'papers': 'int64'})
+
+
+def build(a, b, w, ids=None):
+    # undirected CSR graph from edge arrays of member ids; parallel edges are summed
+    if ids is None:
+        ids = np.unique(np.concatenate([a, b]))
+    index = pd.Index(ids)
+    src = np.concatenate([index.get_indexer(a), index.get_indexer(b)])
+    dst = np.concatenate([index.get_indexer(b), index.get_indexer(a)])
+    w = np.concatenate([w, w]).astype(float)
+    n = len(ids)
+    # merge duplicates (the same pair in several periods) and sort by source
+    key = src.astype(np.int64) * max(n, 1) + dst
+    key, inverse = np.unique(key, return_inverse=True)
+    weights = np.bincount(inverse, weights=w)
+    src, dst = key // max(n, 1), key % max(n, 1)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))])
+    return Graph(np.asarray(ids), indptr, dst, weights)
+
+
+def _sources(g):
+    return np.repeat(np.arange(len(g.ids)), np.diff(g.indptr))
+
+
+def components(g):
+    # component label per node: the smallest node index it is connected to
+    labels = np.arange(len(g.ids))
+    src = _sources(g)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, src, labels[g.indices])
+        new = new[new]  # pointer jumping: follow labels to their own labels
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def pagerank(g, damping=DAMPING, tol=1e-10, max_iter=100):
+    # weighted PageRank; every node has at least one edge, so there are no dangling nodes
+    n = len(g.ids)
+    if n == 0:
+        return np.zeros(0)
+    src = _sources(g)
+    strength = np.bincount(src, weights=g.weights, minlength=n)
+    share = g.weights / strength[src]
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        nxt = (1 - damping) / n + damping * np.bincount(g.indices, weights=share * x[src], minlength=n)
+        done = np.abs(nxt - x).sum() < tol
+        x = nxt
+        if done:
+            break
+    return x
+
+
+def measure(g):
+    # DataFrame indexed by member_id: degree, strength (papers with co-authors, summed over pairs), pagerank, component
+    labels = components(g)
+    return pd.DataFrame({
+        'degree': np.diff(g.indptr),
+        'strength': np.bincount(_sources(g), weights=g.weights, minlength=len(g.ids)).astype(np.int64),
+        'pagerank': pagerank(g),
+        'component': labels,
+    }, index=pd.Index(g.ids, name='member_id'))
+
+
+def _top(m, k, names):
+    top = m.sort_values(['pagerank', 'strength'], ascending=False).head(k)
+    return [{'member_id': mid, 'name': names.get(mid), 'degree': int(r.degree), 'strength': int(r.strength),
+             'pagerank': round(float(r.pagerank), 6)} for mid, r in top.iterrows()]
+
+
+def compute(edges, k, names):
+    if edges.empty:
+        g = build(np.array([], dtype=object), np.array([], dtype=object), np.array([]))
+    else:
+        g = build(edges['member_a'].to_numpy(), edges['member_b'].to_numpy(), edges['papers'].to_numpy())
+    m = measure(g)
+    sizes = m.groupby('component').size().sort_values(ascending=False)
+    n = len(g.ids)
+    pairs = (edges.groupby(['member_a', 'member_b'], as_index=False)['papers'].sum()
+             .sort_values(['papers', 'member_a', 'member_b'], ascending=[False, True, True]))
+    periods = []
+    for period, part in edges.groupby('period'):
+        pg = build(part['member_a'].to_numpy(), part['member_b'].to_numpy(), part['papers'].to_numpy())
+        pm = measure(pg)
+        periods.append({
+            'period': 'undated' if period == UNDATED else int(period),
+            'members': len(pg.ids),
+            'pairs': len(part),
+            'components': int(pm['component'].nunique()),
+            'top': _top(pm, k, names),
+        })
+    return {
+        'summary': {
+            'members': n,
+            'pairs': len(pairs),
+            'components': len(sizes),
+            'largest_component': int(sizes.iloc[0]) if len(sizes) else 0,
+            'density': round(2 * len(pairs) / (n * (n - 1)), 4) if n > 1 else 0.0,
+        },
+        'central': [dict(r, component=int(m.at[r['member_id'], 'component'])) for r in _top(m, k, names)],
+        'pairs': [{'member_a': r.member_a, 'name_a': names.get(r.member_a), 'member_b': r.member_b,
+                   'name_b': names.get(r.member_b), 'papers': int(r.papers)} for r in pairs.head(TOP_PAIRS).itertuples()],
+        'components': [{'size': int(size), 'members': sorted(m.index[m['component'] == label])[:COMPONENT_MEMBERS]}
+                       for label, size in sizes.head(TOP_COMPONENTS).items()],
+        'periods': periods,
+    }
+
+
+def report(first=None, last=None, k=5, names=None, progress=None):
+    # first/last are publication years (None: no bound); cached by data version.
+    # progress(fraction, message) is called between phases (background jobs, see jobs.py)
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f'k must be between 1 and {MAX_K}')
+    if first is not None and last is not None and last < first:
+        raise ValueError('end is before start')
+    key, version, hit = _cache.lookup(first, last, k)
+    if hit is not None:
+        metrics.incr('collaboration.cache_hits')
+        return hit
+    metrics.incr('collaboration.cache_misses')
+    if names is None:
+        names = dict(db.session.execute(text('SELECT member_id, name FROM LabMember')).all())
+    if progress:
+        progress(0.1, 'loading co-author pairs', force=True)
+    edges = load_edges(first, last)
+    if progress:
+        progress(0.5, f'measuring a graph of {len(edges)} pairs', force=True)
+    result = compute(edges, k, names)
+    result.update({'start': first, 'end': last, 'k': k, 'data_version': version})
+    _cache.store(key, result)
+    return result
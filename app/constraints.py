@@ -0,0 +1,81 @@
+# Schema rule violations
+#
+# Rules that span rows are enforced by triggers. These cover mentorship
+# direction, mentorship cycles, one mentor at a time per mentee, grant
+# budgets and equipment concurrency. Each trigger aborts the statement with
+# a fixed message. rule_of() names the rule behind an IntegrityError.
+# mentorship_error() turns one into a ConstraintError that carries the rule
+# and the values involved, so routes can answer with JSON or a flash message
+# without matching on driver strings themselves.
+from sqlalchemy import text
+
+from .models import db, to_epoch, OPEN_END_TS
+
+# trigger message prefix -> rule name
+RULES = (
+    ('Mentorship overlap', 'mentorship_overlap'),
+    ('Mentorship cycle', 'mentorship_cycle'),
+    ('Students cannot mentor faculty', 'mentor_type'),
+    ('Changing member_type would make a student mentor a faculty member', 'mentor_type'),
+    ('Grant budget exceeded', 'grant_budget'),
+    ('Equipment concurrency limit exceeded', 'equipment_concurrency'),
+    ('Cannot remove the last author', 'last_author'),
+    ('UNIQUE constraint failed', 'duplicate'),
+)
+
+
+class ConstraintError(Exception):
+    def __init__(self, rule, message, **details):
+        self.rule = rule
+        self.message = message
+        self.details = details
+        super().__init__(message)
+
+    def to_dict(self):
+        return {'error': self.message, 'rule': self.rule, **self.details}
+
+
+def _raw(exc):
+    return str(getattr(exc, 'orig', None) or exc)
+
+
+def rule_of(exc):
+    # rule name for a trigger/constraint abort, or None when it is not one of ours
+    raw = _raw(exc)
+    for prefix, rule in RULES:
+        if raw.startswith(prefix):
+            return rule
+    return None
+
+
+def overlapping_mentorships(mentee_id, start_date, end_date, exclude=None):
+    # the mentee's mentorships whose [start, end] meets the given range; the same
+    # probe of idx_mentorship_mentee_range the overlap trigger makes
+    sql = '''SELECT mentor_id, start_date, end_date FROM Mentorship
+             WHERE mentee_id = :mentee AND end_ts >= :s AND start_ts <= :e
+               AND mentor_id IS NOT :exclude
+             ORDER BY start_ts'''
+    rows = db.session.execute(text(sql), {
+        'mentee': mentee_id, 's': to_epoch(start_date),
+        'e': to_epoch(end_date) if end_date else OPEN_END_TS, 'exclude': exclude}).all()
+    return [{'mentor_id': r.mentor_id, 'start_date': str(r.start_date) if r.start_date else None,
+             'end_date': str(r.end_date) if r.end_date else None} for r in rows]
+
+
+def mentorship_error(exc, mentor_id, mentee_id, start_date, end_date, exclude=None):
+    # ConstraintError for a failed Mentorship write; call after the session was rolled back.
+    # exclude is the mentor of the row being edited, which does not conflict with itself.
+    rule = rule_of(exc)
+    details = {'mentor_id': mentor_id, 'mentee_id': mentee_id,
+               'start_date': str(start_date) if start_date else None, 'end_date': str(end_date) if end_date else None}
+    if rule == 'mentorship_overlap':
+        conflicts = overlapping_mentorships(mentee_id, start_date, end_date, exclude)
+        return ConstraintError(rule, f'Mentee {mentee_id} already has a mentorship overlapping this time frame.',
+                               conflicts=conflicts, **details)
+    if rule == 'mentorship_cycle':
+        return ConstraintError(rule, f'{mentee_id} is already above {mentor_id} in the mentorship lineage.', **details)
+    if rule == 'mentor_type':
+        return ConstraintError(rule, f'Students cannot mentor faculty: {mentor_id} → {mentee_id}', **details)
+    if rule == 'duplicate':
+        return ConstraintError(rule, f'{mentor_id} already mentors {mentee_id}.', **details)
+    return ConstraintError('integrity', _raw(exc), **details)
@@ -0,0 +1,207 @@
+# In-process event bus for live pages
+#
+# Pages that show something "as of now" (equipment occupancy) used to fetch
+# it again and again. Instead they subscribe over Server-Sent Events and the
+# server tells them when a row they care about changes. Commits are watched
+# through the session hooks (like refcache.py): each watched table maps a
+# column of the changed rows (EquipmentUse.equip_id) to an event key, and
+# after the commit every subscriber of that key gets an event. Bulk deletes
+# don't say which rows went away, so they publish a channel-wide event.
+#
+# Each subscriber has its own bounded queue. A slow or stalled client never
+# blocks a writer: when its queue is full the event is dropped and the
+# subscription is flagged, and the stream resends a full snapshot instead.
+#
+# Writes made by other processes (or by raw SQL) never pass through this
+# session. With EVENTS_CHANGELOG_POLL set, a relay thread reads the
+# ChangeLog every few seconds while anyone is subscribed and turns new
+# entries for watched tables into channel-wide events.
+import queue
+import threading
+import time
+from itertools import chain
+
+from sqlalchemy import event, inspect, text
+
+from . import changes
+from .metrics import metrics
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, channel, keys, maxsize, capped=True):
+        self.channel = channel
+        self.capped = capped  # counts towards max_subscribers
+        self.keys = frozenset(keys) if keys else None  # None: every key in the channel
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize)
+
+    def wants(self, channel, key):
+        return channel == self.channel and (key is None or self.keys is None or key in self.keys)
+
+    def offer(self, key):
+        try:
+            self._queue.put_nowait(key)
+        except queue.Full:
+            self.overflowed = True
+            metrics.incr('events.dropped')
+
+    def wait(self, timeout):
+        # block for the first event, then drain whatever else is queued;
+        # returns the set of keys (None meaning "anything") or an empty set
+        try:
+            keys = {self._queue.get(timeout=max(timeout, 0))}
+        except queue.Empty:
+            return set()
+        while True:
+            try:
+                keys.add(self._queue.get_nowait())
+            except queue.Empty:
+                return keys
+
+
+class EventBus:
+    def __init__(self):
+        self.queue_size = 64
+        self.max_subscribers = 64
+        self.poll = 0.0
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._watched = {}
+        self._relay_thread = None
+        self._app = None
+        self._db = None
+
+    def init_app(self, app, db):
+        cfg = app.config
+        self.queue_size = int(cfg.get('EVENTS_QUEUE_SIZE') or self.queue_size)
+        self.max_subscribers = int(cfg.get('EVENTS_MAX_SUBSCRIBERS') or self.max_subscribers)
+        self.poll = float(cfg.get('EVENTS_CHANGELOG_POLL') or 0)
+        self._app = app
+        self._db = db
+        self._install_hooks(db)
+        app.extensions['events'] = self
+
+    def watch(self, table, attr, channel):
+        self._watched[table] = (attr, channel)
+
+    def touch(self, sess, table, keys):
+        # for writes the flush hooks can't see (Core statements); keys are values of the watched column
+        watched = self._watched.get(table)
+        if watched:
+            sess.info.setdefault('events_pending', {}).setdefault(watched[1], set()).update(keys)
+
+    def subscribe(self, channel, keys=None, capped=True):
+        # capped=False is for the app's own listeners, which don't hold a connection
+        sub = Subscription(channel, keys, self.queue_size, capped)
+        with self._lock:
+            connected = sum(1 for s in self._subs if s.capped)
+            if capped and connected >= self.max_subscribers:
+                metrics.incr('events.rejected')
+                raise TooManySubscribers(f'{connected} subscribers already connected')
+            self._subs.add(sub)
+            if self.poll and self._relay_thread is None:
+                self._relay_thread = threading.Thread(target=self._relay, name='events-relay', daemon=True)
+                self._relay_thread.start()
+        metrics.incr('events.subscribed')
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def subscribers(self):
+        with self._lock:
+            return len(self._subs)
+
+    def publish(self, channel, keys):
+        with self._lock:
+            subs = list(self._subs)
+        for key in keys:
+            metrics.incr('events.published')
+            for sub in subs:
+                if sub.wants(channel, key):
+                    sub.offer(key)
+
+    def _relay(self):
+        db = self._db
+        tables = sorted(self._watched)
+        sql = text(f'''SELECT seq, tbl FROM ChangeLog WHERE seq > :since
+                       AND tbl IN ({", ".join(f"'{t}'" for t in tables)}) ORDER BY seq''')
+        try:
+            with self._app.app_context():
+                try:
+                    since = changes.head()
+                finally:
+                    db.session.remove()
+            while True:
+                time.sleep(self.poll)
+                with self._lock:
+                    if not self._subs:
+                        return
+                with self._app.app_context():
+                    try:
+                        rows = db.session.execute(sql, {'since': since}).all()
+                    finally:
+                        db.session.remove()
+                if rows:
+                    since = rows[-1].seq
+                    for channel in {self._watched[r.tbl][1] for r in rows}:
+                        self.publish(channel, [None])
+        except Exception:
+            # no ChangeLog (database not migrated) or the database went away
+            metrics.incr('events.relay_errors')
+        finally:
+            with self._lock:
+                self._relay_thread = None
+
+    def _install_hooks(self, db):
+        session = db.session
+
+        def _pending(sess):
+            return sess.info.setdefault('events_pending', {})
+
+        @event.listens_for(session, 'after_flush')
+        def _after_flush(sess, flush_context):
+            pending = None
+            for obj in list(sess.new) + list(sess.dirty) + list(sess.deleted):
+                watched = self._watched.get(getattr(obj, '__tablename__', None))
+                if not watched:
+                    continue
+                attr, channel = watched
+                if pending is None:
+                    pending = _pending(sess)
+                keys = pending.setdefault(channel, set())
+                # a moved row changes both its old and its new key
+                hist = inspect(obj).attrs[attr].history
+                keys.update(k for k in chain(hist.added or (), hist.deleted or (), hist.unchanged or ()) if k is not None)
+
+        @event.listens_for(session, 'after_bulk_update')
+        def _after_bulk_update(update_context):
+            watched = self._watched.get(update_context.mapper.local_table.name)
+            if watched:
+                _pending(update_context.session).setdefault(watched[1], set()).add(None)
+
+        @event.listens_for(session, 'after_bulk_delete')
+        def _after_bulk_delete(delete_context):
+            watched = self._watched.get(delete_context.mapper.local_table.name)
+            if watched:
+                _pending(delete_context.session).setdefault(watched[1], set()).add(None)
+
+        @event.listens_for(session, 'after_commit')
+        def _after_commit(sess):
+            pending = sess.info.pop('events_pending', None)
+            if pending:
+                for channel, keys in pending.items():
+                    # one channel-wide event covers every key
+                    self.publish(channel, [None] if None in keys else sorted(keys))
+
+        @event.listens_for(session, 'after_rollback')
+        def _after_rollback(sess):
+            sess.info.pop('events_pending', None)
+
+
+events = EventBus()
@@ -0,0 +1,524 @@
+# Background jobs
+#
+# Long reports and exports run in a pool of worker processes instead of the
+# request thread, so each one can use a whole core and no web thread is held
+# for minutes:
+#
+#   POST /jobs {"kind": "export", "params": {"tables": "members,projects"}}  -> 202, Location: /jobs/<id>.json
+#   GET  /reports/equipment_utilization.json?start=...&background=1          -> 202, same
+#   GET  /jobs/<id>.json        status, progress, message, error
+#   POST /jobs/<id>/cancel
+#   GET  /jobs/<id>/result      the result file once the job is done
+#
+# The Job table (sql/migrations/010) is the source of truth, so any web
+# process can report on any job. Parameters are checked in the submitting
+# process, which records the job as 'queued' and hands its id to the pool.
+# The worker records its progress on the row and writes the result file
+# under JOBS_DIR. A job that has already started can only be cancelled
+# cooperatively: the request sets cancel_requested, and the worker stops at
+# its next progress report. While a job runs, a thread in its worker polls
+# that flag, and a SQLite progress handler interrupts the statement it is
+# running once the flag is set. A cancel that arrives after the last check
+# still wins: the job is only marked done if no cancel was requested, and
+# its result is discarded otherwise.
+#
+# Workers are started with 'spawn' (JOBS_START_METHOD). Forking a web
+# process that is running threads and holding pooled connections is not
+# safe. Each worker builds its own app once with the sweeper turned off.
+# The pool is created on the first submit in each process, so pre-forked
+# web workers each get their own.
+#
+#   python -m app.jobs prune --older-than-hours 168
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import event, select, text, tuple_
+from sqlalchemy.exc import OperationalError
+
+from .metrics import metrics
+from .models import db
+from .writes import WriteBusy, is_busy, write_transaction, writes
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'labmanager.db')
+JOBS_DIR = os.path.join(BASE_DIR, 'jobs')
+FINISHED = ('done', 'failed', 'cancelled')
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes, and between looks at the cancel flag
+CANCEL_CHECK_OPS = 100000  # SQLite VM steps between checks of the cancel flag inside a statement
+EXPORT_CHUNK = 5000
+LIST_LIMIT = 50
+
+# prepare(params) -> normalized params, run in the submitting process (raises ValueError);
+# run(params, progress, path) in a worker, writing the result to path
+Kind = namedtuple('Kind', 'prepare run ext mimetype')
+KINDS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now():
+    return int(time.time())
+
+
+def _owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# ---- job kinds -------------------------------------------------------------------
+
+def _write_json(path, result):
+    with open(path, 'w') as f:
+        json.dump(result, f, separators=(',', ':'), default=str)
+
+
+def _split(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if str(v)]
+    return [v for v in (value or '').split(',') if v]
+
+
+def _prepare_utilization(p):
+    from . import utilization
+    start_d, end_d = utilization.parse_range(p.get('start'), p.get('end'))
+    bucket = p.get('bucket') or 'day'
+    if bucket not in utilization.BUCKETS:
+        raise ValueError(f'bucket must be one of {", ".join(utilization.BUCKETS)}')
+    return {'start': start_d.isoformat(), 'end': end_d.isoformat(), 'equip_ids': _split(p.get('equip_ids')), 'bucket': bucket}
+
+
+def _run_utilization(p, progress, path):
+    from . import utilization
+    from .refcache import refcache
+    equipment = [(e.equip_id, e.name) for e in refcache.get('equipment')]
+    result = utilization.report(date.fromisoformat(p['start']), date.fromisoformat(p['end']), p['equip_ids'],
+                                p['bucket'], equipment=equipment, progress=progress)
+    _write_json(path, result)
+
+
+def _prepare_collaboration(p):
+    from . import collaboration
+    out = {}
+    for name in ('start', 'end'):
+        value = p.get(name)
+        if value and not str(value).isdigit():
+            raise ValueError(f'{name} must be a year')
+        out[name] = int(value) if value else None
+    k = str(p.get('k') or 5)
+    if not k.isdigit() or not 1 <= int(k) <= collaboration.MAX_K:
+        raise ValueError(f'k must be between 1 and {collaboration.MAX_K}')
+    out['k'] = int(k)
+    return out
+
+
+def _run_collaboration(p, progress, path):
+    from . import collaboration
+    _write_json(path, collaboration.report(p['start'], p['end'], p['k'], progress=progress))
+
+
+def _prepare_burndown(p):
+    from . import burndown
+    first, last = burndown.parse_range(p.get('start'), p.get('end'))
+    within = str(p.get('ending_within') or burndown.DEFAULT_ENDING_WITHIN)
+    if not within.isdigit():
+        raise ValueError('ending_within must be a number of days')
+    grant_ids = [g if g.startswith('G') or not g.isdigit() else f'G{g}' for g in _split(p.get('grant_ids'))]
+    return {'start': first, 'end': last, 'grant_ids': grant_ids, 'ending_within': int(within)}
+
+
+def _run_burndown(p, progress, path):
+    from . import burndown
+    _write_json(path, burndown.report(p['start'], p['end'], p['grant_ids'], p['ending_within'], progress=progress))
+
+
+def _prepare_export(p):
+    from . import api
+    tables = _split(p.get('tables')) or list(api.RESOURCES)
+    unknown = [t for t in tables if t not in api.RESOURCES]
+    if unknown:
+        raise ValueError(f'unknown tables: {", ".join(unknown)} (one of {", ".join(api.RESOURCES)})')
+    return {'tables': tables}
+
+
+def _run_export(p, progress, path):
+    # one CSV per read-API resource in a zip, read in key order a chunk at a time so no
+    # read transaction stays open across progress writes
+    from . import api
+    totals = {name: db.session.scalar(select(text('COUNT(*)')).select_from(api._table(name))) for name in p['tables']}
+    db.session.rollback()
+    grand = sum(totals.values()) or 1
+    done = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name in p['tables']:
+            table = api._table(name)
+            cols = api.columns(name)
+            key = [table.c[k] for k in api.key(name)]
+            with zf.open(f'{name}.csv', 'w') as raw:
+                out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                w = csv.writer(out)
+                w.writerow(cols)
+                after = None
+                while True:
+                    stmt = select(*[api._col(table, c) for c in cols]).order_by(*key).limit(EXPORT_CHUNK)
+                    if after is not None:
+                        stmt = stmt.where(tuple_(*key) > tuple_(*after) if len(key) > 1 else key[0] > after[0])
+                    rows = db.session.execute(stmt).all()
+                    db.session.rollback()
+                    w.writerows(rows)
+                    done += len(rows)
+                    progress(done / grand, f'{name}: {done} of {grand} rows')
+                    if len(rows) < EXPORT_CHUNK:
+                        break
+                    last = rows[-1]._mapping
+                    after = [last[c.name] for c in key]
+                out.flush()
+                out.detach()
+
+
+KINDS.update({
+    'equipment_utilization': Kind(_prepare_utilization, _run_utilization, 'json', 'application/json'),
+    'collaboration': Kind(_prepare_collaboration, _run_collaboration, 'json', 'application/json'),
+    'grant_burndown': Kind(_prepare_burndown, _run_burndown, 'json', 'application/json'),
+    'export': Kind(_prepare_export, _run_export, 'zip', 'application/zip'),
+})
+
+
+# ---- worker side -------------------------------------------------------------------
+
+_worker_app = None
+_cancelled = threading.Event()  # the job this worker is running was cancelled
+
+
+def _interruptible(dbapi_conn, record):
+    # a statement of a cancelled job fails with "interrupted"
+    dbapi_conn.set_progress_handler(_cancelled.is_set, CANCEL_CHECK_OPS)
+
+
+def _init_worker(config):
+    global _worker_app
+    from .app import create_app  # app.py imports this module
+    _worker_app = create_app(config)
+    with _worker_app.app_context():
+        event.listen(db.engine, 'connect', _interruptible)
+
+
+def _write(sql, params, retry=True):
+    # one short statement on the Job table in its own transaction; returns its rowcount. Any read
+    # transaction is ended first: upgrading it fails at once instead of waiting
+    # like BEGIN IMMEDIATE does. With the rollback journal the COMMIT also has to
+    # wait for readers, a job's long report query among them, so a busy write is
+    # redone until SQLITE_WRITE_DEADLINE, or given up at once when retry is False.
+    deadline = time.monotonic() + writes.deadline
+    attempt = 0
+    while True:
+        db.session.rollback()
+        try:
+            with write_transaction():
+                rowcount = db.session.execute(text(sql), params).rowcount
+                db.session.commit()
+            return rowcount
+        except (OperationalError, WriteBusy) as ex:
+            db.session.rollback()
+            remaining = deadline - time.monotonic()
+            if not retry or remaining <= 0 or not (isinstance(ex, WriteBusy) or is_busy(ex)):
+                raise
+            metrics.incr('jobs.write_retries')
+            time.sleep(writes.backoff_delay(attempt, remaining))
+            attempt += 1
+
+
+def _set(job_id, retry=True, **fields):
+    # update the job's row; returns whether a cancel was requested
+    sets = ', '.join(f'{k} = :{k}' for k in fields)
+    _write(f'UPDATE Job SET {sets} WHERE job_id = :job_id', dict(fields, job_id=job_id), retry)
+    cancel = db.session.scalar(text('SELECT cancel_requested FROM Job WHERE job_id = :job_id'), {'job_id': job_id})
+    db.session.rollback()
+    return bool(cancel)
+
+
+class Progress:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last = 0.0
+
+    def __call__(self, fraction, message=None, force=False):
+        if _cancelled.is_set():
+            raise JobCancelled()
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        try:
+            cancel = _set(self.job_id, retry=False, progress=round(min(max(fraction, 0.0), 1.0), 4), message=message)
+        except (OperationalError, WriteBusy):
+            # progress is advisory: skip this report rather than hold up the job
+            metrics.incr('jobs.progress_skipped')
+            return
+        if cancel:
+            raise JobCancelled()
+
+
+def result_path(directory, job_id, kind):
+    return os.path.join(directory, f'{job_id}.{KINDS[kind].ext}')
+
+
+class _CancelWatch:
+    # polls the job's cancel flag on a connection of its own while the job runs,
+    # so a cancel also stops a long statement or a phase between progress reports
+    def __init__(self, job_id, database):
+        self.job_id = job_id
+        self.database = database
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='job-cancel-watch', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _poll(self):
+        conn = sqlite3.connect(self.database, timeout=0)
+        try:
+            while not self._stop.wait(PROGRESS_INTERVAL):
+                try:
+                    row = conn.execute('SELECT cancel_requested FROM Job WHERE job_id = ?', (self.job_id,)).fetchone()
+                except sqlite3.OperationalError:
+                    continue  # busy: look again next time
+                if row and row[0]:
+                    _cancelled.set()
+                    return
+        finally:
+            conn.close()
+
+
+def _execute(job_id):
+    _cancelled.clear()
+    with _worker_app.app_context():
+        tmp = None
+        try:
+            row = db.session.execute(text('SELECT kind, params, cancel_requested FROM Job WHERE job_id = :j'), {'j': job_id}).one()
+            db.session.rollback()
+            if row.cancel_requested:
+                raise JobCancelled()
+            if _set(job_id, status='running', started_at=_now()):
+                raise JobCancelled()
+            directory = current_app.config['JOBS_DIR']
+            os.makedirs(directory, exist_ok=True)
+            path = result_path(directory, job_id, row.kind)
+            tmp = path + '.part'
+            with _CancelWatch(job_id, db.engine.url.database):
+                KINDS[row.kind].run(json.loads(row.params), Progress(job_id), tmp)
+            if _cancelled.is_set():
+                raise JobCancelled()
+            os.replace(tmp, path)
+            done = _write("""UPDATE Job SET status = 'done', progress = 1.0, message = NULL, result_file = :f, finished_at = :now
+                             WHERE job_id = :j AND cancel_requested = 0""",
+                          {'f': os.path.basename(path), 'now': _now(), 'j': job_id})
+            if not done:
+                os.remove(path)
+                raise JobCancelled()
+        except Exception as ex:
+            # the interrupted statement of a cancelled job surfaces as an OperationalError
+            cancelled = isinstance(ex, JobCancelled) or _cancelled.is_set()
+            _cancelled.clear()
+            db.session.rollback()
+            if cancelled:
+                _set(job_id, status='cancelled', finished_at=_now())
+            else:
+                _set(job_id, status='failed', error=f'{type(ex).__name__}: {ex}', finished_at=_now())
+        finally:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            db.session.remove()
+
+
+# ---- web side ----------------------------------------------------------------------
+
+def _row_dict(r):
+    return {'job_id': r.job_id, 'kind': r.kind, 'params': json.loads(r.params), 'status': r.status,
+            'progress': r.progress, 'message': r.message, 'error': r.error, 'has_result': r.result_file is not None,
+            'cancel_requested': bool(r.cancel_requested),
+            'created_at': r.created_at, 'started_at': r.started_at, 'finished_at': r.finished_at}
+
+
+class JobRunner:
+    def __init__(self):
+        self.workers = 2
+        self.directory = JOBS_DIR
+        self.start_method = 'spawn'
+        self._config = {}
+        self._pools = {}      # pid -> executor; a forked child never uses its parent's
+        self._futures = {}    # job_id -> future, for jobs submitted by this process
+        self._recovered = set()
+        self._lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app, db):
+        cfg = app.config
+        self.workers = int(cfg.get('JOBS_WORKERS') or self.workers)
+        self.directory = cfg.get('JOBS_DIR') or self.directory
+        self.start_method = cfg.get('JOBS_START_METHOD') or self.start_method
+        # what a worker's own app needs: the same database and write settings, no background threads
+        self._config = {k: v for k, v in cfg.items()
+                        if k == 'SQLALCHEMY_DATABASE_URI' or k.startswith(('SQLITE_', 'REFCACHE_'))}
+        self._config.update(JOBS_DIR=self.directory, OCCUPANCY_SWEEPER=False, EVENTS_CHANGELOG_POLL=0)
+        self._app = app
+        app.extensions['jobs'] = self
+
+    def _pool(self):
+        pid = os.getpid()
+        with self._lock:
+            pool = self._pools.get(pid)
+            if pool is None:
+                ctx = multiprocessing.get_context(self.start_method)
+                pool = ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=_init_worker, initargs=(self._config,))
+                self._pools = {pid: pool}
+            return pool
+
+    def _recover(self):
+        # unfinished jobs owned by a process on this host that no longer exists will never finish
+        pid = os.getpid()
+        if pid in self._recovered:
+            return
+        self._recovered.add(pid)
+        host = socket.gethostname()
+        owners = db.session.scalars(text("SELECT DISTINCT owner FROM Job WHERE status IN ('queued', 'running')")).all()
+        dead = []
+        for owner in owners:
+            h, _, p = (owner or '').rpartition(':')
+            if h == host and p.isdigit() and not _alive(int(p)):
+                dead.append(owner)
+        for owner in dead:
+            _write("""UPDATE Job SET status = 'failed', error = 'interrupted: the process that ran it exited', finished_at = :now
+                      WHERE status IN ('queued', 'running') AND owner = :owner""", {'now': _now(), 'owner': owner})
+
+    def submit(self, kind, params=None):
+        # check the parameters here, record the job and queue it; returns the job as a dict
+        if kind not in KINDS:
+            raise ValueError(f'unknown job kind {kind} (one of {", ".join(KINDS)})')
+        params = KINDS[kind].prepare(dict(params or {}))
+        self._recover()
+        job_id = uuid.uuid4().hex
+        _write('INSERT INTO Job(job_id, kind, params, owner) VALUES (:j, :k, :p, :o)',
+               {'j': job_id, 'k': kind, 'p': json.dumps(params), 'o': _owner()})
+        future = self._pool().submit(_execute, job_id)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda f, j=job_id: self._done(j, f))
+        metrics.incr(f'jobs.{kind}.submitted')
+        return self.get(job_id)
+
+    def _done(self, job_id, future):
+        self._futures.pop(job_id, None)
+        if future.cancelled() or future.exception() is None:
+            return
+        # the worker died (killed, out of memory) before it could record anything
+        metrics.incr('jobs.crashed')
+        with self._lock:
+            self._pools.pop(os.getpid(), None)
+        with self._app.app_context():
+            try:
+                _write("""UPDATE Job SET status = 'failed', error = :e, finished_at = :now
+                          WHERE job_id = :j AND status IN ('queued', 'running')""",
+                       {'e': f'worker crashed: {future.exception()}', 'now': _now(), 'j': job_id})
+            finally:
+                db.session.remove()
+
+    def get(self, job_id):
+        r = db.session.execute(text('SELECT * FROM Job WHERE job_id = :j'), {'j': job_id}).first()
+        return _row_dict(r) if r is not None else None
+
+    def list(self, limit=LIST_LIMIT):
+        rows = db.session.execute(text('SELECT * FROM Job ORDER BY created_at DESC, rowid DESC LIMIT :n'), {'n': limit}).all()
+        return [_row_dict(r) for r in rows]
+
+    def cancel(self, job_id):
+        # returns the job; a queued job this process still holds is dropped from the pool,
+        # anything else is flagged and stopped by its worker
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            _write("UPDATE Job SET status = 'cancelled', finished_at = :now WHERE job_id = :j AND status = 'queued'",
+                   {'now': _now(), 'j': job_id})
+        else:
+            _write("UPDATE Job SET cancel_requested = 1 WHERE job_id = :j AND status IN ('queued', 'running')", {'j': job_id})
+        return self.get(job_id)
+
+    def result(self, job):
+        # (directory, file name, mimetype) of a finished job's result, or None
+        r = db.session.scalar(text('SELECT result_file FROM Job WHERE job_id = :j'), {'j': job['job_id']})
+        if job['status'] != 'done' or not r or not os.path.exists(os.path.join(self.directory, r)):
+            return None
+        return self.directory, r, KINDS[job['kind']].mimetype
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+jobs = JobRunner()
+
+
+# ---- maintenance (sqlite3 connection, like app/changes.py) -----------------------
+
+def prune(conn, directory, older_than_hours=168, now=None):
+    # delete finished jobs older than the window and their result files; returns the count
+    cutoff = (now or _now()) - int(older_than_hours * 3600)
+    rows = conn.execute(f"SELECT job_id, result_file FROM Job WHERE status IN {FINISHED} AND finished_at < ?", (cutoff,)).fetchall()
+    for _, result_file in rows:
+        if result_file:
+            try:
+                os.remove(os.path.join(directory, result_file))
+            except FileNotFoundError:
+                pass
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany('DELETE FROM Job WHERE job_id = ?', [(r[0],) for r in rows])
+    conn.execute('COMMIT')
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the background job table and result files')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--dir', default=os.environ.get('JOBS_DIR', JOBS_DIR))
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('prune', help='delete finished jobs and their results')
+    p.add_argument('--older-than-hours', type=float, default=168)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    t0 = time.perf_counter()
+    removed = prune(conn, args.dir, args.older_than_hours)
+    conn.close()
+    print(f'prune: removed {removed} jobs in {time.perf_counter() - t0:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
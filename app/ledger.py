@@ -0,0 +1,88 @@
+# Grant budget ledger
+#
+# GrantFund.allocated_total holds the sum of the grant's allocations and is
+# maintained by triggers on ProjectGrant (sql/migrations/003_grant_ledger.sql).
+# The BEFORE triggers compare the new total against the budget, so the check
+# and the debit happen in the single INSERT/UPDATE that records the
+# allocation, inside whatever write transaction the caller is in. Two workers
+# allocating from the same grant can't both pass: the second statement sees
+# the first one's total, or waits for its write lock.
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from .models import db
+from .refcache import refcache
+
+BUDGET_ERROR = 'Grant budget exceeded'
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, grant_id, budget, would_be):
+        self.grant_id = grant_id
+        self.budget = budget
+        self.would_be = would_be
+        super().__init__(f'Allocation for grant {grant_id} would exceed its budget (budget={budget}, would be {would_be}).')
+
+
+def remaining(grant_id):
+    # budget left on a grant (None when it has no budget), O(1)
+    row = db.session.execute(text('SELECT budget - allocated_total, budget FROM GrantFund WHERE grant_id = :g'),
+                             {'g': grant_id}).first()
+    if row is None or row[1] is None:
+        return None
+    return row[0]
+
+
+def _exceeded(project_id, grant_id, amount):
+    # rebuild the numbers for the error message from the ledger
+    budget, total = db.session.execute(text('SELECT budget, allocated_total FROM GrantFund WHERE grant_id = :g'),
+                                       {'g': grant_id}).one()
+    current = db.session.execute(text('SELECT amount_allocated FROM ProjectGrant WHERE project_id = :p AND grant_id = :g'),
+                                 {'p': project_id, 'g': grant_id}).scalar() or 0
+    return BudgetExceeded(grant_id, budget, total - current + (amount or 0))
+
+
+def reserve(project_id, grant_id, amount):
+    # set project_id's allocation from grant_id to amount, or raise BudgetExceeded
+    try:
+        with db.session.begin_nested():
+            db.session.execute(text(
+                'INSERT INTO ProjectGrant(project_id, grant_id, amount_allocated) VALUES (:p, :g, :a) '
+                'ON CONFLICT(project_id, grant_id) DO UPDATE SET amount_allocated = excluded.amount_allocated'),
+                {'p': project_id, 'g': grant_id, 'a': amount})
+    except IntegrityError as ex:
+        if BUDGET_ERROR not in str(ex.orig):
+            raise
+        raise _exceeded(project_id, grant_id, amount) from ex
+    refcache.touch(db.session, ('ProjectGrant', 'GrantFund'))
+
+
+def release(project_id, grant_id):
+    db.session.execute(text('DELETE FROM ProjectGrant WHERE project_id = :p AND grant_id = :g'),
+                       {'p': project_id, 'g': grant_id})
+    refcache.touch(db.session, ('ProjectGrant', 'GrantFund'))
+
+
+def apply_allocations(project_id=None, grant_id=None, allocations=()):
+    # replace all allocations of one project (allocations = [(grant_id, amount)])
+    # or of one grant (allocations = [(project_id, amount)]). Removals and
+    # decreases run before increases so funds moved between rows never trip
+    # the budget check halfway through.
+    if project_id is not None:
+        key, other = 'project_id', 'grant_id'
+        pair = lambda o: (project_id, o)
+    else:
+        key, other = 'grant_id', 'project_id'
+        pair = lambda o: (o, grant_id)
+    current = dict(db.session.execute(
+        text(f'SELECT {other}, amount_allocated FROM ProjectGrant WHERE {key} = :k'),
+        {'k': project_id if project_id is not None else grant_id}).all())
+    wanted = dict(allocations)
+    for o in current:
+        if o not in wanted:
+            release(*pair(o))
+    ordered = sorted(wanted.items(), key=lambda kv: (kv[1] or 0) - (current.get(kv[0]) or 0))
+    for o, amount in ordered:
+        if o in current and current[o] == amount:
+            continue
+        reserve(*pair(o), amount)
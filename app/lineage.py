@@ -0,0 +1,170 @@
+# Mentorship lineage
+#
+# MentorshipClosure (sql/migrations/006) has a row for every (ancestor,
+# descendant, depth) reachable through Mentorship and is kept current by
+# triggers, so "every mentor above X" and "everyone below X" are single range
+# reads of its two indexes however deep the tree is. On a database that has
+# not been migrated yet the same answers come from a recursive CTE over
+# Mentorship; which one is used is decided once per engine.
+#
+#   python -m app.lineage verify
+#   python -m app.lineage rebuild
+import argparse
+import os
+import sqlite3
+import time
+
+from sqlalchemy import bindparam, text
+
+from . import changes
+from .models import db
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'labmanager.db')
+MAX_DEPTH = 1000
+MAX_CHAINS = 100
+
+# the whole closure as a recursive walk over Mentorship; used by rebuild() and verify()
+WALK = f'''WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+    SELECT mentor_id, mentee_id, 1 FROM Mentorship
+    UNION ALL
+    SELECT w.ancestor_id, m.mentee_id, w.depth + 1
+    FROM walk w JOIN Mentorship m ON m.mentor_id = w.descendant_id
+    WHERE w.depth < {MAX_DEPTH}
+)'''
+CLOSURE_CTE = WALK + ''',
+closure AS (SELECT ancestor_id, descendant_id, depth, COUNT(*) AS paths FROM walk GROUP BY ancestor_id, descendant_id, depth)'''
+
+# single-member walks for the fallback, starting from the member instead of every edge
+_UP = '''WITH RECURSIVE up(member_id, depth) AS (
+    SELECT mentor_id, 1 FROM Mentorship WHERE mentee_id = :mid
+    UNION ALL
+    SELECT m.mentor_id, up.depth + 1 FROM up JOIN Mentorship m ON m.mentee_id = up.member_id
+    WHERE up.depth < %d
+)
+SELECT member_id AS ancestor_id, {agg}(depth) AS depth FROM up GROUP BY member_id''' % MAX_DEPTH
+_DOWN = '''WITH RECURSIVE down(member_id, depth) AS (
+    SELECT mentee_id, 1 FROM Mentorship WHERE mentor_id = :mid
+    UNION ALL
+    SELECT m.mentee_id, down.depth + 1 FROM down JOIN Mentorship m ON m.mentor_id = down.member_id
+    WHERE down.depth < %d
+)
+SELECT member_id AS descendant_id, {agg}(depth) AS depth FROM down GROUP BY member_id''' % MAX_DEPTH
+
+
+def has_closure():
+    return changes.has_table('MentorshipClosure')
+
+
+def _ancestors_sql(agg='MIN'):
+    # (ancestor_id, depth) for :mid; MIN gives the nearest generation, MAX the longest chain
+    if has_closure():
+        return f'''SELECT ancestor_id, {agg}(depth) AS depth FROM MentorshipClosure
+                   WHERE descendant_id = :mid GROUP BY ancestor_id'''
+    return _UP.format(agg=agg)
+
+
+def _descendants_sql(agg='MIN'):
+    if has_closure():
+        return f'''SELECT descendant_id, {agg}(depth) AS depth FROM MentorshipClosure
+                   WHERE ancestor_id = :mid GROUP BY descendant_id'''
+    return _DOWN.format(agg=agg)
+
+
+def ancestors(member_id):
+    # every mentor above member_id, nearest first: [(member_id, name, member_type, depth)]
+    sql = f'''SELECT a.ancestor_id AS member_id, l.name, l.member_type, a.depth
+              FROM ({_ancestors_sql()}) a LEFT JOIN LabMember l ON l.member_id = a.ancestor_id
+              ORDER BY a.depth, a.ancestor_id'''
+    return db.session.execute(text(sql), {'mid': member_id}).all()
+
+
+def descendants(member_id):
+    # everyone below member_id with their direct mentor inside the subtree, by generation:
+    # [(member_id, name, member_type, depth, mentor_id)]
+    sql = f'''WITH d AS ({_descendants_sql()})
+              SELECT d.descendant_id AS member_id, l.name, l.member_type, d.depth, m.mentor_id
+              FROM d JOIN Mentorship m ON m.mentee_id = d.descendant_id
+              LEFT JOIN LabMember l ON l.member_id = d.descendant_id
+              WHERE m.mentor_id = :mid OR m.mentor_id IN (SELECT descendant_id FROM d)
+              ORDER BY d.depth, m.mentor_id, d.descendant_id'''
+    return db.session.execute(text(sql), {'mid': member_id}).all()
+
+
+def chains(member_id, limit=MAX_CHAINS):
+    # mentor chains from the top of the lineage down to member_id: [[top, ..., direct mentor]]
+    up = [r.ancestor_id for r in db.session.execute(text(_ancestors_sql()), {'mid': member_id})]
+    if not up:
+        return []
+    edges = db.session.execute(
+        text('SELECT mentor_id, mentee_id FROM Mentorship WHERE mentee_id IN :ids')
+        .bindparams(bindparam('ids', expanding=True)), {'ids': up + [member_id]}).all()
+    mentors = {}
+    for e in edges:
+        mentors.setdefault(e.mentee_id, []).append(e.mentor_id)
+    out = []
+    stack = [(member_id, [])]
+    while stack and len(out) < limit:
+        node, path = stack.pop()
+        above = sorted(mentors.get(node, ()), reverse=True)
+        if not above and path:
+            out.append(path[::-1])
+        for m in above:
+            if m not in path:
+                stack.append((m, path + [m]))
+    return sorted(out)
+
+
+def stats(member_id):
+    # depth: generations above the member along its longest chain; subtree_size: everyone below it
+    sql = f'''SELECT (SELECT MAX(depth) FROM ({_ancestors_sql('MAX')})) AS depth,
+                      (SELECT COUNT(*) FROM ({_descendants_sql('MAX')})) AS subtree_size,
+                      (SELECT MAX(depth) FROM ({_descendants_sql('MAX')})) AS generations_below'''
+    r = db.session.execute(text(sql), {'mid': member_id}).one()
+    return {'depth': r.depth or 0, 'subtree_size': r.subtree_size or 0, 'generations_below': r.generations_below or 0}
+
+
+# ---- maintenance (sqlite3 connection, like app/archive.py) ---------------------
+
+def rebuild(conn):
+    # recompute MentorshipClosure from Mentorship; returns the number of rows
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM MentorshipClosure')
+        conn.execute(f'{CLOSURE_CTE} INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths) SELECT * FROM closure')
+        n = conn.execute('SELECT COUNT(*) FROM MentorshipClosure').fetchone()[0]
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return n
+
+
+def verify(conn):
+    # (missing, extra): rows the walk produces that the table lacks, and the reverse
+    missing = conn.execute(f'{CLOSURE_CTE} SELECT COUNT(*) FROM (SELECT * FROM closure EXCEPT SELECT * FROM MentorshipClosure)').fetchone()[0]
+    extra = conn.execute(f'{CLOSURE_CTE} SELECT COUNT(*) FROM (SELECT * FROM MentorshipClosure EXCEPT SELECT * FROM closure)').fetchone()[0]
+    return missing, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check or rebuild the mentorship closure table')
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('verify', help='compare MentorshipClosure with a walk over Mentorship')
+    sub.add_parser('rebuild', help='recompute MentorshipClosure from Mentorship')
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    t0 = time.perf_counter()
+    if args.cmd == 'rebuild':
+        print(f'rebuild: {rebuild(conn)} closure rows in {time.perf_counter() - t0:.2f}s')
+    else:
+        missing, extra = verify(conn)
+        print(f'verify: {missing} missing, {extra} extra closure rows in {time.perf_counter() - t0:.2f}s')
+        if missing or extra:
+            raise SystemExit(1)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
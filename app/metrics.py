@@ -0,0 +1,41 @@
+# Lightweight in-process metrics registry (counters and timings)
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value):
+        # keep count/sum/max so averages and worst cases can be reported
+        with self._lock:
+            t = self._timings.get(name)
+            if t is None:
+                self._timings[name] = {'count': 1, 'sum': value, 'max': value}
+            else:
+                t['count'] += 1
+                t['sum'] += value
+                if value > t['max']:
+                    t['max'] = value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': {k: dict(v) for k, v in self._timings.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
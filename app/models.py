@@ -1,8 +1,28 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import calendar
 
 db = SQLAlchemy()
 
+# Companion *_ts columns (sql/migrations/001) hold seconds since 1970 with naive
+# timestamps read as UTC; a missing end is stored as the largest INTEGER.
+OPEN_END_TS = 9223372036854775807
+DAY_SECONDS = 86400
+
+def to_epoch(value):
+    # same encoding as SQLite strftime('%s', ...) so Python and SQL values compare directly
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return calendar.timegm(value.timetuple())
+
+def _epoch_expr(col):
+    return f"CAST(strftime('%s', {col}) AS INTEGER)"
+
+def _open_end_expr(col):
+    return f"COALESCE(CAST(strftime('%s', {col}) AS INTEGER), {OPEN_END_TS})"
+
 class LabMember(db.Model):
     __tablename__ = 'LabMember'
     member_id = db.Column(db.String, primary_key=True)
@@ -42,6 +62,8 @@ class Project(db.Model):
     expected_duration = db.Column(db.Integer)
     status = db.Column(db.String, nullable=False)
     leader_id = db.Column(db.String, db.ForeignKey('Faculty.member_id'), nullable=False)
+    start_ts = db.Column(db.Integer, db.Computed(_epoch_expr('start_date'), persisted=False))
+    end_ts = db.Column(db.Integer, db.Computed(_open_end_expr('end_date'), persisted=False))
 
 class GrantFund(db.Model):
     __tablename__ = 'GrantFund'
@@ -50,6 +72,8 @@ class GrantFund(db.Model):
     budget = db.Column(db.Float)
     start_date = db.Column(db.Date)
     duration = db.Column(db.Integer)
+    # running sum of ProjectGrant.amount_allocated, maintained by triggers (see app/ledger.py)
+    allocated_total = db.Column(db.Float, nullable=False, server_default='0')
 
 class ProjectGrant(db.Model):
     __tablename__ = 'ProjectGrant'
@@ -82,6 +106,45 @@ class EquipmentUse(db.Model):
     use_start = db.Column(db.DateTime)
     use_end = db.Column(db.DateTime)
     purpose = db.Column(db.String)
+    use_start_ts = db.Column(db.Integer, db.Computed(_epoch_expr('use_start'), persisted=False))
+    use_end_ts = db.Column(db.Integer, db.Computed(_open_end_expr('use_end'), persisted=False))
+
+class EquipmentOccupancy(db.Model):
+    # bookings active right now per equipment, kept by triggers and app/occupancy.py (sql/migrations/005)
+    __tablename__ = 'EquipmentOccupancy'
+    equip_id = db.Column(db.String, db.ForeignKey('Equipment.equip_id'), primary_key=True)
+    active_count = db.Column(db.Integer, nullable=False, server_default='0')
+    active_use_ids = db.Column(db.Text, nullable=False, server_default='[]')
+    valid_until = db.Column(db.Integer)
+    computed_at = db.Column(db.Integer, nullable=False, server_default='0')
+
+class EquipmentUseArchive(db.Model):
+    # completed bookings moved out of EquipmentUse by app/archive.py
+    __tablename__ = 'EquipmentUseArchive'
+    use_id = db.Column(db.String, primary_key=True)
+    equip_id = db.Column(db.String, db.ForeignKey('Equipment.equip_id'))
+    member_id = db.Column(db.String, db.ForeignKey('LabMember.member_id'))
+    use_start = db.Column(db.DateTime)
+    use_end = db.Column(db.DateTime)
+    purpose = db.Column(db.String)
+    archived_at = db.Column(db.DateTime)
+    use_start_ts = db.Column(db.Integer, db.Computed(_epoch_expr('use_start'), persisted=False))
+    use_end_ts = db.Column(db.Integer, db.Computed(_epoch_expr('use_end'), persisted=False))
+
+# read-only view: EquipmentUse UNION ALL EquipmentUseArchive (sql/migrations/002)
+equipment_use_history = db.Table(
+    'EquipmentUseHistory', db.metadata,
+    db.Column('use_id', db.String, primary_key=True),
+    db.Column('equip_id', db.String),
+    db.Column('member_id', db.String),
+    db.Column('use_start', db.DateTime),
+    db.Column('use_end', db.DateTime),
+    db.Column('purpose', db.String),
+    db.Column('use_start_ts', db.Integer),
+    db.Column('use_end_ts', db.Integer),
+    db.Column('archived', db.Integer),
+    info={'is_view': True},
+)
 
 class Publication(db.Model):
     __tablename__ = 'Publication'
@@ -106,7 +169,40 @@ class Mentorship(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=True)
     notes = db.Column(db.Text, nullable=True)
+    start_ts = db.Column(db.Integer, db.Computed(_epoch_expr('start_date'), persisted=False))
+    end_ts = db.Column(db.Integer, db.Computed(_open_end_expr('end_date'), persisted=False))
 
     # relationships for convenience
     mentor = db.relationship('LabMember', foreign_keys=[mentor_id], backref='mentees')
     mentee = db.relationship('LabMember', foreign_keys=[mentee_id], backref='mentors')
+
+class MentorshipClosure(db.Model):
+    # (ancestor, descendant, depth) over Mentorship, kept by triggers; read via app/lineage.py (sql/migrations/006)
+    __tablename__ = 'MentorshipClosure'
+    ancestor_id = db.Column(db.String, primary_key=True)
+    descendant_id = db.Column(db.String, primary_key=True)
+    depth = db.Column(db.Integer, primary_key=True)
+    paths = db.Column(db.Integer, nullable=False, server_default='1')
+
+class CoAuthorEdge(db.Model):
+    # papers per co-author pair and publication year, kept by triggers; read via app/collaboration.py (sql/migrations/007)
+    __tablename__ = 'CoAuthorEdge'
+    member_a = db.Column(db.String, primary_key=True)
+    member_b = db.Column(db.String, primary_key=True)
+    period = db.Column(db.Integer, primary_key=True)
+    papers = db.Column(db.Integer, nullable=False, server_default='1')
+
+class ChangeLog(db.Model):
+    # appended by triggers on every table (sql/migrations/004); read via app/changes.py
+    __tablename__ = 'ChangeLog'
+    seq = db.Column(db.Integer, primary_key=True)
+    tbl = db.Column(db.String, nullable=False)
+    op = db.Column(db.String(1), nullable=False)
+    pk = db.Column(db.String, nullable=False)
+    cols = db.Column(db.String)
+    changed_at = db.Column(db.Integer, nullable=False)
+
+class ChangeLogMeta(db.Model):
+    __tablename__ = 'ChangeLogMeta'
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,228 @@
+# Current equipment occupancy
+#
+# EquipmentOccupancy (sql/migrations/005) keeps, for every equipment, the
+# bookings active right now and valid_until, the epoch second at which that
+# stops being true (the next booking start or end). Triggers refresh a row
+# when its bookings are written, so current() is a primary-key read. A row
+# past its valid_until is recomputed from equipment_occupancy_now on read,
+# which keeps answers right even when nothing has swept it yet.
+#
+# The sweeper thread keeps the rows (and with them the derived
+# Equipment.status) current as time passes. Every row's valid_until goes on
+# a hashed timing wheel; each tick only looks at one slot, and the rows due
+# in it are refreshed in one write transaction and put back on the wheel at
+# their new valid_until. Local booking commits reach it through the event
+# bus; writes from other processes are picked up by a periodic reload (or
+# sooner with EVENTS_CHANGELOG_POLL).
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+from .events import events
+from .metrics import metrics
+from .models import db, to_epoch
+from .writes import write_transaction
+
+LIMIT = 3
+
+Occupancy = namedtuple('Occupancy', 'equip_id status active_count active_use_ids valid_until')
+
+
+def now_ts():
+    return to_epoch(datetime.now())
+
+
+def _derived_status(db_status, active_count):
+    if db_status == 'retired':
+        return 'retired'
+    return 'in use' if active_count > 0 else 'available'
+
+
+def _in(sql):
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+
+def current(equip_ids=None, now=None):
+    # {equip_id: Occupancy} for the given equipment (all when None)
+    now = now_ts() if now is None else now
+    sql = '''SELECT e.equip_id, e.status, o.equip_id AS has_row, o.active_count, o.active_use_ids, o.valid_until
+             FROM Equipment e LEFT JOIN EquipmentOccupancy o ON o.equip_id = e.equip_id'''
+    if equip_ids:
+        rows = db.session.execute(_in(sql + ' WHERE e.equip_id IN :ids'), {'ids': list(equip_ids)}).all()
+    else:
+        rows = db.session.execute(text(sql)).all()
+    stale = [r.equip_id for r in rows if r.has_row is None or (r.valid_until is not None and r.valid_until <= now)]
+    fresh = {}
+    if stale:
+        metrics.incr('occupancy.stale_reads', len(stale))
+        fresh = {r.equip_id: r for r in db.session.execute(
+            _in('SELECT equip_id, active_count, active_use_ids, valid_until FROM equipment_occupancy_now WHERE equip_id IN :ids'),
+            {'ids': stale})}
+    out = {}
+    for r in rows:
+        src = fresh.get(r.equip_id, r)
+        count = int(src.active_count or 0)
+        out[r.equip_id] = Occupancy(r.equip_id, _derived_status(r.status, count), count,
+                                    json.loads(src.active_use_ids or '[]'), src.valid_until)
+    return out
+
+
+def refresh(equip_ids):
+    # recompute the rows as of now; returns {equip_id: valid_until}
+    with write_transaction():
+        try:
+            db.session.execute(_in('''UPDATE EquipmentOccupancy SET (active_count, active_use_ids, valid_until, computed_at) =
+                                          (SELECT active_count, active_use_ids, valid_until, computed_at
+                                           FROM equipment_occupancy_now v WHERE v.equip_id = EquipmentOccupancy.equip_id)
+                                      WHERE equip_id IN :ids'''), {'ids': list(equip_ids)})
+            rows = db.session.execute(_in('SELECT equip_id, valid_until FROM EquipmentOccupancy WHERE equip_id IN :ids'),
+                                      {'ids': list(equip_ids)}).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    metrics.incr('occupancy.refreshed', len(rows))
+    return {r.equip_id: r.valid_until for r in rows}
+
+
+class TimingWheel:
+    # Hashed timing wheel: `slots` buckets of `tick` seconds each. A deadline
+    # goes in bucket (deadline // tick) % slots; one further out than a full
+    # revolution simply stays put until the cursor reaches it on a later lap.
+    def __init__(self, tick=1, slots=512):
+        self.tick = tick
+        self.slots = slots
+        self._buckets = [{} for _ in range(slots)]
+        self._where = {}
+        self._cursor = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        n = int(deadline // self.tick)
+        if self._cursor is not None and n <= self._cursor:
+            n = self._cursor + 1  # already due: fire on the next advance
+        slot = n % self.slots
+        self._buckets[slot][key] = deadline
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._buckets[slot].pop(key, None)
+
+    def clear(self):
+        for b in self._buckets:
+            b.clear()
+        self._where.clear()
+
+    def advance(self, now):
+        # keys whose deadline is <= now, visiting only the slots passed since the last call
+        target = int(now // self.tick)
+        if self._cursor is None:
+            self._cursor = target - 1
+        if target - self._cursor >= self.slots:
+            slots = range(self.slots)  # fell a whole lap behind: check everything once
+        else:
+            slots = (n % self.slots for n in range(self._cursor + 1, target + 1))
+        self._cursor = max(self._cursor, target)
+        due = []
+        for slot in slots:
+            bucket = self._buckets[slot]
+            for key in [k for k, d in bucket.items() if d <= now]:
+                del bucket[key]
+                del self._where[key]
+                due.append(key)
+        return due
+
+
+class OccupancySweeper:
+    def __init__(self):
+        self.enabled = False
+        self.tick = 1
+        self.resync = 300.0
+        self._started = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db):
+        cfg = app.config
+        self.enabled = bool(cfg.get('OCCUPANCY_SWEEPER'))
+        self.tick = int(cfg.get('OCCUPANCY_SWEEP_TICK') or self.tick)
+        self.resync = float(cfg.get('OCCUPANCY_RESYNC') or self.resync)
+        app.extensions['occupancy'] = self
+        if self.enabled:
+            # started from the first request so each pre-forked worker gets its own thread
+            app.before_request(lambda: self.ensure_started(app))
+
+    def ensure_started(self, app):
+        key = (os.getpid(), id(app))
+        if key in self._started:
+            return
+        with self._lock:
+            if key in self._started:
+                return
+            self._started.add(key)
+            threading.Thread(target=self._run, args=(app,), name='occupancy-sweeper', daemon=True).start()
+
+    def _load(self, wheel, equip_ids=None):
+        sql = 'SELECT equip_id, valid_until FROM EquipmentOccupancy'
+        if equip_ids:
+            rows = db.session.execute(_in(sql + ' WHERE equip_id IN :ids'), {'ids': list(equip_ids)}).all()
+        else:
+            wheel.clear()
+            rows = db.session.execute(text(sql)).all()
+        db.session.rollback()
+        self._schedule(wheel, {r.equip_id: r.valid_until for r in rows})
+
+    def _schedule(self, wheel, deadlines):
+        for eid, until in deadlines.items():
+            if until is None:
+                wheel.cancel(eid)
+            else:
+                wheel.schedule(eid, until)
+
+    def _run(self, app):
+        wheel = TimingWheel(self.tick)
+        sub = events.subscribe('equipment', capped=False)
+        reload_at = 0
+        try:
+            while True:
+                with app.app_context():
+                    try:
+                        now = now_ts()
+                        if now >= reload_at:
+                            self._load(wheel)
+                            reload_at = now + self.resync
+                        due = wheel.advance(now)
+                        if due:
+                            self._schedule(wheel, refresh(due))
+                    except Exception:
+                        # e.g. the database has not been migrated yet; try again at the next reload
+                        metrics.incr('occupancy.sweep_errors')
+                        reload_at = now_ts() + self.resync
+                    finally:
+                        db.session.remove()
+                keys = sub.wait(self.tick)
+                if keys:
+                    # local commits already refreshed the rows; pick up their new valid_until
+                    with app.app_context():
+                        try:
+                            if None in keys:
+                                reload_at = 0
+                            else:
+                                self._load(wheel, sorted(keys))
+                        except Exception:
+                            metrics.incr('occupancy.sweep_errors')
+                        finally:
+                            db.session.remove()
+        finally:
+            events.unsubscribe(sub)
+
+
+sweeper = OccupancySweeper()
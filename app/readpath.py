@@ -0,0 +1,28 @@
+# ORM-free read path for list pages
+#
+# Large "view all" pages only print a few columns per row, so hydrating an
+# identity-mapped ORM object for each row is wasted work. These helpers run a
+# Core select() and hand back plain Row tuples, which templates can read with
+# the same attribute syntax (m.member_id, p.title) as the mapped classes.
+from sqlalchemy import select
+
+from .models import db
+
+
+def select_columns(model, columns=None, order_by=None):
+    cols = [getattr(model, c) for c in columns] if columns else list(model.__table__.columns)
+    stmt = select(*cols)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    return stmt
+
+
+def fetch_rows(model, columns=None, order_by=None):
+    return db.session.execute(select_columns(model, columns, order_by)).all()
+
+
+def iter_rows(stmt, batch_size=500):
+    # stream rows off the cursor in batches instead of materializing the result
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for row in result:
+        yield row
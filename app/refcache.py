@@ -0,0 +1,192 @@
+# Process-local cache for small reference sets (faculty, grants, projects, ...)
+#
+# Entries are stored as tuples of namedtuples so templates can keep using
+# attribute access (f.member_id, g.source) without holding ORM instances.
+# Each entry remembers the versions of the tables it was loaded from; a
+# commit touching one of those tables bumps its version and the next get()
+# reloads. Versions live in a dict by default, or in a small mmap'd file when
+# REFCACHE_SHARED_PATH is set so that several worker processes see each
+# other's commits. Entries and versions belong to the app (app.extensions),
+# so two apps on different databases in one process never share a list;
+# the registered sets and the session hooks are shared.
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event, select
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, bumps are best-effort
+    fcntl = None
+
+
+class LocalVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, tables):
+        with self._lock:
+            for t in tables:
+                self._versions[t] = self._versions.get(t, 0) + 1
+
+
+class SharedVersions:
+    # one unsigned 64-bit counter per table, in sorted table-name order
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path, tables):
+        self.index = {t: i for i, t in enumerate(sorted(tables))}
+        size = self.SLOT.size * max(len(self.index), 1)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._lock_path = path + '.lock'
+        self._thread_lock = threading.Lock()
+
+    def get(self, table):
+        i = self.index.get(table)
+        if i is None:
+            return 0
+        return self.SLOT.unpack_from(self._mm, i * self.SLOT.size)[0]
+
+    def bump(self, tables):
+        with self._thread_lock:
+            lock_f = open(self._lock_path, 'a') if fcntl else None
+            try:
+                if lock_f:
+                    fcntl.flock(lock_f, fcntl.LOCK_EX)
+                for t in tables:
+                    i = self.index.get(t)
+                    if i is None:
+                        continue
+                    off = i * self.SLOT.size
+                    self.SLOT.pack_into(self._mm, off, self.SLOT.unpack_from(self._mm, off)[0] + 1)
+            finally:
+                if lock_f:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+                    lock_f.close()
+
+
+class _AppCache:
+    # one app's entries and table versions
+    def __init__(self, versions):
+        self.versions = versions
+        self.entries = {}
+        self.lock = threading.Lock()
+
+
+class ReferenceCache:
+    def __init__(self):
+        self._sets = {}
+        self._db = None
+        self._hooked = False
+
+    def init_app(self, app, db):
+        self._db = db
+        path = app.config.get('REFCACHE_SHARED_PATH')
+        versions = SharedVersions(path, db.metadata.tables.keys()) if path else LocalVersions()
+        app.extensions['refcache'] = _AppCache(versions)
+        # db.session is shared by every app, so its listeners go on once
+        if not self._hooked:
+            self._install_hooks(db)
+            self._hooked = True
+
+    def _cache(self):
+        return current_app.extensions['refcache']
+
+    def register(self, name, model, order_by=None, tables=None):
+        cols = list(model.__table__.columns)
+        record = namedtuple(f'{model.__name__}Ref', [c.key for c in cols])
+        stmt = select(*cols)
+        if order_by is not None:
+            stmt = stmt.order_by(order_by)
+        deps = tuple(tables or (model.__tablename__,))
+        self._sets[name] = (record, stmt, deps)
+
+    def get(self, name):
+        record, stmt, deps = self._sets[name]
+        cache = self._cache()
+        version = tuple(cache.versions.get(t) for t in deps)
+        entry = cache.entries.get(name)
+        if entry is not None and entry[0] == version:
+            metrics.incr(f'refcache.{name}.hits')
+            return entry[1]
+        metrics.incr(f'refcache.{name}.misses')
+        # version is read before loading so a concurrent commit forces a reload
+        rows = tuple(record(*r) for r in self._db.session.execute(stmt))
+        with cache.lock:
+            cache.entries[name] = (version, rows)
+        return rows
+
+    def load_all(self):
+        # every registered set, e.g. while a worker warms up
+        for name in self._sets:
+            self.get(name)
+
+    def touch(self, sess, tables):
+        # for writes the flush hooks can't see (raw SQL, trigger side effects)
+        sess.info.setdefault('refcache_touched', set()).update(tables)
+
+    def invalidate(self, tables=None):
+        if tables is None:
+            tables = self._db.metadata.tables.keys()
+        self._cache().versions.bump(tables)
+
+    def stats(self):
+        counters = metrics.snapshot()['counters']
+        out = {}
+        for name in self._sets:
+            hits = counters.get(f'refcache.{name}.hits', 0)
+            misses = counters.get(f'refcache.{name}.misses', 0)
+            total = hits + misses
+            out[name] = {'hits': hits, 'misses': misses, 'hit_rate': (hits / total) if total else None}
+        return out
+
+    def _install_hooks(self, db):
+        session = db.session
+
+        def _touched(sess):
+            return sess.info.setdefault('refcache_touched', set())
+
+        @event.listens_for(session, 'after_flush')
+        def _after_flush(sess, flush_context):
+            touched = _touched(sess)
+            for obj in list(sess.new) + list(sess.dirty) + list(sess.deleted):
+                table = getattr(obj, '__tablename__', None)
+                if table:
+                    touched.add(table)
+
+        @event.listens_for(session, 'after_bulk_update')
+        def _after_bulk_update(update_context):
+            _touched(update_context.session).add(update_context.mapper.local_table.name)
+
+        @event.listens_for(session, 'after_bulk_delete')
+        def _after_bulk_delete(delete_context):
+            _touched(delete_context.session).add(delete_context.mapper.local_table.name)
+
+        @event.listens_for(session, 'after_commit')
+        def _after_commit(sess):
+            touched = sess.info.pop('refcache_touched', None)
+            if touched:
+                self._cache().versions.bump(touched)
+
+        @event.listens_for(session, 'after_rollback')
+        def _after_rollback(sess):
+            sess.info.pop('refcache_touched', None)
+
+
+refcache = ReferenceCache()
@@ -0,0 +1,20 @@
+# Streaming template rendering for large list pages
+#
+# render_template() builds the whole document before sending a byte. For
+# long tables we instead let Jinja generate the page incrementally and hand
+# the generator to the WSGI server, so the header and the first rows reach
+# the browser while later rows are still being read from the cursor.
+from flask import Response, current_app, get_flashed_messages, stream_with_context
+
+
+def stream_page(template_name, **context):
+    app = current_app._get_current_object()
+    # flashes live in the session cookie, which is sent with the headers; pop
+    # them now (Flask caches them on the request) so they are not shown twice
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+    stream = template.stream(context)
+    # group small template events into chunks of N before each write
+    stream.enable_buffering(app.config.get('STREAM_BUFFER_SIZE', 50))
+    return Response(stream_with_context(stream), mimetype='text/html')
@@ -0,0 +1,134 @@
+# Project activity over time
+#
+# /project/status answers one project at one instant. For timelines the
+# batch endpoint reads every requested project in one query and evaluates
+# the same rule as /project/status (status is 'active' and the day lies
+# within [start_date, end_date], open-ended when end_date is NULL) for all
+# instants at once as a numpy (projects x instants) boolean matrix. Each
+# project's row goes out as a string of 0/1 characters, so 500 projects over
+# a year of days is ~180 KB of JSON.
+#
+# Project.status has no history, so the status column is the current one.
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from .models import db, to_epoch, DAY_SECONDS
+
+MAX_INSTANTS = 5000
+MAX_CELLS = 5_000_000
+STEP_UNITS = {'h': timedelta(hours=1), 'd': timedelta(days=1), 'w': timedelta(weeks=1)}
+
+
+def normalize_id(pid):
+    # accept either numeric id or prefixed id like P1, as /project/status does
+    pid = pid.strip()
+    return f'P{pid}' if pid.isdigit() else pid
+
+
+def _as_list(value, name):
+    # ids or instants from a JSON list, or a comma separated string as in the query string
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        return [v for v in value.split(',') if v.strip()]
+    if not isinstance(value, list) or any(isinstance(v, bool) or not isinstance(v, (str, int)) for v in value):
+        raise ValueError(f'{name} must be a list or a comma separated string')
+    return [str(v) for v in value]
+
+
+def _as_text(value, name):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f'{name} must be a string')
+
+
+def parse_step(step):
+    m = re.fullmatch(r'(\d+)([hdw])', (step or '1d').strip().lower())
+    if not m or int(m.group(1)) == 0:
+        raise ValueError('step must look like 12h, 1d or 2w')
+    return int(m.group(1)) * STEP_UNITS[m.group(2)]
+
+
+def _parse_instant(value, name):
+    try:
+        return datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ValueError(f'{name} must be an ISO date or datetime') from None
+
+
+def instants(when=None, start=None, end=None, step=None):
+    # explicit list of instants, or start..end (inclusive) every step
+    if when:
+        out = [_parse_instant(w, 'when') for w in when]
+    elif start and end:
+        t, stop, delta = _parse_instant(start, 'start'), _parse_instant(end, 'end'), parse_step(step)
+        if stop < t:
+            raise ValueError('end is before start')
+        if (stop - t) // delta + 1 > MAX_INSTANTS:
+            raise ValueError(f'at most {MAX_INSTANTS} instants; use a larger step')
+        out = []
+        while t <= stop:
+            out.append(t)
+            t += delta
+    else:
+        raise ValueError('give either when=... or start, end and step')
+    if len(out) > MAX_INSTANTS:
+        raise ValueError(f'at most {MAX_INSTANTS} instants')
+    return out
+
+
+def load_projects(project_ids=None, status=None, leader_id=None):
+    sql = 'SELECT project_id, status, start_ts, end_ts FROM Project WHERE 1 = 1'
+    params = {}
+    if project_ids is not None:
+        sql += ' AND project_id IN :ids'
+        params['ids'] = list(project_ids)
+    if status:
+        sql += ' AND status = :status'
+        params['status'] = status
+    if leader_id:
+        sql += ' AND leader_id = :leader'
+        params['leader'] = leader_id
+    stmt = text(sql + ' ORDER BY project_id')
+    if project_ids is not None:
+        stmt = stmt.bindparams(bindparam('ids', expanding=True))
+    return db.session.execute(stmt, params).all()
+
+
+def active_matrix(rows, when):
+    # (projects x instants) bool: active status and start_date <= day <= end_date
+    day = np.array([to_epoch(w) for w in when], dtype=np.int64) // DAY_SECONDS
+    is_active = np.array([r.status == 'active' for r in rows], dtype=bool)
+    # start_ts is NULL only for rows that break the NOT NULL rule; they are never active
+    start_day = np.array([r.start_ts if r.start_ts is not None else np.iinfo(np.int64).max for r in rows], dtype=np.int64) // DAY_SECONDS
+    end_day = np.array([r.end_ts for r in rows], dtype=np.int64) // DAY_SECONDS
+    return is_active[:, None] & (start_day[:, None] <= day[None, :]) & (day[None, :] <= end_day[:, None])
+
+
+def batch(project_ids=None, status=None, leader_id=None, when=None, start=None, end=None, step=None):
+    # the arguments come straight from a query string or a JSON body
+    project_ids, when = _as_list(project_ids, 'project_ids'), _as_list(when, 'when')
+    status, leader_id, start, end, step = (_as_text(v, n) for v, n in (
+        (status, 'status'), (leader_id, 'leader_id'), (start, 'start'), (end, 'end'), (step, 'step')))
+    times = instants(when, start, end, step)
+    ids = None if project_ids is None else sorted({normalize_id(p) for p in project_ids if p.strip()})
+    rows = load_projects(ids, status, leader_id)
+    if len(rows) * len(times) > MAX_CELLS:
+        raise ValueError(f'{len(rows)} projects x {len(times)} instants is more than {MAX_CELLS} cells')
+    active = active_matrix(rows, times)
+    bits = (active.astype(np.uint8) + ord('0'))
+    found = {r.project_id for r in rows}
+    return {
+        'instants': [t.isoformat() for t in times],
+        'projects': [r.project_id for r in rows],
+        'status': [r.status for r in rows],
+        'active': [row.tobytes().decode('ascii') for row in bits],
+        'active_count': active.sum(axis=0).tolist(),
+        # requested ids that don't exist or don't match the filters
+        'missing': [p for p in ids if p not in found] if ids is not None else [],
+    }
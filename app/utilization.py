@@ -0,0 +1,203 @@
+# Equipment utilization analytics
+#
+# Loads the bookings overlapping a date range from EquipmentUseHistory (hot
+# and archived) into columnar arrays and runs one vectorized sweep line over
+# all equipment at once: booking starts are +1 events and ends are -1
+# events. The events are sorted by (equipment, time) and the running sum
+# gives the number of concurrent users on every segment between two events.
+# Each equipment's events sum to zero, so one global cumsum restarts at every
+# equipment boundary. From the segments we get busy time, peak concurrency
+# and idle gaps. Integrals at bucket edges (found with a single searchsorted
+# over (equipment, time) keys) give the hourly and daily histograms and the
+# weekday x hour heatmap.
+#
+# Times are epoch seconds in the same local-as-UTC encoding as the *_ts
+# columns. Bookings count over [start, end). Open-ended bookings run until now.
+# Results are cached per data version (changes.VersionedCache), so repeated
+# report views cost one ChangeLog lookup.
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from . import changes
+from .metrics import metrics
+from .models import DAY_SECONDS, OPEN_END_TS, db, to_epoch
+
+HOUR_SECONDS = 3600
+BUCKETS = {'hour': HOUR_SECONDS, 'day': DAY_SECONDS}
+MAX_DAYS = 366
+MAX_HISTOGRAM_BINS = 24 * 62
+LIMIT = 3
+TABLES = ('EquipmentUse', 'EquipmentUseArchive', 'Equipment')
+EPOCH = datetime(1970, 1, 1)
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+_cache = changes.VersionedCache(TABLES)
+
+
+def parse_range(start, end, today=None):
+    # [start 00:00, end + 1 day 00:00) from YYYY-MM-DD strings; defaults to the last 30 days
+    today = today or date.today()
+    end_d = date.fromisoformat(end) if end else today
+    start_d = date.fromisoformat(start) if start else end_d - timedelta(days=29)
+    if end_d < start_d:
+        raise ValueError('end is before start')
+    if (end_d - start_d).days + 1 > MAX_DAYS:
+        raise ValueError(f'range is limited to {MAX_DAYS} days')
+    return start_d, end_d
+
+
+def load_bookings(t0, t1, equip_ids=None):
+    sql = '''SELECT equip_id, use_start_ts, use_end_ts FROM EquipmentUseHistory
+             WHERE use_end_ts >= :t0 AND use_start_ts < :t1'''
+    params = {'t0': t0, 't1': t1}
+    stmt = text(sql)
+    if equip_ids:
+        stmt = text(sql + ' AND equip_id IN :ids').bindparams(bindparam('ids', expanding=True))
+        params['ids'] = list(equip_ids)
+    return pd.read_sql_query(stmt, db.session.connection(), params=params,
+                             dtype={'use_start_ts': 'int64', 'use_end_ts': 'int64'})
+
+
+def sweep(codes, starts, ends, n_equip, t0, t1):
+    # segments of constant concurrency per equipment covering [t0, t1];
+    # starts/ends must already be clipped to the window with starts < ends
+    n = len(codes)
+    ev_code = np.concatenate([codes, codes, np.arange(n_equip), np.arange(n_equip)])
+    ev_time = np.concatenate([starts, ends, np.full(n_equip, t0), np.full(n_equip, t1)])
+    ev_delta = np.concatenate([np.ones(n, np.int64), -np.ones(n, np.int64), np.zeros(2 * n_equip, np.int64)])
+    # equipment, then time, then ends before starts so back-to-back bookings don't overlap
+    order = np.lexsort((ev_delta, ev_time, ev_code))
+    code, time, level = ev_code[order], ev_time[order], np.cumsum(ev_delta[order])
+    dur = np.diff(time)
+    dur[code[1:] != code[:-1]] = 0
+    seg = level[:-1]
+    return {
+        'code': code, 'time': time, 'level': level, 'dur': dur,
+        # integral of users and of "at least one user" up to each event (global, see eval_integral)
+        'users': np.concatenate([[0], np.cumsum(dur * seg)]),
+        'busy': np.concatenate([[0], np.cumsum(dur * (seg > 0))]),
+    }
+
+
+def eval_integral(sw, kind, n_equip, t0, t1, edges):
+    # users / busy seconds of each equipment from t0 to every edge: array (n_equip, len(edges))
+    cum = sw[kind]
+    rate = sw['level'] if kind == 'users' else (sw['level'] > 0)
+    span = t1 - t0 + 1
+    keys = sw['code'] * span + (sw['time'] - t0)
+    q = (np.arange(n_equip)[:, None] * span + (edges[None, :] - t0)).ravel()
+    idx = np.searchsorted(keys, q, side='right') - 1
+    vals = cum[idx] + rate[idx] * (np.tile(edges, n_equip) - sw['time'][idx])
+    vals = vals.reshape(n_equip, len(edges)).astype(float)
+    return vals - vals[:, :1]
+
+
+def compute(equipment, bookings, t0, t1, bucket, now):
+    # equipment: [(equip_id, name)]; bookings: DataFrame from load_bookings()
+    ids = [e[0] for e in equipment]
+    n_equip = len(ids)
+    index = pd.Index(ids)
+    codes = index.get_indexer(bookings['equip_id'])
+    starts = bookings['use_start_ts'].to_numpy()
+    ends = bookings['use_end_ts'].to_numpy()
+    ends = np.where(ends == OPEN_END_TS, max(min(now, t1), t0), ends)
+    starts, ends = np.clip(starts, t0, t1), np.clip(ends, t0, t1)
+    keep = (codes >= 0) & (ends > starts)
+    codes, starts, ends = codes[keep], starts[keep], ends[keep]
+    sw = sweep(codes, starts, ends, n_equip, t0, t1)
+
+    window = t1 - t0
+    seg_code = sw['code'][:-1]
+    seg_level = sw['level'][:-1]
+    busy = np.bincount(seg_code, weights=sw['dur'] * (seg_level > 0), minlength=n_equip)
+    user_sec = np.bincount(seg_code, weights=sw['dur'] * seg_level, minlength=n_equip)
+    bookings_n = np.bincount(codes, minlength=n_equip)
+    peak = np.zeros(n_equip, np.int64)
+    np.maximum.at(peak, sw['code'], sw['level'])
+    idle = np.where((seg_level == 0) & (sw['dur'] > 0), sw['dur'], 0)
+    longest_idle = np.zeros(n_equip, np.int64)
+    np.maximum.at(longest_idle, seg_code, idle)
+    # first time each equipment reached its peak
+    at_peak = (sw['level'] == peak[sw['code']]) & (peak[sw['code']] > 0)
+    first = pd.Series(sw['time'][at_peak]).groupby(sw['code'][at_peak]).min()
+    peak_at = np.full(n_equip, -1, np.int64)
+    peak_at[first.index.to_numpy()] = first.to_numpy()
+
+    # histogram of average concurrent users per bucket
+    step = BUCKETS[bucket]
+    edges = np.append(np.arange(t0, t1, step), t1)
+    hist = np.diff(eval_integral(sw, 'users', n_equip, t0, t1, edges), axis=1) / np.diff(edges)
+
+    # weekday x hour heatmap: share of each hour slot with at least one user
+    hour_edges = np.append(np.arange(t0, t1, HOUR_SECONDS), t1)
+    hourly_busy = np.diff(eval_integral(sw, 'busy', n_equip, t0, t1, hour_edges), axis=1)
+    slot = (((hour_edges[:-1] // DAY_SECONDS) + 3) % 7) * 24 + (hour_edges[:-1] // HOUR_SECONDS) % 24  # 1970-01-01 was a Thursday
+    slot_hours = np.bincount(slot, weights=np.diff(hour_edges), minlength=7 * 24)
+    heat = np.zeros((n_equip, 7 * 24))
+    np.add.at(heat.T, slot, hourly_busy.T)
+    heat = np.divide(heat, slot_hours, out=np.zeros_like(heat), where=slot_hours > 0) * 100
+
+    summary = pd.DataFrame({
+        'equip_id': ids,
+        'name': [e[1] for e in equipment],
+        'bookings': bookings_n,
+        'busy_hours': busy / HOUR_SECONDS,
+        'idle_hours': (window - busy) / HOUR_SECONDS,
+        'utilization_pct': busy / window * 100,
+        'capacity_pct': user_sec / (window * LIMIT) * 100,
+        'peak_concurrent': peak,
+        'longest_idle_hours': longest_idle / HOUR_SECONDS,
+    }).round(2)
+    rows = summary.to_dict('records')
+    for i, r in enumerate(rows):
+        r['bookings'] = int(r['bookings'])
+        r['peak_concurrent'] = int(r['peak_concurrent'])
+        r['peak_at'] = _iso(peak_at[i]) if peak_at[i] >= 0 else None
+        r['histogram'] = np.round(hist[i], 4).tolist()
+        r['heatmap'] = np.round(heat[i].reshape(7, 24), 1).tolist()
+    lab_heat = np.round(heat.mean(axis=0).reshape(7, 24), 1).tolist() if n_equip else [[0.0] * 24 for _ in range(7)]
+    return {
+        'bucket': bucket,
+        'buckets': [_iso(t) for t in edges[:-1]],
+        'equipment': rows,
+        'lab_heatmap': lab_heat,
+        'weekdays': WEEKDAYS,
+    }
+
+
+def _iso(ts):
+    return (EPOCH + timedelta(seconds=int(ts))).isoformat()
+
+
+def report(start_d, end_d, equip_ids=None, bucket='day', equipment=None, now=None, progress=None):
+    # cached by data version; a window that reaches past now also depends on the clock.
+    # progress(fraction, message) is called between phases (background jobs, see jobs.py)
+    if bucket not in BUCKETS:
+        raise ValueError(f'bucket must be one of {", ".join(BUCKETS)}')
+    t0 = to_epoch(start_d)
+    t1 = to_epoch(end_d + timedelta(days=1))
+    if (t1 - t0) // BUCKETS[bucket] > MAX_HISTOGRAM_BINS:
+        raise ValueError(f'too many {bucket} buckets; use a shorter range or bucket=day')
+    now = to_epoch(datetime.now()) if now is None else now
+    key, version, hit = _cache.lookup(t0, t1, tuple(equip_ids or ()), bucket, now // 300 if t1 > now else None)
+    if hit is not None:
+        metrics.incr('utilization.cache_hits')
+        return hit
+    metrics.incr('utilization.cache_misses')
+    if equipment is None:
+        equipment = [(e.equip_id, e.name) for e in db.session.execute(text('SELECT equip_id, name FROM Equipment ORDER BY equip_id'))]
+    if equip_ids:
+        wanted = set(equip_ids)
+        equipment = [e for e in equipment if e[0] in wanted]
+    if progress:
+        progress(0.1, 'loading bookings', force=True)
+    bookings = load_bookings(t0, t1, equip_ids)
+    if progress:
+        progress(0.6, f'sweeping {len(bookings)} bookings', force=True)
+    result = compute(equipment, bookings, t0, t1, bucket, now)
+    result.update({'start': start_d.isoformat(), 'end': end_d.isoformat(), 'data_version': version})
+    _cache.store(key, result)
+    return result
@@ -0,0 +1,177 @@
+# Write coordination for SQLite
+#
+# pysqlite opens transactions lazily with a deferred BEGIN, so two requests
+# that read and then write both hold SHARED locks and the second to upgrade
+# fails with "database is locked". Here the driver's own transaction handling
+# is switched off and every transaction is begun explicitly: requests with a
+# write method (and code inside write_transaction()) start with
+# BEGIN IMMEDIATE, which takes the RESERVED lock up front. When that is
+# busy we back off with full jitter and retry until SQLITE_WRITE_DEADLINE
+# runs out, then raise WriteBusy. Views that take a write method but only
+# read (a query in a POST body, the /admin/sql SELECT) opt out with
+# @read_only or mark_read_only() and get a deferred BEGIN, so they neither
+# wait for nor block the writers.
+# SQLITE_SERIALIZE_WRITES additionally
+# queues writers of this process on a lock so they don't spin against each
+# other. Waits, retries and give-ups go to the metrics registry.
+import functools
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from .metrics import metrics
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_force_write = ContextVar('force_write', default=False)
+
+
+class WriteBusy(Exception):
+    pass
+
+
+def is_busy(exc):
+    # a SQLITE_BUSY error: another connection holds the lock
+    msg = str(exc).lower()
+    return 'database is locked' in msg or 'database is busy' in msg
+
+
+@contextmanager
+def write_transaction():
+    # mark transactions begun in this block as writes outside of a request
+    token = _force_write.set(True)
+    try:
+        yield
+    finally:
+        _force_write.reset(token)
+
+
+def mark_read_only():
+    # this request won't write: its transactions begin deferred whatever the method
+    g.writes_read_only = True
+
+
+def read_only(view):
+    # route decorator for mark_read_only()
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        mark_read_only()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class WriteCoordinator:
+    def __init__(self):
+        self.busy_timeout_ms = 100
+        self.deadline = 10.0
+        self.backoff_base = 0.005
+        self.backoff_cap = 0.25
+        self.journal_mode = None
+        self.serialize = False
+        self._writer_lock = threading.Lock()
+
+    def init_app(self, app, db):
+        cfg = app.config
+        self.busy_timeout_ms = int(cfg.get('SQLITE_BUSY_TIMEOUT_MS') or self.busy_timeout_ms)
+        self.deadline = float(cfg.get('SQLITE_WRITE_DEADLINE') or self.deadline)
+        self.journal_mode = cfg.get('SQLITE_JOURNAL_MODE') or None
+        self.serialize = bool(cfg.get('SQLITE_SERIALIZE_WRITES'))
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            self._install_hooks(engine)
+        app.extensions['writes'] = self
+
+        @app.errorhandler(WriteBusy)
+        def _write_busy(e):
+            return 'The database is busy, please retry shortly.', 503, {'Retry-After': '1'}
+
+    def is_write(self):
+        if _force_write.get():
+            return True
+        return has_request_context() and request.method in WRITE_METHODS and not g.get('writes_read_only')
+
+    def backoff_delay(self, attempt, remaining):
+        # jittered exponential sleep before retry number attempt, never past the deadline
+        return min(random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt))), remaining)
+
+    def begin_immediate(self, dbapi_conn):
+        # routes swallow errors around their lookups and try again; after one
+        # give-up the rest of the request fails fast instead of waiting again
+        if has_request_context() and g.get('writes_gave_up'):
+            raise WriteBusy('database is locked: write already timed out in this request')
+        try:
+            return self._begin_immediate(dbapi_conn)
+        except WriteBusy:
+            if has_request_context():
+                g.writes_gave_up = True
+            raise
+
+    def _begin_immediate(self, dbapi_conn):
+        started = time.perf_counter()
+        if self.serialize:
+            if not self._writer_lock.acquire(timeout=self.deadline):
+                metrics.incr('writes.giveups')
+                raise WriteBusy(f'database is locked: no writer slot within {self.deadline:.1f}s')
+            metrics.observe('writes.queue_wait_ms', (time.perf_counter() - started) * 1000)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    dbapi_conn.execute('BEGIN IMMEDIATE')
+                    break
+                except sqlite3.OperationalError as exc:
+                    remaining = self.deadline - (time.perf_counter() - started)
+                    if not is_busy(exc) or remaining <= 0:
+                        if is_busy(exc):
+                            metrics.incr('writes.giveups')
+                            raise WriteBusy(f'database is locked: gave up after {attempt} retries in {self.deadline:.1f}s') from exc
+                        raise
+                    metrics.incr('writes.retries')
+                    time.sleep(self.backoff_delay(attempt, remaining))
+                    attempt += 1
+        except BaseException:
+            if self.serialize:
+                self._writer_lock.release()
+            raise
+        metrics.incr('writes.immediate')
+        metrics.observe('writes.lock_wait_ms', (time.perf_counter() - started) * 1000)
+        return self.serialize
+
+    def _install_hooks(self, engine):
+        coordinator = self
+
+        @event.listens_for(engine, 'connect')
+        def _connect(dbapi_conn, record):
+            # take transaction control away from the driver (see SQLAlchemy's pysqlite notes)
+            dbapi_conn.isolation_level = None
+            dbapi_conn.execute(f'PRAGMA busy_timeout = {coordinator.busy_timeout_ms}')
+            if coordinator.journal_mode:
+                dbapi_conn.execute(f'PRAGMA journal_mode = {coordinator.journal_mode}')
+
+        @event.listens_for(engine, 'begin')
+        def _begin(conn):
+            dbapi_conn = conn.connection.driver_connection
+            if coordinator.is_write():
+                held = coordinator.begin_immediate(dbapi_conn)
+                conn.info['writes_lock_held'] = held
+            else:
+                dbapi_conn.execute('BEGIN')
+
+        # fires just before the driver's COMMIT/ROLLBACK; a writer let in that early
+        # retries its BEGIN IMMEDIATE once or twice
+        def _release(conn):
+            if conn.info.pop('writes_lock_held', False):
+                coordinator._writer_lock.release()
+
+        event.listen(engine, 'commit', _release)
+        event.listen(engine, 'rollback', _release)
+
+
+writes = WriteCoordinator()
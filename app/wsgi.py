@@ -0,0 +1,290 @@
+# Production entry point
+#
+# `application` is built once, when this module is imported, so a pre-fork
+# server loads the code and the app in the parent and forks its workers from
+# there. Two things have to happen in each worker:
+#
+# - Pooled connections opened before the fork belong to the parent. An
+#   os.register_at_fork hook disposes the engines in every child without
+#   closing the parent's connections, so a worker opens its own.
+# - warm() runs before the worker accepts traffic. It loads the reference
+#   lists and the analytics snapshot and compiles every template. Then it
+#   requests the hot read pages once, which fills SQLAlchemy's compiled
+#   statement cache and the connection's sqlite3 statement cache. Its timings
+#   are served by GET /ready, which answers 503 while a worker is warming.
+#
+# The built-in server forks --workers processes that share one listening
+# socket. Each serves requests from a pool of --threads threads and stops
+# accepting while all of them are busy, so waiting connections stay in the
+# kernel backlog for an idle worker to pick up. A worker that dies is
+# replaced. SIGTERM or Ctrl-C lets requests in flight finish for up to
+# --grace seconds.
+#
+# A live page's stream (/equipment/stream) holds its request thread for as
+# long as the tab is open. So that streams can never take every thread, each
+# worker lowers EVENTS_MAX_SUBSCRIBERS to threads - 1 and answers further
+# streams with 503. With --threads 1 (or gunicorn's sync workers) streams are
+# refused altogether. Raise --threads to serve more live pages per worker:
+#
+#   python -m app.wsgi --bind 0.0.0.0:8000 --workers 4 --threads 8
+#
+# With gunicorn, load this module as the config file as well, so that its
+# post_fork hook warms each worker:
+#
+#   gunicorn -c python:app.wsgi --workers 4 --threads 8 app.wsgi:application
+#
+# post_fork applies the same stream cap from gunicorn's --threads.
+#
+# The occupancy sweeper, the background job pool and the SSE relay are
+# started per process on first use, so every worker gets its own.
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from .analytics import snapshot
+from .app import compile_templates, create_app
+from .events import events
+from .jobs import jobs
+from .metrics import metrics
+from .models import db
+from .refcache import refcache
+
+DEFAULT_BIND = os.environ.get('WSGI_BIND', '127.0.0.1:8000')
+DEFAULT_WORKERS = int(os.environ.get('WSGI_WORKERS', 0)) or os.cpu_count() or 1
+DEFAULT_THREADS = int(os.environ.get('WSGI_THREADS', 8))
+KEEPALIVE = 5
+GRACE = 30
+RESTART_DELAY = 1
+
+# read pages requested once per worker while it warms up; writes are never replayed
+WARMUP_PATHS = (
+    '/',
+    '/members',
+    '/projects',
+    '/grants',
+    '/equipment',
+    '/publications',
+    '/equipmentuse',
+    '/equipment/availability',
+    '/view/members',
+    '/view/works-on',
+    '/view/grants',
+    '/view/authorship',
+    '/view/mentorship',
+    '/reports/top_authors',
+    '/reports/avg_student_pubs',
+    '/reports/breakdown',
+    '/api/v1/members?limit=1',
+)
+
+application = create_app()
+
+
+def _after_fork():
+    # the parent's pooled connections must be neither used nor closed by the child
+    with application.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # the parent's warmup says nothing about this process
+    application.extensions.pop('warmup', None)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _request_pages(app, paths):
+    failed = {}
+    client = app.test_client()
+    for path in paths:
+        resp = client.get(path)
+        resp.close()
+        if resp.status_code >= 400:
+            failed[path] = resp.status_code
+    if failed:
+        raise RuntimeError(f'warmup requests failed: {failed}')
+    return len(paths)
+
+
+def warm(app=application, paths=WARMUP_PATHS):
+    # prime this process before it serves; returns the state /ready reports.
+    # A failing step is recorded and the worker still starts: it is only slower.
+    state = {'ready': False, 'pid': os.getpid(), 'seconds': None, 'steps': {}, 'errors': {}}
+    app.extensions['warmup'] = state
+    t0 = time.perf_counter()
+    steps = (
+        ('refcache', refcache.load_all),
+        ('analytics', snapshot),
+        ('templates', lambda: compile_templates(app)),
+        ('pages', lambda: _request_pages(app, paths)),
+    )
+    for name, step in steps:
+        t = time.perf_counter()
+        try:
+            with app.app_context():
+                try:
+                    step()
+                finally:
+                    db.session.remove()
+        except Exception as exc:
+            state['errors'][name] = f'{type(exc).__name__}: {exc}'
+        state['steps'][name] = round(time.perf_counter() - t, 4)
+    # /metrics starts from real traffic
+    metrics.reset()
+    state['seconds'] = round(time.perf_counter() - t0, 4)
+    state['ready'] = True
+    return state
+
+
+def cap_streams(threads):
+    # an SSE stream keeps its thread until the client leaves; always leave one for other requests
+    events.max_subscribers = min(events.max_subscribers, threads - 1)
+    return events.max_subscribers
+
+
+def post_fork(server, worker):
+    # gunicorn server hook, picked up by `gunicorn -c python:app.wsgi`
+    cap_streams(worker.cfg.threads)
+    warm()
+
+
+class _Handler(WSGIRequestHandler):
+    # an idle keep-alive connection gives its thread back after KEEPALIVE seconds
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # werkzeug's server with a fixed pool of request threads. ThreadedWSGIServer
+    # starts a thread per connection and keeps accepting however busy it is.
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, handler=_Handler, fd=fd)
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        # blocks the accept loop while every thread is busy
+        self._slots.acquire()
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self, timeout):
+        # wait up to timeout seconds for requests in flight; returns how many are still running
+        deadline = time.monotonic() + timeout
+        taken = 0
+        while taken < self.threads and self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            taken += 1
+        return self.threads - taken
+
+
+def _log(message):
+    print(f'wsgi[{os.getpid()}]: {message}', file=sys.stderr, flush=True)
+
+
+def _serve(fd, host, threads, grace, warmup):
+    # one worker process
+    stop = lambda *a: sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server = None
+    cap_streams(threads)
+    try:
+        if warmup:
+            state = warm()
+            _log(f'warmed up in {state["seconds"]:.2f}s' + (f', errors: {state["errors"]}' if state['errors'] else ''))
+        server = PooledWSGIServer(host, 0, application, threads, fd=fd)
+        server.serve_forever()
+    finally:
+        if server is not None:
+            left = server.drain(grace)
+            if left:
+                _log(f'{left} requests still running after {grace}s')
+            server.server_close()
+        jobs.shutdown(wait=False)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # pool threads stuck in a stream would otherwise be joined at exit
+        os._exit(0)
+
+
+def _listen(bind, backlog):
+    host, _, port = bind.rpartition(':')
+    host = host.strip('[]') or '127.0.0.1'
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.create_server((host, int(port)), family=family, backlog=backlog)
+    sock.set_inheritable(True)
+    return host, sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app with pre-forked, warmed-up worker processes')
+    parser.add_argument('--bind', default=DEFAULT_BIND, help='host:port (default from WSGI_BIND)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='processes (default from WSGI_WORKERS, else one per core)')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='request threads per process (default from WSGI_THREADS)')
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--grace', type=float, default=GRACE, help='seconds a stopping worker waits for requests in flight')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    args = parser.parse_args()
+    if args.workers < 1 or args.threads < 1:
+        parser.error('--workers and --threads must be at least 1')
+
+    host, sock = _listen(args.bind, args.backlog)
+    port = sock.getsockname()[1]
+    _log(f'listening on {host}:{port} with {args.workers} workers x {args.threads} threads')
+    ctx = multiprocessing.get_context('fork')
+    procs = {}
+    stopping = False
+
+    def spawn():
+        p = ctx.Process(target=_serve, args=(sock.fileno(), host, args.threads, args.grace, args.warmup), name='wsgi-worker')
+        p.start()
+        procs[p.sentinel] = p
+
+    def stop(*a):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    while not stopping:
+        for sentinel in multiprocessing.connection.wait(list(procs), timeout=1):
+            p = procs.pop(sentinel)
+            p.join()
+            if not stopping:
+                _log(f'worker {p.pid} exited with {p.exitcode}, starting another')
+                time.sleep(RESTART_DELAY)
+                spawn()
+    _log('stopping')
+    for p in procs.values():
+        p.terminate()
+    for p in procs.values():
+        p.join(args.grace + 5)
+        if p.is_alive():
+            p.kill()
+            p.join()
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
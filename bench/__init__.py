@@ -0,0 +1 @@
+# benchmark and load-testing tools (not imported by the app)
@@ -0,0 +1,366 @@
+# Concurrent load generator with a mixed read/write workload
+#
+# Starts a pre-forked pool of app workers sharing one listening socket (or
+# targets an already running server with --url) and fires an open-loop
+# stream of requests at it: arrivals follow a Poisson process at --rate
+# requests/second regardless of how fast the server answers, so queueing
+# shows up as latency instead of silently lowering the offered load.
+# Latency is measured from each request's scheduled arrival time.
+#
+#   python -m bench.loadgen --scale 10 --workers 4 --rate 40 --duration 30 \
+#       --mix booking=2,availability=5,report=2,member_edit=1
+#
+# Write outcomes are read from the flash messages in the session cookie of the
+# redirect, so "database is locked" failures that the routes turn into error
+# flashes are counted separately from ordinary validation rejections.
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from bench.routes import ANCHOR, _percentile, ensure_db  # noqa: E402
+
+LOCKED = 'database is locked'
+REPORTS = [
+    '/reports/top_authors',
+    '/reports/avg_student_pubs',
+    '/reports/avg_student_pubs.json',
+    '/reports/projects_active?start=2023-01-01&end=2024-12-31',
+    '/reports/top3_for_grant?grant_id=G1',
+]
+
+
+# ---- server side ----------------------------------------------------------
+
+def _serve(fd, db_path, threaded, metrics_dir):
+    import logging
+    from werkzeug.serving import make_server
+    from app.app import create_app
+    from app.metrics import metrics
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}'})
+    server = make_server('127.0.0.1', 0, app, threaded=threaded, fd=fd)
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        # hand this worker's counters (lock retries, waits, ...) back to the driver
+        with open(os.path.join(metrics_dir, f'worker-{os.getpid()}.json'), 'w', encoding='utf8') as f:
+            json.dump(metrics.snapshot(), f)
+
+
+def start_workers(db_path, workers, threaded, metrics_dir):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=_serve, args=(sock.fileno(), db_path, threaded, metrics_dir), daemon=True)
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    return sock, procs
+
+
+def stop_workers(sock, procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join(timeout=10)
+    sock.close()
+
+
+def merge_worker_metrics(metrics_dir):
+    counters = defaultdict(int)
+    timings = {}
+    for name in os.listdir(metrics_dir):
+        with open(os.path.join(metrics_dir, name), encoding='utf8') as f:
+            snap = json.load(f)
+        for k, v in snap['counters'].items():
+            counters[k] += v
+        for k, t in snap['timings'].items():
+            cur = timings.setdefault(k, {'count': 0, 'sum': 0, 'max': 0})
+            cur['count'] += t['count']
+            cur['sum'] += t['sum']
+            cur['max'] = max(cur['max'], t['max'])
+    return {'counters': dict(counters), 'timings': timings}
+
+
+# ---- workload -------------------------------------------------------------
+
+class Workload:
+    def __init__(self, db_path, seed, booking_days):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.edits = 0
+        conn = sqlite3.connect(db_path)
+        self.equipment = [r[0] for r in conn.execute('SELECT equip_id FROM Equipment')]
+        self.members = [r[0] for r in conn.execute('SELECT member_id FROM LabMember')]
+        # full edit forms, so re-posting a member keeps its subtype fields and project assignments
+        self.edit_forms = {}
+        for mid, name, mtype in conn.execute('SELECT member_id, name, member_type FROM LabMember ORDER BY random() LIMIT 200'):
+            form = {'name': name, 'member_type': mtype}
+            if mtype == 'faculty':
+                row = conn.execute('SELECT department, affiliation, title FROM Faculty WHERE member_id = ?', (mid,)).fetchone() or ('', '', '')
+                form.update(department=row[0] or '', faculty_affiliation=row[1] or '', title=row[2] or '')
+            elif mtype == 'student':
+                row = conn.execute('SELECT student_number, academic_level, major, affiliation FROM Student WHERE member_id = ?', (mid,)).fetchone() or ('', '', '', '')
+                form.update(student_number=row[0] or '', academic_level=row[1] or '', major=row[2] or '', student_affiliation=row[3] or '')
+            else:
+                row = conn.execute('SELECT organization, contact_info, biography FROM Collaborator WHERE member_id = ?', (mid,)).fetchone() or ('', '', '')
+                form.update(organization=row[0] or '', contact_info=row[1] or '', biography=row[2] or '')
+            works = conn.execute('SELECT project_id, role, weekly_hours FROM WorksOn WHERE member_id = ?', (mid,)).fetchall()
+            pairs = list(form.items()) + [('project_ids', pid) for pid, _, _ in works]
+            for pid, role, hours in works:
+                pairs += [(f'role_{pid}', role or 'member'), (f'weekly_hours_{pid}', str(hours or 0))]
+            self.edit_forms[mid] = pairs
+        conn.close()
+        self.booking_days = booking_days
+
+    def _slot(self):
+        day = ANCHOR + timedelta(days=1 + self.rng.randrange(self.booking_days))
+        start = self.rng.randrange(8, 18)
+        return f'{day.isoformat()}T{start:02d}:00', f'{day.isoformat()}T{start + self.rng.choice((1, 2)):02d}:00'
+
+    def request(self, kind):
+        # returns (method, path, form pairs or None)
+        with self.lock:
+            if kind == 'booking':
+                start, end = self._slot()
+                return 'POST', '/equipmentuse/new', [
+                    ('equip_id', self.rng.choice(self.equipment)), ('member_id', self.rng.choice(self.members)),
+                    ('use_start', start), ('use_end', end), ('purpose', 'load test')]
+            if kind == 'availability':
+                start, end = self._slot()
+                return 'GET', '/equipment/availability?' + urlencode(
+                    {'equip_id': self.rng.choice(self.equipment), 'start': start, 'end': end}), None
+            if kind == 'report':
+                return 'GET', self.rng.choice(REPORTS), None
+            if kind == 'member_edit':
+                mid = self.rng.choice(list(self.edit_forms))
+                self.edits += 1
+                pairs = [(k, f'{v} #{self.edits}' if k == 'name' else v) for k, v in self.edit_forms[mid]]
+                return 'POST', f'/members/{mid}/edit', pairs
+        raise ValueError(f'unknown request kind {kind!r}')
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+# ---- client side ----------------------------------------------------------
+
+class Flashes:
+    # decodes the flash list out of Flask's signed session cookie
+    def __init__(self, secret_key):
+        app = Flask('loadgen')
+        app.secret_key = secret_key
+        self.serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+
+    def __call__(self, resp):
+        cookie = SimpleCookie()
+        for header in resp.getheaders():
+            if header[0].lower() == 'set-cookie':
+                cookie.load(header[1])
+        morsel = cookie.get('session')
+        if morsel is None or not morsel.value:
+            return []
+        try:
+            return self.serializer.loads(morsel.value).get('_flashes', [])
+        except Exception:
+            return []
+
+
+def send(host, port, method, path, pairs, timeout):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        body = urlencode(pairs) if pairs is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp
+    finally:
+        conn.close()
+
+
+def classify(resp, flashes):
+    # ok | rejected (validation/conflict flash) | locked | server_error
+    if resp.status == 503:
+        # the write coordinator gave up waiting for the lock (app/writes.py)
+        return 'locked'
+    if resp.status >= 500:
+        return 'server_error'
+    errors = [msg for category, msg in flashes(resp) if category == 'error']
+    if any(LOCKED in msg for msg in errors):
+        return 'locked'
+    if errors:
+        return 'rejected'
+    return 'ok'
+
+
+def run_load(host, port, workload, mix, rate, duration, concurrency, retries, timeout, seed, secret_key):
+    flashes = Flashes(secret_key)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    arrivals = random.Random(seed + 1)
+    samples = defaultdict(list)
+    outcomes = defaultdict(lambda: defaultdict(int))
+    retry_counts = defaultdict(int)
+    record_lock = threading.Lock()
+
+    def job(kind, scheduled):
+        method, path, pairs = workload.request(kind)
+        attempt = 0
+        while True:
+            try:
+                outcome = classify(send(host, port, method, path, pairs, timeout), flashes)
+            except (OSError, http.client.HTTPException):
+                outcome = 'transport_error'
+            if outcome != 'locked' or attempt >= retries:
+                break
+            attempt += 1
+            time.sleep(random.uniform(0.01, 0.05) * attempt)
+        latency = (time.perf_counter() - scheduled) * 1000
+        with record_lock:
+            samples[kind].append(latency)
+            outcomes[kind][outcome] += 1
+            retry_counts[kind] += attempt
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        t = started
+        while True:
+            t += arrivals.expovariate(rate)
+            if t - started >= duration:
+                break
+            delay = t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(job, arrivals.choices(kinds, weights)[0], t)
+    elapsed = time.perf_counter() - started
+
+    report = {'elapsed_s': elapsed, 'kinds': {}}
+    total = 0
+    for kind in kinds:
+        lat = samples.get(kind) or [0.0]
+        n = len(samples.get(kind, []))
+        total += n
+        out = dict(outcomes[kind])
+        report['kinds'][kind] = {
+            'requests': n,
+            'throughput_rps': n / elapsed,
+            'p50_ms': _percentile(lat, 0.50),
+            'p95_ms': _percentile(lat, 0.95),
+            'p99_ms': _percentile(lat, 0.99),
+            'max_ms': max(lat),
+            'outcomes': out,
+            'locked_rate': out.get('locked', 0) / n if n else 0.0,
+            'client_retries': retry_counts[kind],
+        }
+    report['requests'] = total
+    report['throughput_rps'] = total / elapsed
+    report['locked'] = sum(k['outcomes'].get('locked', 0) for k in report['kinds'].values())
+    report['locked_rate'] = report['locked'] / total if total else 0.0
+    report['client_retries'] = sum(retry_counts.values())
+    return report
+
+
+def print_report(report):
+    print(f"{'kind':14s} {'reqs':>6s} {'rps':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'max':>8s} {'locked':>7s} {'retries':>7s}  outcomes")
+    for kind, k in report['kinds'].items():
+        print(f"{kind:14s} {k['requests']:6d} {k['throughput_rps']:7.1f} {k['p50_ms']:8.1f} {k['p95_ms']:8.1f} "
+              f"{k['p99_ms']:8.1f} {k['max_ms']:8.1f} {k['locked_rate']:7.1%} {k['client_retries']:7d}  {k['outcomes']}")
+    print(f"total {report['requests']} requests in {report['elapsed_s']:.1f}s, {report['throughput_rps']:.1f} req/s, "
+          f"locked {report['locked']} ({report['locked_rate']:.1%}), client retries {report['client_retries']}")
+    server = report.get('server_metrics')
+    if server:
+        interesting = {k: v for k, v in server['counters'].items() if not k.startswith('refcache.')}
+        if interesting:
+            print('server counters:', json.dumps(interesting, sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator for the lab manager app')
+    parser.add_argument('--db', help='database to run against (modified in place); default: a copy of a generated database')
+    parser.add_argument('--scale', type=int, default=10, help='scale factor of the generated database (default: 10)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help='drive an already running server instead of starting workers (e.g. http://127.0.0.1:5000)')
+    parser.add_argument('--workers', type=int, default=4, help='server worker processes (default: 4)')
+    parser.add_argument('--threaded', action='store_true', help='let each worker process handle requests in threads')
+    parser.add_argument('--rate', type=float, default=20.0, help='offered load in requests/second (default: 20)')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of arrivals (default: 20)')
+    parser.add_argument('--mix', default='booking=2,availability=5,report=2,member_edit=1',
+                        help='request kinds and weights (default: booking=2,availability=5,report=2,member_edit=1)')
+    parser.add_argument('--concurrency', type=int, default=64, help='client threads (default: 64)')
+    parser.add_argument('--retries', type=int, default=0, help='client-side retries of locked writes (default: 0)')
+    parser.add_argument('--booking-days', type=int, default=30, help='spread bookings over this many days (default: 30)')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--secret-key', default='dev', help="the app's SECRET_KEY, used to read flash messages")
+    parser.add_argument('--out', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if not db_path:
+            db_path = os.path.join(tmp, 'load.db')
+            shutil.copyfile(ensure_db(args.scale, args.seed), db_path)
+        workload = Workload(db_path, args.seed, args.booking_days)
+        metrics_dir = os.path.join(tmp, 'metrics')
+        os.makedirs(metrics_dir)
+        sock = procs = None
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            sock, procs = start_workers(db_path, args.workers, args.threaded, metrics_dir)
+            host, port = sock.getsockname()
+            time.sleep(0.5)
+        try:
+            report = run_load(host, port, workload, mix, args.rate, args.duration, args.concurrency,
+                              args.retries, args.timeout, args.seed, args.secret_key)
+        finally:
+            if procs:
+                stop_workers(sock, procs)
+        if procs:
+            report['server_metrics'] = merge_worker_metrics(metrics_dir)
+        report['config'] = {k: v for k, v in vars(args).items() if k != 'secret_key'}
+        report['config']['mix'] = mix
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote', args.out)
+
+
+if __name__ == '__main__':
+    main()
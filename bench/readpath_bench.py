@@ -0,0 +1,79 @@
+# Compare ORM hydration (.query.all()) with the Core select() read path
+#
+#   python -m bench.readpath_bench --rows 100000 --repeat 5
+import argparse
+import gc
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from app.app import create_app
+from app.models import db, LabMember
+from app.readpath import fetch_rows
+
+BASE = os.path.dirname(os.path.dirname(__file__))
+SCHEMA = os.path.join(BASE, 'sql', 'schema_sqlite.sql')
+
+
+def build_db(path, rows):
+    conn = sqlite3.connect(path)
+    with open(SCHEMA, 'r', encoding='utf8') as f:
+        conn.executescript(f.read())
+    types = ('faculty', 'student', 'collaborator')
+    conn.executemany(
+        'INSERT INTO LabMember(member_id, name, member_type, join_date) VALUES (?, ?, ?, ?)',
+        ((f'M{i}', f'Member {i}', types[i % 3], f'20{10 + i % 15:02d}-0{1 + i % 9}-1{i % 10}') for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def measure(fn, repeat):
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        db.session.remove()
+        gc.collect()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+        _, p = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak = max(peak, p)
+        n = len(result)
+        del result
+    return {
+        'rows': n,
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'peak_bytes': peak,
+        'bytes_per_row': peak / n if n else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='ORM vs Core read-path benchmark')
+    ap.add_argument('--rows', type=int, default=100000)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_db(path, args.rows)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        with app.app_context():
+            orm = measure(lambda: LabMember.query.order_by(LabMember.member_id).all(), args.repeat)
+            core = measure(lambda: fetch_rows(LabMember, order_by=LabMember.member_id), args.repeat)
+            db.session.remove()
+            db.engine.dispose()
+    report = {'orm_query_all': orm, 'core_select': core,
+              'speedup': orm['median_ms'] / core['median_ms'],
+              'memory_ratio': orm['peak_bytes'] / core['peak_bytes']}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
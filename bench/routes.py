@@ -0,0 +1,356 @@
+# Route-level benchmark suite
+#
+# Boots create_app() against generated databases (init_db.generate_data) at
+# one or more scale factors and drives the hot routes through the Flask test
+# client. For each route it records latency percentiles, SQL statements per
+# request and peak traced memory, and writes everything to a JSON file.
+#
+#   python -m bench.routes run --scales 1,10,100 --repeat 30
+#   python -m bench.routes save-baseline bench/results/<file>.json --name main
+#   python -m bench.routes compare bench/baselines/main.json bench/results/<file>.json --threshold 0.25
+#
+# Each scale factor runs in its own interpreter, so per-process caches (the
+# reference lists, the report caches) never carry one scale's data into the
+# next.
+#
+# `compare` exits with status 1 when any route got slower (p50/p90) or issues
+# more SQL statements than the baseline by more than the threshold.
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+from sqlalchemy import event
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+import init_db  # noqa: E402
+from app.app import create_app  # noqa: E402
+from app.models import db  # noqa: E402
+
+RESULTS_DIR = os.path.join(BASE, 'bench', 'results')
+BASELINES_DIR = os.path.join(BASE, 'bench', 'baselines')
+CACHE_DIR = os.path.join(BASE, 'bench', '.cache')
+ANCHOR = date(2025, 6, 30)
+
+# (name, method, url, form data or a callable(i) returning it)
+READ_ROUTES = [
+    ('equipment_availability', 'GET', '/equipment/availability?equip_id=E1&start=2025-06-29T09:00&end=2025-06-29T12:00', None),
+    ('equipment_users', 'GET', '/equipment/users?equip_id=E1', None),
+    ('equipment_member_conflicts', 'GET', '/equipment/member_conflicts?equip_id=E1&member_id=S1&start=2025-06-29T09:00&end=2025-06-29T12:00', None),
+    ('members_search', 'GET', '/members/search?member_id=S1', None),
+    ('grants_status', 'GET', '/grants/status?grant_id=G1&start=2023-01-01&end=2024-12-31', None),
+    ('project_status', 'GET', '/project/status?project_id=P1&when=2024-01-01', None),
+    ('reports_top_authors', 'GET', '/reports/top_authors', None),
+    ('reports_avg_student_pubs', 'GET', '/reports/avg_student_pubs', None),
+    ('reports_avg_student_pubs_json', 'GET', '/reports/avg_student_pubs.json', None),
+    ('reports_projects_active', 'GET', '/reports/projects_active?start=2023-01-01&end=2024-12-31', None),
+    ('reports_top3_for_grant', 'GET', '/reports/top3_for_grant?grant_id=G1', None),
+    ('reports_breakdown', 'GET', '/reports/breakdown.json?by=year,member_type,major', None),
+    # report pages queue a background job unless inline=1; the benchmark times the inline computation
+    ('reports_equipment_utilization', 'GET', '/reports/equipment_utilization?inline=1&start=2025-01-01&end=2025-06-30', None),
+    ('reports_collaboration', 'GET', '/reports/collaboration?inline=1', None),
+    ('reports_grant_burndown', 'GET', '/reports/grant_burndown?inline=1&start=2023-07&end=2025-06', None),
+    ('members', 'GET', '/members', None),
+    ('projects', 'GET', '/projects', None),
+    ('publications', 'GET', '/publications', None),
+    ('equipment', 'GET', '/equipment', None),
+    ('grants', 'GET', '/grants', None),
+    ('view_faculty', 'GET', '/view/faculty', None),
+    ('view_students', 'GET', '/view/students', None),
+    ('view_collaborators', 'GET', '/view/collaborators', None),
+    ('view_works_on', 'GET', '/view/works-on', None),
+    ('view_authorship', 'GET', '/view/authorship', None),
+    ('view_mentorship', 'GET', '/view/mentorship', None),
+    ('equipment_usage_tracking', 'GET', '/equipment-usage-tracking', None),
+    ('form_project_new', 'GET', '/projects/new', None),
+    ('form_member_new', 'GET', '/members/new', None),
+    ('form_equipment_use_new', 'GET', '/equipmentuse/new', None),
+]
+
+
+def _booking(i):
+    # one booking per iteration on a distinct future day, so every post is accepted
+    day = date.fromordinal(ANCHOR.toordinal() + 400 + i).isoformat()
+    return {'equip_id': 'E1', 'member_id': 'S1', 'use_start': f'{day}T09:00', 'use_end': f'{day}T10:00', 'purpose': 'bench'}
+
+
+def _member(i):
+    return {'name': f'Bench Member {i}', 'member_type': 'student', 'join_date': '2025-01-01',
+            'student_number': f'BENCH{i:06d}', 'academic_level': 'graduate', 'major': 'Computer Science'}
+
+
+def _workson(i):
+    return {'member_id': f'SB{i:06d}', 'project_id': 'P1', 'role': 'researcher', 'weekly_hours': '5'}
+
+
+def _mentorship(i):
+    return {'mentor_id': 'F1', 'mentee_id': f'SB{i:06d}', 'start_date': '2030-01-01', 'notes': 'bench'}
+
+
+def _seed_students(conn, n):
+    # generated students are already assigned and mentored, so add fresh ones
+    conn.executemany('INSERT INTO LabMember (member_id, name, join_date, member_type) VALUES (?, ?, ?, ?)',
+                     [(f'SB{i:06d}', f'Bench Student {i}', '2025-01-01', 'student') for i in range(n)])
+    conn.executemany('INSERT INTO Student (member_id, student_number, academic_level, major) VALUES (?, ?, ?, ?)',
+                     [(f'SB{i:06d}', f'BM{i:06d}', 'graduate', 'Computer Science') for i in range(n)])
+
+
+WRITE_ROUTES = [
+    ('post_equipment_use_new', 'POST', '/equipmentuse/new', _booking),
+    ('post_member_new', 'POST', '/members/new', _member),
+    ('post_workson_new', 'POST', '/workson/new', _workson),
+    ('post_mentorship_new', 'POST', '/mentorship/new', _mentorship),
+]
+
+# fixtures a write route needs in the database before it runs: name -> fn(conn, n)
+SETUP = {
+    'post_workson_new': _seed_students,
+    'post_mentorship_new': _seed_students,
+}
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def ensure_db(scale, seed):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f'sf{scale}_seed{seed}.db')
+    if not os.path.exists(path):
+        conn = sqlite3.connect(path)
+        init_db.run_sql_file(conn, os.path.join(init_db.SQL_DIR, 'schema_sqlite.sql'))
+        init_db.apply_migrations(conn)
+        init_db.bulk_load(conn, init_db.generate_data(scale, seed, ANCHOR))
+        conn.close()
+    else:
+        # cached databases predate newer migrations
+        conn = sqlite3.connect(path)
+        init_db.apply_migrations(conn)
+        conn.close()
+    return path
+
+
+def bench_scale(scale, seed, repeat, warmup, routes):
+    src = ensure_db(scale, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # writes mutate the database, so every run works on a fresh copy
+        path = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(src, path)
+        setups = list(dict.fromkeys(SETUP[r[0]] for r in routes if r[0] in SETUP))
+        if setups:
+            conn = sqlite3.connect(path)
+            with conn:
+                for setup in setups:
+                    setup(conn, warmup + repeat + 1)
+            conn.close()
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        client = app.test_client()
+        counter = {'n': 0}
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', lambda *a, **k: counter.__setitem__('n', counter['n'] + 1))
+        results = {}
+        for name, method, url, data in routes:
+            i = 0
+
+            def call():
+                nonlocal i
+                form = data(i) if callable(data) else data
+                i += 1
+                if method == 'POST':
+                    resp = client.post(url, data=form)
+                else:
+                    resp = client.get(url)
+                resp.get_data()
+                return resp.status_code
+
+            def flashed_errors():
+                # writes report failures through flash(); read them outside the timed section
+                with client.session_transaction() as sess:
+                    flashes = sess.pop('_flashes', [])
+                return sum(1 for category, _ in flashes if category in ('error', 'danger'))
+            for _ in range(warmup):
+                call()
+            flashed_errors()
+            times = []
+            statements = []
+            statuses = {}
+            errors = 0
+            for _ in range(repeat):
+                counter['n'] = 0
+                t0 = time.perf_counter()
+                status = call()
+                times.append((time.perf_counter() - t0) * 1000)
+                statements.append(counter['n'])
+                statuses[status] = statuses.get(status, 0) + 1
+                errors += flashed_errors()
+            # memory is traced in a separate request so tracing overhead does not skew latency
+            tracemalloc.start()
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = {
+                'method': method,
+                'url': url,
+                'n': repeat,
+                'p50_ms': _percentile(times, 0.50),
+                'p90_ms': _percentile(times, 0.90),
+                'p99_ms': _percentile(times, 0.99),
+                'mean_ms': statistics.fmean(times),
+                'statements': statistics.fmean(statements),
+                'peak_kb': peak / 1024,
+                'status': {str(k): v for k, v in statuses.items()},
+                'errors': errors,
+            }
+            print(f'  sf{scale} {name:32s} p50={results[name]["p50_ms"]:8.2f}ms p99={results[name]["p99_ms"]:8.2f}ms '
+                  f'sql={results[name]["statements"]:6.1f} peak={results[name]["peak_kb"]:9.1f}KB'
+                  + (f' errors={errors}' if errors else ''))
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+    return results
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def cmd_child(args):
+    # one scale factor in a fresh interpreter; results go to --out, progress to stdout
+    wanted = set(args.routes.split(','))
+    routes = [r for r in READ_ROUTES + WRITE_ROUTES if r[0] in wanted]
+    results = bench_scale(args.scale, args.seed, args.repeat, args.warmup, routes)
+    with open(args.out, 'w', encoding='utf8') as f:
+        json.dump(results, f)
+
+
+def _run_scale(scale, args, routes):
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'results.json')
+        cmd = [sys.executable, '-m', 'bench.routes', 'child', '--scale', str(scale), '--seed', str(args.seed),
+               '--repeat', str(args.repeat), '--warmup', str(args.warmup),
+               '--routes', ','.join(r[0] for r in routes), '--out', out]
+        proc = subprocess.run(cmd, cwd=BASE, env=dict(os.environ, PYTHONPATH=BASE))
+        if proc.returncode:
+            raise SystemExit(f'benchmark of scale factor {scale} failed with status {proc.returncode}')
+        with open(out, encoding='utf8') as f:
+            return json.load(f)
+
+
+def cmd_run(args):
+    scales = [int(s) for s in args.scales.split(',')]
+    routes = READ_ROUTES + ([] if args.no_writes else WRITE_ROUTES)
+    if args.only:
+        wanted = set(args.only.split(','))
+        routes = [r for r in routes if r[0] in wanted]
+    for scale in scales:
+        # build missing databases here rather than in the timed child
+        ensure_db(scale, args.seed)
+    report = {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git': _git_rev(), 'python': platform.python_version(),
+                 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(), 'seed': args.seed,
+                 'repeat': args.repeat, 'scales': scales},
+        'results': {},
+    }
+    for scale in scales:
+        print(f'scale factor {scale}')
+        report['results'][f'sf{scale}'] = _run_scale(scale, args, routes)
+    out = args.out or os.path.join(RESULTS_DIR, f'routes-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote', out)
+
+
+def cmd_save_baseline(args):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    dest = os.path.join(BASELINES_DIR, f'{args.name}.json')
+    shutil.copyfile(args.results, dest)
+    print('Saved baseline', dest)
+
+
+def compare(baseline, current, threshold, min_ms=1.0):
+    # returns a list of (scale, route, metric, old, new) regressions
+    regressions = []
+    for scale, routes in current['results'].items():
+        base_routes = baseline['results'].get(scale, {})
+        for name, cur in routes.items():
+            old = base_routes.get(name)
+            if not old:
+                continue
+            for metric in ('p50_ms', 'p90_ms'):
+                # ignore sub-millisecond noise
+                if cur[metric] > max(old[metric], min_ms) * (1 + threshold):
+                    regressions.append((scale, name, metric, old[metric], cur[metric]))
+            if cur['statements'] > old['statements'] * (1 + threshold) and cur['statements'] - old['statements'] >= 1:
+                regressions.append((scale, name, 'statements', old['statements'], cur['statements']))
+    return regressions
+
+
+def cmd_compare(args):
+    with open(args.baseline, encoding='utf8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf8') as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_ms)
+    for scale, name, metric, old, new in regressions:
+        print(f'REGRESSION {scale} {name} {metric}: {old:.2f} -> {new:.2f} ({(new / old - 1) * 100 if old else float("inf"):+.0f}%)')
+    if regressions:
+        sys.exit(1)
+    print('No regressions beyond', f'{args.threshold:.0%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route-level benchmarks for the lab manager app')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('run', help='run the benchmarks and write a results JSON file')
+    p.add_argument('--scales', default='1,10', help='comma separated scale factors (default: 1,10)')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--only', help='comma separated route names to run')
+    p.add_argument('--no-writes', action='store_true', help='skip the POST routes')
+    p.add_argument('--out', help='results file (default: bench/results/routes-<timestamp>.json)')
+    p.set_defaults(func=cmd_run)
+    p = sub.add_parser('save-baseline', help='store a results file as a named baseline')
+    p.add_argument('results')
+    p.add_argument('--name', default='main')
+    p.set_defaults(func=cmd_save_baseline)
+    p = sub.add_parser('compare', help='fail if current results regress against a baseline')
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown (default: 0.25)')
+    p.add_argument('--min-ms', type=float, default=1.0, help='latencies below this are treated as noise (default: 1.0)')
+    p.set_defaults(func=cmd_compare)
+    p = sub.add_parser('child', help=argparse.SUPPRESS)
+    p.add_argument('--scale', type=int, required=True)
+    p.add_argument('--seed', type=int, required=True)
+    p.add_argument('--repeat', type=int, required=True)
+    p.add_argument('--warmup', type=int, required=True)
+    p.add_argument('--routes', required=True)
+    p.add_argument('--out', required=True)
+    p.set_defaults(func=cmd_child)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# Cold-start profile
+#
+# Starts fresh interpreters against a generated database and times what a new
+# worker pays before it answers quickly: importing app.app, create_app(),
+# compiling every template, and the first (then second) request to a few
+# pages. Each sample is its own process, run under three template cache
+# states:
+#
+#   nocache  JINJA_CACHE_DIR='' -- templates compiled from source
+#   cold     an empty bytecode cache directory, filled by this run
+#   warm     the directory the cold run filled, as after a restart
+#
+# One extra run under `python -X importtime` lists the packages whose
+# modules take longest to import. Medians are written to
+# bench/results/startup-<timestamp>.json, next to the route benchmarks:
+#
+#   python -m bench.startup run --scale 10 --repeat 5
+#   python -m bench.routes save-baseline bench/results/startup-<ts>.json --name startup
+#   python -m bench.startup compare bench/baselines/startup.json bench/results/startup-<ts>.json
+#
+# `compare` exits with status 1 when a phase of a scenario got slower than the
+# baseline by more than the threshold.
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+RESULTS_DIR = os.path.join(BASE, 'bench', 'results')
+SCENARIOS = ('nocache', 'cold', 'warm')
+FIRST_PATHS = ('/members', '/equipment', '/reports/top_authors', '/view/authorship')
+PHASES = ('process_s', 'import_s', 'create_app_s', 'templates_s', 'first_request_ms', 'budget_s')
+IMPORT_TOP = 15
+
+
+# ---- inside the measured process ------------------------------------------------
+
+def cmd_child(args):
+    # no app imports before this point, so the import is measured cold
+    t0 = time.perf_counter()
+    from app.app import compile_templates, create_app
+    t1 = time.perf_counter()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{args.db}', 'OCCUPANCY_SWEEPER': False})
+    t2 = time.perf_counter()
+    n = compile_templates(app)
+    t3 = time.perf_counter()
+    client = app.test_client()
+    first, second = {}, {}
+    for out in (first, second):
+        for path in args.paths.split(','):
+            t = time.perf_counter()
+            resp = client.get(path)
+            resp.close()
+            out[path] = round((time.perf_counter() - t) * 1000, 3)
+            if resp.status_code >= 400:
+                raise SystemExit(f'{path} answered {resp.status_code}')
+    json.dump({'import_s': t1 - t0, 'create_app_s': t2 - t1, 'templates_s': t3 - t2, 'templates': n,
+               'first_request_ms': first, 'second_request_ms': second}, sys.stdout)
+
+
+# ---- driver --------------------------------------------------------------------
+
+def _sample(db, cache_dir, paths, importtime=False):
+    env = dict(os.environ, JINJA_CACHE_DIR=cache_dir, PYTHONPATH=BASE)
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+          ['-m', 'bench.startup', 'child', '--db', db, '--paths', ','.join(paths)]
+    t = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=BASE, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t
+    if proc.returncode:
+        raise SystemExit(f'startup child failed:\n{proc.stderr}')
+    sample = json.loads(proc.stdout)
+    sample['process_s'] = elapsed
+    return sample, proc.stderr
+
+
+def _top_imports(stderr, n=IMPORT_TOP):
+    # "import time: self [us] | cumulative | imported package"; self times summed per top-level package
+    totals = {}
+    for line in stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|\s+\d+ \| +(\S+)$', line)
+        if m:
+            root = m.group(2).split('.')[0]
+            totals[root] = totals.get(root, 0) + int(m.group(1)) / 1e6
+    top = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:n]
+    return [{'package': name, 'self_s': round(s, 4)} for name, s in top]
+
+
+def _summary(samples):
+    # medians per phase; budget_s is what a new worker spends before its pages are fast
+    out = {}
+    for key in ('process_s', 'import_s', 'create_app_s', 'templates_s'):
+        out[key] = round(statistics.median(s[key] for s in samples), 4)
+    for key in ('first_request_ms', 'second_request_ms'):
+        out[key] = {p: round(statistics.median(s[key][p] for s in samples), 3) for p in samples[0][key]}
+    out['budget_s'] = round(statistics.median(
+        s['import_s'] + s['create_app_s'] + s['templates_s'] + sum(s['first_request_ms'].values()) / 1000
+        for s in samples), 4)
+    out['templates'] = samples[0]['templates']
+    return out
+
+
+def cmd_run(args):
+    from bench.routes import _git_rev, ensure_db
+
+    paths = args.paths.split(',')
+    src = ensure_db(args.scale, args.seed)
+    report = {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git': _git_rev(), 'python': platform.python_version(),
+                 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(), 'seed': args.seed,
+                 'repeat': args.repeat, 'scale': args.scale, 'paths': paths},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(src, db)
+        cache = os.path.join(tmp, 'jinja')
+        for scenario in SCENARIOS:
+            samples = []
+            for _ in range(args.repeat):
+                if scenario == 'cold':
+                    shutil.rmtree(cache, ignore_errors=True)
+                samples.append(_sample(db, '' if scenario == 'nocache' else cache, paths)[0])
+            result = report['results'][scenario] = _summary(samples)
+            print(f'  {scenario:8s} process={result["process_s"]:.3f}s import={result["import_s"]:.3f}s '
+                  f'create_app={result["create_app_s"]:.3f}s templates={result["templates_s"]:.3f}s '
+                  f'first={sum(result["first_request_ms"].values()):.1f}ms budget={result["budget_s"]:.3f}s')
+        _, stderr = _sample(db, cache, paths, importtime=True)
+        report['imports'] = _top_imports(stderr)
+    for row in report['imports'][:5]:
+        print(f'  import {row["package"]:24s} {row["self_s"]:.3f}s')
+    out = args.out or os.path.join(RESULTS_DIR, f'startup-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote', out)
+
+
+def compare(baseline, current, threshold, min_s=0.01):
+    # returns a list of (scenario, phase, old, new) regressions, in seconds
+    regressions = []
+    for scenario, cur in current['results'].items():
+        old = baseline['results'].get(scenario)
+        if not old:
+            continue
+        for phase in PHASES:
+            new_v, old_v = cur[phase], old[phase]
+            if phase == 'first_request_ms':
+                new_v, old_v = sum(new_v.values()) / 1000, sum(old_v.values()) / 1000
+            # ignore noise below min_s
+            if new_v > max(old_v, min_s) * (1 + threshold):
+                regressions.append((scenario, phase, old_v, new_v))
+    return regressions
+
+
+def cmd_compare(args):
+    with open(args.baseline, encoding='utf8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf8') as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_s)
+    for scenario, phase, old, new in regressions:
+        print(f'REGRESSION {scenario} {phase}: {old:.3f}s -> {new:.3f}s ({(new / old - 1) * 100 if old else float("inf"):+.0f}%)')
+    if regressions:
+        sys.exit(1)
+    print('No regressions beyond', f'{args.threshold:.0%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start profile of the lab manager app')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('run', help='profile fresh processes and write a results JSON file')
+    p.add_argument('--scale', type=int, default=10)
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--repeat', type=int, default=5, help='processes per scenario (default: 5)')
+    p.add_argument('--paths', default=','.join(FIRST_PATHS), help='comma separated pages requested after startup')
+    p.add_argument('--out', help='results file (default: bench/results/startup-<timestamp>.json)')
+    p.set_defaults(func=cmd_run)
+    p = sub.add_parser('compare', help='fail if a startup phase regresses against a baseline')
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown (default: 0.25)')
+    p.add_argument('--min-s', type=float, default=0.01, help='phases below this many seconds are noise (default: 0.01)')
+    p.set_defaults(func=cmd_compare)
+    p = sub.add_parser('child', help=argparse.SUPPRESS)
+    p.add_argument('--db', required=True)
+    p.add_argument('--paths', required=True)
+    p.set_defaults(func=cmd_child)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
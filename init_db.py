@@ -1,8 +1,14 @@
 import sqlite3
 import os
+import argparse
+import random
+import time
+from datetime import date, timedelta
 
 BASE = os.path.dirname(__file__)
 SQL_DIR = os.path.join(BASE, 'sql')
+MIGRATIONS_DIR = os.path.join(SQL_DIR, 'migrations')
+REBUILD_SQL = os.path.join(SQL_DIR, 'rebuild_derived.sql')
 DB_PATH = os.path.join(BASE, 'labmanager.db')
 
 def run_sql_file(conn, path):
@@ -10,14 +16,257 @@ def run_sql_file(conn, path):
         sql = f.read()
     conn.executescript(sql)
 
-if __name__ == '__main__':
-    if os.path.exists(DB_PATH):
-        print('Removing old DB at', DB_PATH)
-        os.remove(DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
+def apply_migrations(conn):
+    # migrations are numbered NNN_name.sql; PRAGMA user_version records the last one applied
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not name.endswith('.sql'):
+            continue
+        version = int(name.split('_', 1)[0])
+        if version <= current:
+            continue
+        run_sql_file(conn, os.path.join(MIGRATIONS_DIR, name))
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+        print('Applied migration', name)
+
+# --- synthetic data -------------------------------------------------------
+#
+# generate_data() builds a deterministic lab of arbitrary size from a scale
+# factor and a seed. Scale 1 is a small lab (~40 members, 1k bookings); the
+# row counts grow linearly, so scale 1000 gives ~1M bookings. The business
+# rules enforced by the triggers and routes hold by construction:
+#   - at most 3 bookings per equipment per day, by distinct members, inside
+#     one day, so neither the 3-user limit nor the same-day rule is violated
+#   - allocations per grant sum to less than its budget
+#   - mentors always come earlier in a fixed ordering (acyclic) and students
+#     never mentor faculty; each mentee has one mentorship
+#   - project end dates never precede start dates
+
+DEPARTMENTS = ['Computer Science', 'Electrical Engineering', 'Biomedical Engineering', 'Physics', 'Mathematics']
+TITLES = ['Professor', 'Associate Professor', 'Assistant Professor', 'Research Professor']
+LEVELS = ['freshman', 'sophomore', 'junior', 'senior', 'graduate', 'graduate', 'graduate']
+ORGS = ['ACME Labs', 'TechCorp', 'Globex', 'Initech', 'Umbrella Research', 'Stark Industries']
+SOURCES = ['NSF', 'NIH', 'DOE', 'DARPA', 'Industry', 'Foundation']
+EQUIP_TYPES = ['Microscope', '3D Printer', 'EEG', 'Oscilloscope', 'GPU Server', 'Spectrometer', 'Robot Arm']
+VENUES = ['ICML', 'NeurIPS', 'CVPR', 'Nature', 'IEEE TMI', 'ACL', 'KDD', 'SIGMOD']
+ROLES = ['researcher', 'developer', 'analyst', 'research assistant']
+FIRST = ['Alice', 'Bob', 'Carol', 'Dan', 'Eve', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy', 'Mallory', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Trent', 'Victor', 'Walter', 'Yara']
+LAST = ['Smith', 'Johnson', 'Lee', 'Adams', 'Baker', 'Chen', 'Diaz', 'Flores', 'Green', 'Garcia', 'Patel', 'Nguyen', 'Kim', 'Brown', 'Ito', 'Novak']
+SLOTS = [f'{h:02d}:{m:02d}' for h in range(8, 19) for m in (0, 30)]
+
+def _add_months(d, months):
+    y, m = divmod(d.month - 1 + months, 12)
+    return date(d.year + y, m + 1, min(d.day, 28))
+
+def generate_data(scale=1, seed=42, anchor=date(2025, 6, 30), years=3):
+    rnd = random.Random(seed)
+    n_fac = max(3, 5 * scale)
+    n_stu = max(4, 30 * scale)
+    n_col = max(2, 5 * scale)
+    n_proj = max(5, 10 * scale)
+    n_grant = max(3, 4 * scale)
+    n_equip = max(3, 5 * scale)
+    n_pub = max(5, 15 * scale)
+    bookings_per_equip = 200
+    start = anchor - timedelta(days=365 * years)
+    rows = {t: [] for t in ('LabMember', 'Faculty', 'Student', 'Collaborator', 'Project', 'GrantFund',
+                            'ProjectGrant', 'WorksOn', 'Equipment', 'EquipmentUse', 'Publication',
+                            'Authorship', 'Mentorship')}
+
+    def name():
+        return f'{rnd.choice(FIRST)} {rnd.choice(LAST)}'
+
+    def rand_date(lo, hi):
+        return lo + timedelta(days=rnd.randrange(max((hi - lo).days, 1)))
+
+    # members: faculty joined earliest, students most recently
+    faculty, students, collabs = [], [], []
+    for i in range(1, n_fac + 1):
+        mid = f'F{i}'
+        jd = rand_date(date(2005, 1, 1), start)
+        faculty.append((mid, jd))
+        rows['LabMember'].append((mid, 'Dr. ' + name(), 'faculty', jd.isoformat()))
+        rows['Faculty'].append((mid, rnd.choice(DEPARTMENTS), 'NJIT', rnd.choice(TITLES)))
+    for i in range(1, n_stu + 1):
+        mid = f'S{i}'
+        jd = rand_date(start - timedelta(days=365 * 4), anchor)
+        students.append((mid, jd))
+        rows['LabMember'].append((mid, name(), 'student', jd.isoformat()))
+        rows['Student'].append((mid, f'S{jd.year}{i:06d}', rnd.choice(LEVELS), rnd.choice(DEPARTMENTS), 'NJIT'))
+    for i in range(1, n_col + 1):
+        mid = f'O{i}'
+        jd = rand_date(date(2015, 1, 1), anchor)
+        collabs.append((mid, jd))
+        rows['LabMember'].append((mid, name(), 'collaborator', jd.isoformat()))
+        org = rnd.choice(ORGS)
+        rows['Collaborator'].append((mid, org, f'o{i}@{org.split()[0].lower()}.example', 'Visiting collaborator'))
+    members = faculty + students + collabs
+    member_ids = [m for m, _ in members]
+
+    # projects led by faculty; leader is recorded in WorksOn as 'leader'
+    projects = []
+    for i in range(1, n_proj + 1):
+        pid = f'P{i}'
+        sd = rand_date(start - timedelta(days=365 * 2), anchor)
+        dur = rnd.randint(12, 48)
+        ed = _add_months(sd, dur)
+        if ed < anchor:
+            status, end = 'completed', ed
+        else:
+            status, end = rnd.choice(['active', 'active', 'active', 'paused']), (ed if rnd.random() < 0.6 else None)
+        leader = rnd.choice(faculty)[0]
+        projects.append((pid, sd))
+        rows['Project'].append((pid, f'Project {i}: {rnd.choice(["AI", "Robotics", "Imaging", "NLP", "Sensors", "Data"])} {rnd.choice(["Platform", "Toolkit", "Study", "Pipeline"])}',
+                                sd.isoformat(), end.isoformat() if end else None, dur, status, leader))
+        rows['WorksOn'].append((leader, pid, 'leader', 10))
+    # students and collaborators work on 1-2 projects each
+    for mid, _ in students + collabs:
+        for pid, _ in rnd.sample(projects, min(len(projects), rnd.randint(1, 2))):
+            rows['WorksOn'].append((mid, pid, rnd.choice(ROLES), rnd.choice([5, 10, 15, 20])))
+    seen = set()
+    rows['WorksOn'] = [w for w in rows['WorksOn'] if (w[0], w[1]) not in seen and not seen.add((w[0], w[1]))]
+
+    # grants: allocations to 1-4 projects summing to at most 95% of the budget
+    for i in range(1, n_grant + 1):
+        gid = f'G{i}'
+        budget = rnd.randrange(50, 1000) * 1000
+        rows['GrantFund'].append((gid, rnd.choice(SOURCES), budget, rand_date(start - timedelta(days=365 * 2), anchor).isoformat(), rnd.choice([12, 24, 36, 48, 60])))
+        chosen = rnd.sample(projects, min(len(projects), rnd.randint(1, 4)))
+        weights = [rnd.random() for _ in chosen]
+        share = 0.95 * rnd.uniform(0.3, 1.0) / sum(weights)
+        for (pid, _), w in zip(chosen, weights):
+            rows['ProjectGrant'].append((pid, gid, round(budget * w * share, 2)))
+
+    # equipment and bookings
+    days = [(start + timedelta(days=d)).isoformat() for d in range((anchor - start).days)]
+    per_day = bookings_per_equip / len(days)
+    use_n = 0
+    for i in range(1, n_equip + 1):
+        eid = f'E{i}'
+        etype = rnd.choice(EQUIP_TYPES)
+        rows['Equipment'].append((eid, f'{etype} #{i}', etype, rand_date(date(2010, 1, 1), start).isoformat(), 'available', f'Room {100 + i % 50}', 'generated'))
+        for day in days:
+            # 0-3 bookings that day, expected value per_day
+            k = sum(1 for _ in range(3) if rnd.random() < per_day / 3)
+            if not k:
+                continue
+            for mid in rnd.sample(member_ids, k):
+                a = rnd.randrange(len(SLOTS) - 1)
+                b = rnd.randrange(a + 1, min(a + 8, len(SLOTS)))
+                use_n += 1
+                rows['EquipmentUse'].append((f'U{use_n}', eid, mid, f'{day} {SLOTS[a]}', f'{day} {SLOTS[b]}', rnd.choice(['imaging', 'sample prep', 'calibration', 'experiment', 'training run'])))
+
+    # publications with 1-5 distinct authors, first author is primary
+    for i in range(1, n_pub + 1):
+        bid = f'B{i}'
+        rows['Publication'].append((bid, f'Paper {i}', rand_date(start, anchor).isoformat(), rnd.choice(VENUES), f'10.5555/gen.{i}', rnd.choice(['published', 'published', 'submitted', 'in review'])))
+        authors = rnd.sample(member_ids, min(len(member_ids), rnd.randint(1, 5)))
+        for order, mid in enumerate(authors, 1):
+            rows['Authorship'].append((bid, mid, order, 'primary' if order == 1 else None))
+
+    # mentorships: mentor precedes mentee in faculty < students < collaborators order
+    def mentorship(mentor, mentee, lo):
+        sd = rand_date(lo, anchor)
+        ed = _add_months(sd, rnd.randint(6, 48)) if rnd.random() < 0.5 else None
+        rows['Mentorship'].append((mentor, mentee, sd.isoformat(), ed.isoformat() if ed else None, None))
+    for idx, (mid, jd) in enumerate(faculty[1:], 1):
+        if rnd.random() < 0.2:
+            mentor, mjd = faculty[rnd.randrange(idx)]
+            mentorship(mentor, mid, max(jd, mjd))
+    for idx, (mid, jd) in enumerate(students):
+        if idx and rnd.random() < 0.3:
+            mentor, mjd = students[rnd.randrange(idx)]
+        else:
+            mentor, mjd = rnd.choice(faculty)
+        mentorship(mentor, mid, max(jd, mjd))
+    for mid, jd in collabs:
+        if rnd.random() < 0.3:
+            mentor, mjd = rnd.choice(faculty)
+            mentorship(mentor, mid, max(jd, mjd))
+    return rows
+
+INSERTS = {
+    'LabMember': 'INSERT INTO LabMember(member_id, name, member_type, join_date) VALUES (?, ?, ?, ?)',
+    'Faculty': 'INSERT INTO Faculty(member_id, department, affiliation, title) VALUES (?, ?, ?, ?)',
+    'Student': 'INSERT INTO Student(member_id, student_number, academic_level, major, affiliation) VALUES (?, ?, ?, ?, ?)',
+    'Collaborator': 'INSERT INTO Collaborator(member_id, organization, contact_info, biography) VALUES (?, ?, ?, ?)',
+    'Project': 'INSERT INTO Project(project_id, title, start_date, end_date, expected_duration, status, leader_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+    'GrantFund': 'INSERT INTO GrantFund(grant_id, source, budget, start_date, duration) VALUES (?, ?, ?, ?, ?)',
+    'ProjectGrant': 'INSERT INTO ProjectGrant(project_id, grant_id, amount_allocated) VALUES (?, ?, ?)',
+    'WorksOn': 'INSERT INTO WorksOn(member_id, project_id, role, weekly_hours) VALUES (?, ?, ?, ?)',
+    'Equipment': 'INSERT INTO Equipment(equip_id, name, type, purchase_date, status, location, notes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+    'EquipmentUse': 'INSERT INTO EquipmentUse(use_id, equip_id, member_id, use_start, use_end, purpose) VALUES (?, ?, ?, ?, ?, ?)',
+    'Publication': 'INSERT INTO Publication(pub_id, title, pub_date, venue, doi, status) VALUES (?, ?, ?, ?, ?, ?)',
+    'Authorship': 'INSERT INTO Authorship(pub_id, member_id, author_order, author_role) VALUES (?, ?, ?, ?)',
+    'Mentorship': 'INSERT INTO Mentorship(mentor_id, mentee_id, start_date, end_date, notes) VALUES (?, ?, ?, ?, ?)',
+}
+
+def bulk_load(conn, rows):
+    # fast path: no journal/fsync, indexes and triggers dropped during the load and
+    # recreated afterwards (the generated rows already satisfy the trigger rules)
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    deferred = conn.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL").fetchall()
+    for type_, name, _ in deferred:
+        conn.execute(f'DROP {type_.upper()} {name}')
+    conn.execute('BEGIN')
+    for table, stmt in INSERTS.items():
+        conn.executemany(stmt, rows[table])
+    conn.commit()
+    conn.execute('BEGIN')
+    for type_ in ('index', 'trigger'):
+        for t, _, sql in deferred:
+            if t == type_:
+                conn.execute(sql)
+    conn.commit()
+    # the triggers were off during the load, so recompute what they maintain
+    run_sql_file(conn, REBUILD_SQL)
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.execute('PRAGMA synchronous = FULL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('ANALYZE')
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or upgrade the lab manager database')
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: labmanager.db)')
+    parser.add_argument('--migrate', action='store_true', help='apply pending migrations to an existing database instead of recreating it')
+    parser.add_argument('--scale', type=int, default=None, help='load generated data at this scale factor instead of sql/sample_data.sql (1000 ~ 1M bookings)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for --scale (default: 42)')
+    parser.add_argument('--anchor', default='2025-06-30', help="last day of generated history, YYYY-MM-DD or 'today' (default: 2025-06-30)")
+    args = parser.parse_args()
+
+    if args.migrate:
+        conn = sqlite3.connect(args.db)
+        apply_migrations(conn)
+        conn.close()
+        print('Database at', args.db, 'is up to date')
+        return
+
+    if os.path.exists(args.db):
+        print('Removing old DB at', args.db)
+        os.remove(args.db)
+    conn = sqlite3.connect(args.db)
     conn.row_factory = sqlite3.Row
     run_sql_file(conn, os.path.join(SQL_DIR, 'schema_sqlite.sql'))
-    run_sql_file(conn, os.path.join(SQL_DIR, 'sample_data.sql'))
+    apply_migrations(conn)
+    if args.scale:
+        anchor = date.today() if args.anchor == 'today' else date.fromisoformat(args.anchor)
+        t0 = time.perf_counter()
+        rows = generate_data(args.scale, args.seed, anchor)
+        t1 = time.perf_counter()
+        bulk_load(conn, rows)
+        t2 = time.perf_counter()
+        print(', '.join(f'{t}={len(r)}' for t, r in rows.items()))
+        print(f'Generated in {t1 - t0:.1f}s, loaded in {t2 - t1:.1f}s')
+    else:
+        run_sql_file(conn, os.path.join(SQL_DIR, 'sample_data.sql'))
     conn.commit()
     conn.close()
-    print('Initialized database at', DB_PATH)
+    print('Initialized database at', args.db)
+
+if __name__ == '__main__':
+    main()
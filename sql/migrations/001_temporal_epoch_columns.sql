@@ -0,0 +1,65 @@
+-- Integer epoch companions for the TEXT date/time columns.
+-- Values are seconds since 1970 (naive timestamps read as UTC, like strftime('%s')).
+-- A missing end is stored as the largest INTEGER so open intervals compare as "never ends"
+-- and every overlap test becomes a plain range predicate over indexed integers.
+
+ALTER TABLE EquipmentUse ADD COLUMN use_start_ts INTEGER
+    GENERATED ALWAYS AS (CAST(strftime('%s', use_start) AS INTEGER)) VIRTUAL;
+ALTER TABLE EquipmentUse ADD COLUMN use_end_ts INTEGER
+    GENERATED ALWAYS AS (COALESCE(CAST(strftime('%s', use_end) AS INTEGER), 9223372036854775807)) VIRTUAL;
+
+ALTER TABLE Project ADD COLUMN start_ts INTEGER
+    GENERATED ALWAYS AS (CAST(strftime('%s', start_date) AS INTEGER)) VIRTUAL;
+ALTER TABLE Project ADD COLUMN end_ts INTEGER
+    GENERATED ALWAYS AS (COALESCE(CAST(strftime('%s', end_date) AS INTEGER), 9223372036854775807)) VIRTUAL;
+
+ALTER TABLE Mentorship ADD COLUMN start_ts INTEGER
+    GENERATED ALWAYS AS (CAST(strftime('%s', start_date) AS INTEGER)) VIRTUAL;
+ALTER TABLE Mentorship ADD COLUMN end_ts INTEGER
+    GENERATED ALWAYS AS (COALESCE(CAST(strftime('%s', end_date) AS INTEGER), 9223372036854775807)) VIRTUAL;
+
+-- Overlap with [s, e] is "end_ts >= s AND start_ts <= e". Leading with the end
+-- column keeps the scan to bookings that have not finished before s, which is
+-- a small slice of history for availability and "in use now" questions.
+CREATE INDEX idx_equipmentuse_equip_range ON EquipmentUse(equip_id, use_end_ts, use_start_ts);
+CREATE INDEX idx_equipmentuse_member_equip ON EquipmentUse(member_id, equip_id, use_start_ts);
+CREATE INDEX idx_project_range ON Project(end_ts, start_ts);
+CREATE INDEX idx_mentorship_mentee_range ON Mentorship(mentee_id, end_ts, start_ts);
+
+-- Rewrite the concurrency triggers against the integer columns so they run as
+-- index range scans instead of comparing timestamp strings row by row. The
+-- bounds of the new row are computed from NEW.use_start/NEW.use_end: in a
+-- BEFORE UPDATE trigger a virtual column whose source column is not SET by the
+-- statement reads as NULL, and an overlap test against NULL matches nothing.
+DROP TRIGGER IF EXISTS check_equipment_concurrency;
+CREATE TRIGGER check_equipment_concurrency
+BEFORE INSERT ON EquipmentUse
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN (
+            (SELECT COUNT(*) FROM EquipmentUse eu
+             WHERE eu.equip_id = NEW.equip_id
+               AND eu.use_end_ts > CAST(strftime('%s', NEW.use_start) AS INTEGER)
+               AND eu.use_start_ts < COALESCE(CAST(strftime('%s', NEW.use_end) AS INTEGER), 9223372036854775807)
+            ) >= 3
+        ) THEN RAISE(ABORT, 'Equipment concurrency limit exceeded (max 3 users)')
+    END;
+END;
+
+DROP TRIGGER IF EXISTS check_equipment_concurrency_update;
+CREATE TRIGGER check_equipment_concurrency_update
+BEFORE UPDATE ON EquipmentUse
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN (
+            (SELECT COUNT(*) FROM EquipmentUse eu
+             WHERE eu.equip_id = NEW.equip_id
+               AND eu.use_id != OLD.use_id
+               AND eu.use_end_ts > CAST(strftime('%s', NEW.use_start) AS INTEGER)
+               AND eu.use_start_ts < COALESCE(CAST(strftime('%s', NEW.use_end) AS INTEGER), 9223372036854775807)
+            ) >= 3
+        ) THEN RAISE(ABORT, 'Equipment concurrency limit exceeded (max 3 users)')
+    END;
+END;
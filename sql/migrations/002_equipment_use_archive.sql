@@ -0,0 +1,31 @@
+-- Cold storage for completed bookings. app/archive.py moves rows that ended
+-- before the archive horizon out of EquipmentUse so the hot table (and the
+-- concurrency triggers that scan it) only holds current activity.
+
+CREATE TABLE EquipmentUseArchive (
+    use_id TEXT PRIMARY KEY,
+    equip_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    use_start DATETIME NOT NULL,
+    use_end DATETIME NOT NULL,
+    purpose TEXT,
+    archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    use_start_ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', use_start) AS INTEGER)) VIRTUAL,
+    use_end_ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', use_end) AS INTEGER)) VIRTUAL,
+    FOREIGN KEY(equip_id) REFERENCES Equipment(equip_id) ON DELETE CASCADE,
+    FOREIGN KEY(member_id) REFERENCES LabMember(member_id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_equipmentusearchive_equip_range ON EquipmentUseArchive(equip_id, use_start_ts, use_end_ts);
+CREATE INDEX idx_equipmentusearchive_member ON EquipmentUseArchive(member_id);
+
+-- lets the archiver pick the oldest completed bookings without a full scan
+CREATE INDEX idx_equipmentuse_end ON EquipmentUse(use_end_ts);
+
+-- Full booking history for reports: hot rows first, then archived ones.
+CREATE VIEW EquipmentUseHistory AS
+    SELECT use_id, equip_id, member_id, use_start, use_end, purpose, use_start_ts, use_end_ts, 0 AS archived
+    FROM EquipmentUse
+    UNION ALL
+    SELECT use_id, equip_id, member_id, use_start, use_end, purpose, use_start_ts, use_end_ts, 1 AS archived
+    FROM EquipmentUseArchive;
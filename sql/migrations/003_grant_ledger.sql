@@ -0,0 +1,63 @@
+-- Grant ledger: GrantFund.allocated_total is the running sum of the grant's
+-- ProjectGrant allocations, kept current by the triggers below, so a budget
+-- check is one primary-key lookup instead of a scan over every allocation.
+-- The BEFORE triggers reject an allocation that would take a grant over its
+-- budget in the same statement that writes it (see app/ledger.py).
+
+ALTER TABLE GrantFund ADD COLUMN allocated_total REAL NOT NULL DEFAULT 0;
+
+UPDATE GrantFund SET allocated_total = COALESCE(
+    (SELECT SUM(amount_allocated) FROM ProjectGrant WHERE ProjectGrant.grant_id = GrantFund.grant_id), 0);
+
+-- 1e-6 absorbs float drift from the running sum. An upsert fires the INSERT
+-- trigger even when it ends up updating, so the row's current amount (a
+-- primary-key lookup) is credited back before comparing.
+CREATE TRIGGER check_grant_budget_insert
+BEFORE INSERT ON ProjectGrant
+BEGIN
+    SELECT CASE
+        WHEN (SELECT budget IS NOT NULL
+                     AND allocated_total
+                         - COALESCE((SELECT amount_allocated FROM ProjectGrant
+                                     WHERE project_id = NEW.project_id AND grant_id = NEW.grant_id), 0)
+                         + COALESCE(NEW.amount_allocated, 0) > budget + 1e-6
+              FROM GrantFund WHERE grant_id = NEW.grant_id)
+        THEN RAISE(ABORT, 'Grant budget exceeded')
+    END;
+END;
+
+CREATE TRIGGER check_grant_budget_update
+BEFORE UPDATE OF amount_allocated, grant_id ON ProjectGrant
+BEGIN
+    SELECT CASE
+        WHEN (SELECT budget IS NOT NULL
+                     AND allocated_total
+                         - (CASE WHEN OLD.grant_id = NEW.grant_id THEN COALESCE(OLD.amount_allocated, 0) ELSE 0 END)
+                         + COALESCE(NEW.amount_allocated, 0) > budget + 1e-6
+              FROM GrantFund WHERE grant_id = NEW.grant_id)
+        THEN RAISE(ABORT, 'Grant budget exceeded')
+    END;
+END;
+
+CREATE TRIGGER grant_ledger_insert
+AFTER INSERT ON ProjectGrant
+BEGIN
+    UPDATE GrantFund SET allocated_total = allocated_total + COALESCE(NEW.amount_allocated, 0)
+    WHERE grant_id = NEW.grant_id;
+END;
+
+CREATE TRIGGER grant_ledger_update
+AFTER UPDATE OF amount_allocated, grant_id ON ProjectGrant
+BEGIN
+    UPDATE GrantFund SET allocated_total = allocated_total - COALESCE(OLD.amount_allocated, 0)
+    WHERE grant_id = OLD.grant_id;
+    UPDATE GrantFund SET allocated_total = allocated_total + COALESCE(NEW.amount_allocated, 0)
+    WHERE grant_id = NEW.grant_id;
+END;
+
+CREATE TRIGGER grant_ledger_delete
+AFTER DELETE ON ProjectGrant
+BEGIN
+    UPDATE GrantFund SET allocated_total = allocated_total - COALESCE(OLD.amount_allocated, 0)
+    WHERE grant_id = OLD.grant_id;
+END;
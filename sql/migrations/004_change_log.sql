@@ -0,0 +1,436 @@
+-- Change-data capture. Every insert, update and delete on the application
+-- tables appends one row to ChangeLog: a monotonically increasing seq
+-- (AUTOINCREMENT, so pruned numbers are never handed out again), the table,
+-- the operation (I/U/D), the primary key as a JSON array and, for updates,
+-- the comma-separated names of the columns that changed. Consumers poll
+-- /changes?since=<seq>; app/changes.py also compacts and prunes the log.
+-- Generated (virtual) columns are derived and not tracked.
+
+CREATE TABLE ChangeLog (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    tbl TEXT NOT NULL,
+    op TEXT NOT NULL CHECK(op IN ('I','U','D')),
+    pk TEXT NOT NULL,
+    cols TEXT,
+    changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+
+-- per-table feeds and data versions (MAX(seq) per table)
+CREATE INDEX idx_changelog_tbl_seq ON ChangeLog(tbl, seq);
+
+-- name -> value bookkeeping; 'pruned_through' is the highest seq removed by retention
+CREATE TABLE ChangeLogMeta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT INTO ChangeLogMeta(name, value) VALUES ('pruned_through', 0);
+
+-- LabMember
+CREATE TRIGGER changelog_labmember_insert
+AFTER INSERT ON LabMember
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('LabMember', 'I', json_array(NEW.member_id));
+END;
+CREATE TRIGGER changelog_labmember_update
+AFTER UPDATE ON LabMember
+WHEN OLD.member_id IS NOT NEW.member_id
+     OR OLD.name IS NOT NEW.name
+     OR OLD.member_type IS NOT NEW.member_type
+     OR OLD.join_date IS NOT NEW.join_date
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'LabMember', 'D', json_array(OLD.member_id) WHERE OLD.member_id IS NOT NEW.member_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('LabMember', CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'I' ELSE 'U' END, json_array(NEW.member_id),
+        rtrim(CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.name IS NOT NEW.name THEN 'name,' ELSE '' END
+            || CASE WHEN OLD.member_type IS NOT NEW.member_type THEN 'member_type,' ELSE '' END
+            || CASE WHEN OLD.join_date IS NOT NEW.join_date THEN 'join_date,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_labmember_delete
+AFTER DELETE ON LabMember
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('LabMember', 'D', json_array(OLD.member_id));
+END;
+
+-- Faculty
+CREATE TRIGGER changelog_faculty_insert
+AFTER INSERT ON Faculty
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Faculty', 'I', json_array(NEW.member_id));
+END;
+CREATE TRIGGER changelog_faculty_update
+AFTER UPDATE ON Faculty
+WHEN OLD.member_id IS NOT NEW.member_id
+     OR OLD.department IS NOT NEW.department
+     OR OLD.affiliation IS NOT NEW.affiliation
+     OR OLD.title IS NOT NEW.title
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Faculty', 'D', json_array(OLD.member_id) WHERE OLD.member_id IS NOT NEW.member_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Faculty', CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'I' ELSE 'U' END, json_array(NEW.member_id),
+        rtrim(CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.department IS NOT NEW.department THEN 'department,' ELSE '' END
+            || CASE WHEN OLD.affiliation IS NOT NEW.affiliation THEN 'affiliation,' ELSE '' END
+            || CASE WHEN OLD.title IS NOT NEW.title THEN 'title,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_faculty_delete
+AFTER DELETE ON Faculty
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Faculty', 'D', json_array(OLD.member_id));
+END;
+
+-- Student
+CREATE TRIGGER changelog_student_insert
+AFTER INSERT ON Student
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Student', 'I', json_array(NEW.member_id));
+END;
+CREATE TRIGGER changelog_student_update
+AFTER UPDATE ON Student
+WHEN OLD.member_id IS NOT NEW.member_id
+     OR OLD.student_number IS NOT NEW.student_number
+     OR OLD.academic_level IS NOT NEW.academic_level
+     OR OLD.major IS NOT NEW.major
+     OR OLD.affiliation IS NOT NEW.affiliation
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Student', 'D', json_array(OLD.member_id) WHERE OLD.member_id IS NOT NEW.member_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Student', CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'I' ELSE 'U' END, json_array(NEW.member_id),
+        rtrim(CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.student_number IS NOT NEW.student_number THEN 'student_number,' ELSE '' END
+            || CASE WHEN OLD.academic_level IS NOT NEW.academic_level THEN 'academic_level,' ELSE '' END
+            || CASE WHEN OLD.major IS NOT NEW.major THEN 'major,' ELSE '' END
+            || CASE WHEN OLD.affiliation IS NOT NEW.affiliation THEN 'affiliation,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_student_delete
+AFTER DELETE ON Student
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Student', 'D', json_array(OLD.member_id));
+END;
+
+-- Collaborator
+CREATE TRIGGER changelog_collaborator_insert
+AFTER INSERT ON Collaborator
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Collaborator', 'I', json_array(NEW.member_id));
+END;
+CREATE TRIGGER changelog_collaborator_update
+AFTER UPDATE ON Collaborator
+WHEN OLD.member_id IS NOT NEW.member_id
+     OR OLD.organization IS NOT NEW.organization
+     OR OLD.contact_info IS NOT NEW.contact_info
+     OR OLD.biography IS NOT NEW.biography
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Collaborator', 'D', json_array(OLD.member_id) WHERE OLD.member_id IS NOT NEW.member_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Collaborator', CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'I' ELSE 'U' END, json_array(NEW.member_id),
+        rtrim(CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.organization IS NOT NEW.organization THEN 'organization,' ELSE '' END
+            || CASE WHEN OLD.contact_info IS NOT NEW.contact_info THEN 'contact_info,' ELSE '' END
+            || CASE WHEN OLD.biography IS NOT NEW.biography THEN 'biography,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_collaborator_delete
+AFTER DELETE ON Collaborator
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Collaborator', 'D', json_array(OLD.member_id));
+END;
+
+-- Project
+CREATE TRIGGER changelog_project_insert
+AFTER INSERT ON Project
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Project', 'I', json_array(NEW.project_id));
+END;
+CREATE TRIGGER changelog_project_update
+AFTER UPDATE ON Project
+WHEN OLD.project_id IS NOT NEW.project_id
+     OR OLD.title IS NOT NEW.title
+     OR OLD.start_date IS NOT NEW.start_date
+     OR OLD.end_date IS NOT NEW.end_date
+     OR OLD.expected_duration IS NOT NEW.expected_duration
+     OR OLD.status IS NOT NEW.status
+     OR OLD.leader_id IS NOT NEW.leader_id
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Project', 'D', json_array(OLD.project_id) WHERE OLD.project_id IS NOT NEW.project_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Project', CASE WHEN OLD.project_id IS NOT NEW.project_id THEN 'I' ELSE 'U' END, json_array(NEW.project_id),
+        rtrim(CASE WHEN OLD.project_id IS NOT NEW.project_id THEN 'project_id,' ELSE '' END
+            || CASE WHEN OLD.title IS NOT NEW.title THEN 'title,' ELSE '' END
+            || CASE WHEN OLD.start_date IS NOT NEW.start_date THEN 'start_date,' ELSE '' END
+            || CASE WHEN OLD.end_date IS NOT NEW.end_date THEN 'end_date,' ELSE '' END
+            || CASE WHEN OLD.expected_duration IS NOT NEW.expected_duration THEN 'expected_duration,' ELSE '' END
+            || CASE WHEN OLD.status IS NOT NEW.status THEN 'status,' ELSE '' END
+            || CASE WHEN OLD.leader_id IS NOT NEW.leader_id THEN 'leader_id,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_project_delete
+AFTER DELETE ON Project
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Project', 'D', json_array(OLD.project_id));
+END;
+
+-- GrantFund
+CREATE TRIGGER changelog_grantfund_insert
+AFTER INSERT ON GrantFund
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('GrantFund', 'I', json_array(NEW.grant_id));
+END;
+CREATE TRIGGER changelog_grantfund_update
+AFTER UPDATE ON GrantFund
+WHEN OLD.grant_id IS NOT NEW.grant_id
+     OR OLD.source IS NOT NEW.source
+     OR OLD.budget IS NOT NEW.budget
+     OR OLD.start_date IS NOT NEW.start_date
+     OR OLD.duration IS NOT NEW.duration
+     OR OLD.allocated_total IS NOT NEW.allocated_total
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'GrantFund', 'D', json_array(OLD.grant_id) WHERE OLD.grant_id IS NOT NEW.grant_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('GrantFund', CASE WHEN OLD.grant_id IS NOT NEW.grant_id THEN 'I' ELSE 'U' END, json_array(NEW.grant_id),
+        rtrim(CASE WHEN OLD.grant_id IS NOT NEW.grant_id THEN 'grant_id,' ELSE '' END
+            || CASE WHEN OLD.source IS NOT NEW.source THEN 'source,' ELSE '' END
+            || CASE WHEN OLD.budget IS NOT NEW.budget THEN 'budget,' ELSE '' END
+            || CASE WHEN OLD.start_date IS NOT NEW.start_date THEN 'start_date,' ELSE '' END
+            || CASE WHEN OLD.duration IS NOT NEW.duration THEN 'duration,' ELSE '' END
+            || CASE WHEN OLD.allocated_total IS NOT NEW.allocated_total THEN 'allocated_total,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_grantfund_delete
+AFTER DELETE ON GrantFund
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('GrantFund', 'D', json_array(OLD.grant_id));
+END;
+
+-- ProjectGrant
+CREATE TRIGGER changelog_projectgrant_insert
+AFTER INSERT ON ProjectGrant
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('ProjectGrant', 'I', json_array(NEW.project_id, NEW.grant_id));
+END;
+CREATE TRIGGER changelog_projectgrant_update
+AFTER UPDATE ON ProjectGrant
+WHEN OLD.project_id IS NOT NEW.project_id
+     OR OLD.grant_id IS NOT NEW.grant_id
+     OR OLD.amount_allocated IS NOT NEW.amount_allocated
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'ProjectGrant', 'D', json_array(OLD.project_id, OLD.grant_id) WHERE OLD.project_id IS NOT NEW.project_id OR OLD.grant_id IS NOT NEW.grant_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('ProjectGrant', CASE WHEN OLD.project_id IS NOT NEW.project_id OR OLD.grant_id IS NOT NEW.grant_id THEN 'I' ELSE 'U' END, json_array(NEW.project_id, NEW.grant_id),
+        rtrim(CASE WHEN OLD.project_id IS NOT NEW.project_id THEN 'project_id,' ELSE '' END
+            || CASE WHEN OLD.grant_id IS NOT NEW.grant_id THEN 'grant_id,' ELSE '' END
+            || CASE WHEN OLD.amount_allocated IS NOT NEW.amount_allocated THEN 'amount_allocated,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_projectgrant_delete
+AFTER DELETE ON ProjectGrant
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('ProjectGrant', 'D', json_array(OLD.project_id, OLD.grant_id));
+END;
+
+-- WorksOn
+CREATE TRIGGER changelog_workson_insert
+AFTER INSERT ON WorksOn
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('WorksOn', 'I', json_array(NEW.member_id, NEW.project_id));
+END;
+CREATE TRIGGER changelog_workson_update
+AFTER UPDATE ON WorksOn
+WHEN OLD.member_id IS NOT NEW.member_id
+     OR OLD.project_id IS NOT NEW.project_id
+     OR OLD.role IS NOT NEW.role
+     OR OLD.weekly_hours IS NOT NEW.weekly_hours
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'WorksOn', 'D', json_array(OLD.member_id, OLD.project_id) WHERE OLD.member_id IS NOT NEW.member_id OR OLD.project_id IS NOT NEW.project_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('WorksOn', CASE WHEN OLD.member_id IS NOT NEW.member_id OR OLD.project_id IS NOT NEW.project_id THEN 'I' ELSE 'U' END, json_array(NEW.member_id, NEW.project_id),
+        rtrim(CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.project_id IS NOT NEW.project_id THEN 'project_id,' ELSE '' END
+            || CASE WHEN OLD.role IS NOT NEW.role THEN 'role,' ELSE '' END
+            || CASE WHEN OLD.weekly_hours IS NOT NEW.weekly_hours THEN 'weekly_hours,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_workson_delete
+AFTER DELETE ON WorksOn
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('WorksOn', 'D', json_array(OLD.member_id, OLD.project_id));
+END;
+
+-- Equipment
+CREATE TRIGGER changelog_equipment_insert
+AFTER INSERT ON Equipment
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Equipment', 'I', json_array(NEW.equip_id));
+END;
+CREATE TRIGGER changelog_equipment_update
+AFTER UPDATE ON Equipment
+WHEN OLD.equip_id IS NOT NEW.equip_id
+     OR OLD.name IS NOT NEW.name
+     OR OLD.type IS NOT NEW.type
+     OR OLD.purchase_date IS NOT NEW.purchase_date
+     OR OLD.status IS NOT NEW.status
+     OR OLD.location IS NOT NEW.location
+     OR OLD.notes IS NOT NEW.notes
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Equipment', 'D', json_array(OLD.equip_id) WHERE OLD.equip_id IS NOT NEW.equip_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Equipment', CASE WHEN OLD.equip_id IS NOT NEW.equip_id THEN 'I' ELSE 'U' END, json_array(NEW.equip_id),
+        rtrim(CASE WHEN OLD.equip_id IS NOT NEW.equip_id THEN 'equip_id,' ELSE '' END
+            || CASE WHEN OLD.name IS NOT NEW.name THEN 'name,' ELSE '' END
+            || CASE WHEN OLD.type IS NOT NEW.type THEN 'type,' ELSE '' END
+            || CASE WHEN OLD.purchase_date IS NOT NEW.purchase_date THEN 'purchase_date,' ELSE '' END
+            || CASE WHEN OLD.status IS NOT NEW.status THEN 'status,' ELSE '' END
+            || CASE WHEN OLD.location IS NOT NEW.location THEN 'location,' ELSE '' END
+            || CASE WHEN OLD.notes IS NOT NEW.notes THEN 'notes,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_equipment_delete
+AFTER DELETE ON Equipment
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Equipment', 'D', json_array(OLD.equip_id));
+END;
+
+-- EquipmentUse
+CREATE TRIGGER changelog_equipmentuse_insert
+AFTER INSERT ON EquipmentUse
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('EquipmentUse', 'I', json_array(NEW.use_id));
+END;
+CREATE TRIGGER changelog_equipmentuse_update
+AFTER UPDATE ON EquipmentUse
+WHEN OLD.use_id IS NOT NEW.use_id
+     OR OLD.equip_id IS NOT NEW.equip_id
+     OR OLD.member_id IS NOT NEW.member_id
+     OR OLD.use_start IS NOT NEW.use_start
+     OR OLD.use_end IS NOT NEW.use_end
+     OR OLD.purpose IS NOT NEW.purpose
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'EquipmentUse', 'D', json_array(OLD.use_id) WHERE OLD.use_id IS NOT NEW.use_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('EquipmentUse', CASE WHEN OLD.use_id IS NOT NEW.use_id THEN 'I' ELSE 'U' END, json_array(NEW.use_id),
+        rtrim(CASE WHEN OLD.use_id IS NOT NEW.use_id THEN 'use_id,' ELSE '' END
+            || CASE WHEN OLD.equip_id IS NOT NEW.equip_id THEN 'equip_id,' ELSE '' END
+            || CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.use_start IS NOT NEW.use_start THEN 'use_start,' ELSE '' END
+            || CASE WHEN OLD.use_end IS NOT NEW.use_end THEN 'use_end,' ELSE '' END
+            || CASE WHEN OLD.purpose IS NOT NEW.purpose THEN 'purpose,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_equipmentuse_delete
+AFTER DELETE ON EquipmentUse
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('EquipmentUse', 'D', json_array(OLD.use_id));
+END;
+
+-- Publication
+CREATE TRIGGER changelog_publication_insert
+AFTER INSERT ON Publication
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Publication', 'I', json_array(NEW.pub_id));
+END;
+CREATE TRIGGER changelog_publication_update
+AFTER UPDATE ON Publication
+WHEN OLD.pub_id IS NOT NEW.pub_id
+     OR OLD.title IS NOT NEW.title
+     OR OLD.pub_date IS NOT NEW.pub_date
+     OR OLD.venue IS NOT NEW.venue
+     OR OLD.doi IS NOT NEW.doi
+     OR OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Publication', 'D', json_array(OLD.pub_id) WHERE OLD.pub_id IS NOT NEW.pub_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Publication', CASE WHEN OLD.pub_id IS NOT NEW.pub_id THEN 'I' ELSE 'U' END, json_array(NEW.pub_id),
+        rtrim(CASE WHEN OLD.pub_id IS NOT NEW.pub_id THEN 'pub_id,' ELSE '' END
+            || CASE WHEN OLD.title IS NOT NEW.title THEN 'title,' ELSE '' END
+            || CASE WHEN OLD.pub_date IS NOT NEW.pub_date THEN 'pub_date,' ELSE '' END
+            || CASE WHEN OLD.venue IS NOT NEW.venue THEN 'venue,' ELSE '' END
+            || CASE WHEN OLD.doi IS NOT NEW.doi THEN 'doi,' ELSE '' END
+            || CASE WHEN OLD.status IS NOT NEW.status THEN 'status,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_publication_delete
+AFTER DELETE ON Publication
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Publication', 'D', json_array(OLD.pub_id));
+END;
+
+-- Authorship
+CREATE TRIGGER changelog_authorship_insert
+AFTER INSERT ON Authorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Authorship', 'I', json_array(NEW.pub_id, NEW.member_id));
+END;
+CREATE TRIGGER changelog_authorship_update
+AFTER UPDATE ON Authorship
+WHEN OLD.pub_id IS NOT NEW.pub_id
+     OR OLD.member_id IS NOT NEW.member_id
+     OR OLD.author_order IS NOT NEW.author_order
+     OR OLD.author_role IS NOT NEW.author_role
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Authorship', 'D', json_array(OLD.pub_id, OLD.member_id) WHERE OLD.pub_id IS NOT NEW.pub_id OR OLD.member_id IS NOT NEW.member_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Authorship', CASE WHEN OLD.pub_id IS NOT NEW.pub_id OR OLD.member_id IS NOT NEW.member_id THEN 'I' ELSE 'U' END, json_array(NEW.pub_id, NEW.member_id),
+        rtrim(CASE WHEN OLD.pub_id IS NOT NEW.pub_id THEN 'pub_id,' ELSE '' END
+            || CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.author_order IS NOT NEW.author_order THEN 'author_order,' ELSE '' END
+            || CASE WHEN OLD.author_role IS NOT NEW.author_role THEN 'author_role,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_authorship_delete
+AFTER DELETE ON Authorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Authorship', 'D', json_array(OLD.pub_id, OLD.member_id));
+END;
+
+-- Mentorship
+CREATE TRIGGER changelog_mentorship_insert
+AFTER INSERT ON Mentorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Mentorship', 'I', json_array(NEW.mentor_id, NEW.mentee_id));
+END;
+CREATE TRIGGER changelog_mentorship_update
+AFTER UPDATE ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id
+     OR OLD.mentee_id IS NOT NEW.mentee_id
+     OR OLD.start_date IS NOT NEW.start_date
+     OR OLD.end_date IS NOT NEW.end_date
+     OR OLD.notes IS NOT NEW.notes
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Mentorship', 'D', json_array(OLD.mentor_id, OLD.mentee_id) WHERE OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Mentorship', CASE WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id THEN 'I' ELSE 'U' END, json_array(NEW.mentor_id, NEW.mentee_id),
+        rtrim(CASE WHEN OLD.mentor_id IS NOT NEW.mentor_id THEN 'mentor_id,' ELSE '' END
+            || CASE WHEN OLD.mentee_id IS NOT NEW.mentee_id THEN 'mentee_id,' ELSE '' END
+            || CASE WHEN OLD.start_date IS NOT NEW.start_date THEN 'start_date,' ELSE '' END
+            || CASE WHEN OLD.end_date IS NOT NEW.end_date THEN 'end_date,' ELSE '' END
+            || CASE WHEN OLD.notes IS NOT NEW.notes THEN 'notes,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_mentorship_delete
+AFTER DELETE ON Mentorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Mentorship', 'D', json_array(OLD.mentor_id, OLD.mentee_id));
+END;
+
+-- EquipmentUseArchive
+CREATE TRIGGER changelog_equipmentusearchive_insert
+AFTER INSERT ON EquipmentUseArchive
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('EquipmentUseArchive', 'I', json_array(NEW.use_id));
+END;
+CREATE TRIGGER changelog_equipmentusearchive_update
+AFTER UPDATE ON EquipmentUseArchive
+WHEN OLD.use_id IS NOT NEW.use_id
+     OR OLD.equip_id IS NOT NEW.equip_id
+     OR OLD.member_id IS NOT NEW.member_id
+     OR OLD.use_start IS NOT NEW.use_start
+     OR OLD.use_end IS NOT NEW.use_end
+     OR OLD.purpose IS NOT NEW.purpose
+     OR OLD.archived_at IS NOT NEW.archived_at
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'EquipmentUseArchive', 'D', json_array(OLD.use_id) WHERE OLD.use_id IS NOT NEW.use_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('EquipmentUseArchive', CASE WHEN OLD.use_id IS NOT NEW.use_id THEN 'I' ELSE 'U' END, json_array(NEW.use_id),
+        rtrim(CASE WHEN OLD.use_id IS NOT NEW.use_id THEN 'use_id,' ELSE '' END
+            || CASE WHEN OLD.equip_id IS NOT NEW.equip_id THEN 'equip_id,' ELSE '' END
+            || CASE WHEN OLD.member_id IS NOT NEW.member_id THEN 'member_id,' ELSE '' END
+            || CASE WHEN OLD.use_start IS NOT NEW.use_start THEN 'use_start,' ELSE '' END
+            || CASE WHEN OLD.use_end IS NOT NEW.use_end THEN 'use_end,' ELSE '' END
+            || CASE WHEN OLD.purpose IS NOT NEW.purpose THEN 'purpose,' ELSE '' END
+            || CASE WHEN OLD.archived_at IS NOT NEW.archived_at THEN 'archived_at,' ELSE '' END, ','));
+END;
+CREATE TRIGGER changelog_equipmentusearchive_delete
+AFTER DELETE ON EquipmentUseArchive
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('EquipmentUseArchive', 'D', json_array(OLD.use_id));
+END;
@@ -0,0 +1,119 @@
+-- Equipment occupancy: one row per equipment with the bookings active right
+-- now, so "who is using this" and "is it free" are primary-key reads instead
+-- of range scans over EquipmentUse. The triggers below refresh a row whenever
+-- one of its current or future bookings is written. Bookings that merely start
+-- or end with the passing of time are picked up by the sweeper in
+-- app/occupancy.py, which refreshes each row once it reaches valid_until (the
+-- next booking start or end). A reader that finds valid_until in the past
+-- computes the row from equipment_occupancy_now instead.
+--
+-- Equipment.status follows the occupancy ('in use' / 'available') unless it
+-- has been set to 'retired'.
+--
+-- "now" is local wall-clock time read as UTC, which is how the *_ts columns
+-- and app.models.to_epoch() encode timestamps.
+
+CREATE TABLE EquipmentOccupancy (
+    equip_id TEXT PRIMARY KEY REFERENCES Equipment(equip_id),
+    active_count INTEGER NOT NULL DEFAULT 0,
+    active_use_ids TEXT NOT NULL DEFAULT '[]',  -- JSON array of use_id
+    valid_until INTEGER,                        -- epoch of the next start/end, NULL if none is scheduled
+    computed_at INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_equipmentoccupancy_valid_until ON EquipmentOccupancy(valid_until);
+
+-- Bookings end at the end of their last second, so one ending at T stops
+-- counting at T + 1 (open-ended bookings never stop). Every subquery is a range scan of
+-- idx_equipmentuse_equip_range over bookings that have not ended yet.
+CREATE VIEW equipment_occupancy_now AS
+SELECT e.equip_id,
+       (SELECT COUNT(*) FROM EquipmentUse u
+        WHERE u.equip_id = e.equip_id AND u.use_end_ts >= n.ts AND u.use_start_ts <= n.ts) AS active_count,
+       (SELECT json_group_array(use_id) FROM (SELECT u.use_id FROM EquipmentUse u
+        WHERE u.equip_id = e.equip_id AND u.use_end_ts >= n.ts AND u.use_start_ts <= n.ts ORDER BY u.use_id)) AS active_use_ids,
+       (SELECT MIN(CASE WHEN u.use_start_ts > n.ts THEN u.use_start_ts
+                        WHEN u.use_end_ts < 9223372036854775807 THEN u.use_end_ts + 1 END) FROM EquipmentUse u
+        WHERE u.equip_id = e.equip_id AND u.use_end_ts >= n.ts) AS valid_until,
+       n.ts AS computed_at
+FROM Equipment e, (SELECT CAST(strftime('%s', 'now', 'localtime') AS INTEGER) AS ts) n;
+
+INSERT INTO EquipmentOccupancy(equip_id, active_count, active_use_ids, valid_until, computed_at)
+SELECT equip_id, active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now;
+
+-- Booking writes. Rows that ended before now affect neither the count nor
+-- valid_until, so archiving old history does not touch the occupancy rows.
+CREATE TRIGGER occupancy_equipmentuse_insert
+AFTER INSERT ON EquipmentUse
+WHEN NEW.use_end_ts >= CAST(strftime('%s', 'now', 'localtime') AS INTEGER)
+BEGIN
+    UPDATE EquipmentOccupancy SET (active_count, active_use_ids, valid_until, computed_at) =
+        (SELECT active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now v WHERE v.equip_id = NEW.equip_id)
+    WHERE equip_id = NEW.equip_id;
+END;
+
+CREATE TRIGGER occupancy_equipmentuse_update
+AFTER UPDATE OF equip_id, use_start, use_end ON EquipmentUse
+WHEN MAX(OLD.use_end_ts, NEW.use_end_ts) >= CAST(strftime('%s', 'now', 'localtime') AS INTEGER)
+BEGIN
+    UPDATE EquipmentOccupancy SET (active_count, active_use_ids, valid_until, computed_at) =
+        (SELECT active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now v WHERE v.equip_id = EquipmentOccupancy.equip_id)
+    WHERE equip_id IN (OLD.equip_id, NEW.equip_id);
+END;
+
+CREATE TRIGGER occupancy_equipmentuse_delete
+AFTER DELETE ON EquipmentUse
+WHEN OLD.use_end_ts >= CAST(strftime('%s', 'now', 'localtime') AS INTEGER)
+BEGIN
+    UPDATE EquipmentOccupancy SET (active_count, active_use_ids, valid_until, computed_at) =
+        (SELECT active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now v WHERE v.equip_id = OLD.equip_id)
+    WHERE equip_id = OLD.equip_id;
+END;
+
+-- One occupancy row per equipment
+CREATE TRIGGER occupancy_equipment_insert
+AFTER INSERT ON Equipment
+BEGIN
+    INSERT OR REPLACE INTO EquipmentOccupancy(equip_id, active_count, active_use_ids, valid_until, computed_at)
+    SELECT equip_id, active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now WHERE equip_id = NEW.equip_id;
+END;
+
+CREATE TRIGGER occupancy_equipment_delete
+AFTER DELETE ON Equipment
+BEGIN
+    DELETE FROM EquipmentOccupancy WHERE equip_id = OLD.equip_id;
+END;
+
+-- Derived status. The second trigger puts back the derived value when a form
+-- or a script sets anything other than 'retired'; SQLite does not re-enter a
+-- trigger from its own UPDATE (recursive_triggers is off).
+CREATE TRIGGER occupancy_status_insert
+AFTER INSERT ON EquipmentOccupancy
+BEGIN
+    UPDATE Equipment SET status = CASE WHEN NEW.active_count > 0 THEN 'in use' ELSE 'available' END
+    WHERE equip_id = NEW.equip_id AND status IS NOT 'retired'
+      AND status IS NOT (CASE WHEN NEW.active_count > 0 THEN 'in use' ELSE 'available' END);
+END;
+
+CREATE TRIGGER occupancy_status_update
+AFTER UPDATE OF active_count ON EquipmentOccupancy
+BEGIN
+    UPDATE Equipment SET status = CASE WHEN NEW.active_count > 0 THEN 'in use' ELSE 'available' END
+    WHERE equip_id = NEW.equip_id AND status IS NOT 'retired'
+      AND status IS NOT (CASE WHEN NEW.active_count > 0 THEN 'in use' ELSE 'available' END);
+END;
+
+CREATE TRIGGER equipment_status_derived
+AFTER UPDATE OF status ON Equipment
+WHEN NEW.status IS NOT 'retired'
+BEGIN
+    UPDATE Equipment SET status = (SELECT CASE WHEN o.active_count > 0 THEN 'in use' ELSE 'available' END
+                                   FROM EquipmentOccupancy o WHERE o.equip_id = NEW.equip_id)
+    WHERE equip_id = NEW.equip_id
+      AND EXISTS (SELECT 1 FROM EquipmentOccupancy o WHERE o.equip_id = NEW.equip_id
+                  AND NEW.status IS NOT (CASE WHEN o.active_count > 0 THEN 'in use' ELSE 'available' END));
+END;
+
+UPDATE Equipment SET status = (SELECT CASE WHEN o.active_count > 0 THEN 'in use' ELSE 'available' END
+                               FROM EquipmentOccupancy o WHERE o.equip_id = Equipment.equip_id)
+WHERE status IS NOT 'retired' AND equip_id IN (SELECT equip_id FROM EquipmentOccupancy);
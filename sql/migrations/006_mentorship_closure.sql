@@ -0,0 +1,113 @@
+-- Mentorship lineage: MentorshipClosure holds one row per (ancestor,
+-- descendant, depth) reachable through Mentorship, so "all mentors above X"
+-- and "everyone below X" are one index range read however deep the tree is.
+-- `paths` counts the distinct mentor chains of that length between the two
+-- members. With one mentor per mentee it is always 1, but the counts let a
+-- deleted edge be subtracted exactly if a mentee ever has several mentors.
+--
+-- Adding edge a -> b adds every (ancestor of a or a) x (descendant of b or b)
+-- pair; deleting it subtracts the same product. Both sides are index reads,
+-- so the cost is proportional to the rows that change. app/lineage.py reads
+-- the table, falls back to a recursive CTE over Mentorship when it is
+-- missing, and can rebuild or verify it.
+
+CREATE TABLE MentorshipClosure (
+    ancestor_id TEXT NOT NULL,
+    descendant_id TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    paths INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (ancestor_id, descendant_id, depth)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_mentorshipclosure_descendant ON MentorshipClosure(descendant_id, ancestor_id, depth);
+
+WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+    SELECT mentor_id, mentee_id, 1 FROM Mentorship
+    UNION ALL
+    SELECT w.ancestor_id, m.mentee_id, w.depth + 1
+    FROM walk w JOIN Mentorship m ON m.mentor_id = w.descendant_id
+    WHERE w.depth < 1000
+)
+INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+SELECT ancestor_id, descendant_id, depth, COUNT(*) FROM walk GROUP BY ancestor_id, descendant_id, depth;
+
+-- A mentee can't (transitively) mentor one of their own mentors
+CREATE TRIGGER check_mentorship_cycle
+BEFORE INSERT ON Mentorship
+BEGIN
+    SELECT CASE
+        WHEN NEW.mentor_id = NEW.mentee_id
+          OR EXISTS (SELECT 1 FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id AND descendant_id = NEW.mentor_id)
+        THEN RAISE(ABORT, 'Mentorship cycle: the mentee is already above the mentor in the lineage')
+    END;
+END;
+
+CREATE TRIGGER check_mentorship_cycle_update
+BEFORE UPDATE OF mentor_id, mentee_id ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id
+BEGIN
+    SELECT CASE
+        WHEN NEW.mentor_id = NEW.mentee_id
+          OR EXISTS (SELECT 1 FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id AND descendant_id = NEW.mentor_id)
+        THEN RAISE(ABORT, 'Mentorship cycle: the mentee is already above the mentor in the lineage')
+    END;
+END;
+
+CREATE TRIGGER mentorship_closure_insert
+AFTER INSERT ON Mentorship
+BEGIN
+    INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+    SELECT up.id, down.id, up.depth + 1 + down.depth, up.paths * down.paths
+    FROM (SELECT NEW.mentor_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = NEW.mentor_id) up,
+         (SELECT NEW.mentee_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id) down
+    WHERE 1
+    ON CONFLICT(ancestor_id, descendant_id, depth) DO UPDATE SET paths = paths + excluded.paths;
+END;
+
+CREATE TRIGGER mentorship_closure_delete
+AFTER DELETE ON Mentorship
+BEGIN
+    UPDATE MentorshipClosure SET paths = MentorshipClosure.paths - d.paths
+    FROM (SELECT up.id AS ancestor_id, down.id AS descendant_id, up.depth + 1 + down.depth AS depth, SUM(up.paths * down.paths) AS paths
+          FROM (SELECT OLD.mentor_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id) up,
+               (SELECT OLD.mentee_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = OLD.mentee_id) down
+          GROUP BY 1, 2, 3) d
+    WHERE MentorshipClosure.ancestor_id = d.ancestor_id AND MentorshipClosure.descendant_id = d.descendant_id
+      AND MentorshipClosure.depth = d.depth;
+    DELETE FROM MentorshipClosure
+    WHERE paths <= 0
+      AND (ancestor_id = OLD.mentor_id
+           OR ancestor_id IN (SELECT ancestor_id FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id));
+END;
+
+-- re-pointing an edge is a delete of the old one followed by an insert of the new one
+CREATE TRIGGER mentorship_closure_update
+AFTER UPDATE OF mentor_id, mentee_id ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id
+BEGIN
+    UPDATE MentorshipClosure SET paths = MentorshipClosure.paths - d.paths
+    FROM (SELECT up.id AS ancestor_id, down.id AS descendant_id, up.depth + 1 + down.depth AS depth, SUM(up.paths * down.paths) AS paths
+          FROM (SELECT OLD.mentor_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id) up,
+               (SELECT OLD.mentee_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = OLD.mentee_id) down
+          GROUP BY 1, 2, 3) d
+    WHERE MentorshipClosure.ancestor_id = d.ancestor_id AND MentorshipClosure.descendant_id = d.descendant_id
+      AND MentorshipClosure.depth = d.depth;
+    DELETE FROM MentorshipClosure
+    WHERE paths <= 0
+      AND (ancestor_id = OLD.mentor_id
+           OR ancestor_id IN (SELECT ancestor_id FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id));
+    INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+    SELECT up.id, down.id, up.depth + 1 + down.depth, up.paths * down.paths
+    FROM (SELECT NEW.mentor_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = NEW.mentor_id) up,
+         (SELECT NEW.mentee_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id) down
+    WHERE 1
+    ON CONFLICT(ancestor_id, descendant_id, depth) DO UPDATE SET paths = paths + excluded.paths;
+END;
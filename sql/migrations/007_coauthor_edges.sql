@@ -0,0 +1,104 @@
+-- Co-authorship graph: one row per pair of members who wrote papers together,
+-- per period (the publication year, 0 when the paper has no date), with the
+-- number of such papers. member_a < member_b, so each pair is stored once.
+-- app/collaboration.py reads a range of periods from here instead of
+-- self-joining Authorship, which is quadratic in the authors of each paper.
+--
+-- Adding an author adds one paper to their pair with every co-author already
+-- on the paper; removing one subtracts it again. Edges follow only papers
+-- whose Publication row exists. A publication that is deleted outright gives
+-- up its edges in a BEFORE trigger, because its Authorship rows may be
+-- removed by the cascade after the Publication row is already gone.
+
+CREATE TABLE CoAuthorEdge (
+    member_a TEXT NOT NULL,
+    member_b TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    papers INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (member_a, member_b, period)
+) WITHOUT ROWID;
+
+-- period range reads; with the primary key columns included it covers them
+CREATE INDEX idx_coauthoredge_period ON CoAuthorEdge(period, papers);
+
+INSERT INTO CoAuthorEdge(member_a, member_b, period, papers)
+SELECT a.member_id, b.member_id, COALESCE(CAST(strftime('%Y', p.pub_date) AS INTEGER), 0), COUNT(*)
+FROM Authorship a
+JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+JOIN Publication p ON p.pub_id = a.pub_id
+GROUP BY 1, 2, 3;
+
+CREATE TRIGGER coauthor_edge_insert
+AFTER INSERT ON Authorship
+WHEN EXISTS (SELECT 1 FROM Publication WHERE pub_id = NEW.pub_id)
+BEGIN
+    INSERT INTO CoAuthorEdge(member_a, member_b, period, papers)
+    SELECT MIN(NEW.member_id, a.member_id), MAX(NEW.member_id, a.member_id),
+           (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) FROM Publication WHERE pub_id = NEW.pub_id), 1
+    FROM Authorship a
+    WHERE a.pub_id = NEW.pub_id AND a.member_id <> NEW.member_id
+    ON CONFLICT(member_a, member_b, period) DO UPDATE SET papers = papers + 1;
+END;
+
+CREATE TRIGGER coauthor_edge_delete
+AFTER DELETE ON Authorship
+WHEN EXISTS (SELECT 1 FROM Publication WHERE pub_id = OLD.pub_id)
+BEGIN
+    UPDATE CoAuthorEdge SET papers = papers - 1
+    WHERE period = (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) FROM Publication WHERE pub_id = OLD.pub_id)
+      AND (member_a, member_b) IN (SELECT MIN(OLD.member_id, a.member_id), MAX(OLD.member_id, a.member_id)
+                                   FROM Authorship a WHERE a.pub_id = OLD.pub_id AND a.member_id <> OLD.member_id);
+    DELETE FROM CoAuthorEdge
+    WHERE papers <= 0
+      AND period = (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) FROM Publication WHERE pub_id = OLD.pub_id);
+END;
+
+-- moving an authorship to another paper or member is a delete followed by an insert
+CREATE TRIGGER coauthor_edge_update
+AFTER UPDATE OF pub_id, member_id ON Authorship
+WHEN OLD.pub_id IS NOT NEW.pub_id OR OLD.member_id IS NOT NEW.member_id
+BEGIN
+    UPDATE CoAuthorEdge SET papers = papers - 1
+    WHERE period = (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) FROM Publication WHERE pub_id = OLD.pub_id)
+      AND (member_a, member_b) IN (SELECT MIN(OLD.member_id, a.member_id), MAX(OLD.member_id, a.member_id)
+                                   FROM Authorship a WHERE a.pub_id = OLD.pub_id AND a.member_id <> OLD.member_id
+                                     AND NOT (a.pub_id = NEW.pub_id AND a.member_id = NEW.member_id));
+    DELETE FROM CoAuthorEdge
+    WHERE papers <= 0
+      AND period = (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) FROM Publication WHERE pub_id = OLD.pub_id);
+    INSERT INTO CoAuthorEdge(member_a, member_b, period, papers)
+    SELECT MIN(NEW.member_id, a.member_id), MAX(NEW.member_id, a.member_id), p.period, 1
+    FROM Authorship a,
+         (SELECT COALESCE(CAST(strftime('%Y', pub_date) AS INTEGER), 0) AS period FROM Publication WHERE pub_id = NEW.pub_id) p
+    WHERE a.pub_id = NEW.pub_id AND a.member_id <> NEW.member_id
+    ON CONFLICT(member_a, member_b, period) DO UPDATE SET papers = papers + 1;
+END;
+
+-- a paper whose date moves to another year takes its edges with it
+CREATE TRIGGER coauthor_edge_period
+AFTER UPDATE OF pub_date ON Publication
+WHEN COALESCE(CAST(strftime('%Y', OLD.pub_date) AS INTEGER), 0) IS NOT COALESCE(CAST(strftime('%Y', NEW.pub_date) AS INTEGER), 0)
+BEGIN
+    UPDATE CoAuthorEdge SET papers = papers - 1
+    WHERE period = COALESCE(CAST(strftime('%Y', OLD.pub_date) AS INTEGER), 0)
+      AND (member_a, member_b) IN (SELECT a.member_id, b.member_id FROM Authorship a
+                                   JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+                                   WHERE a.pub_id = NEW.pub_id);
+    DELETE FROM CoAuthorEdge WHERE papers <= 0 AND period = COALESCE(CAST(strftime('%Y', OLD.pub_date) AS INTEGER), 0);
+    INSERT INTO CoAuthorEdge(member_a, member_b, period, papers)
+    SELECT a.member_id, b.member_id, COALESCE(CAST(strftime('%Y', NEW.pub_date) AS INTEGER), 0), 1
+    FROM Authorship a JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+    WHERE a.pub_id = NEW.pub_id
+    ON CONFLICT(member_a, member_b, period) DO UPDATE SET papers = papers + 1;
+END;
+
+CREATE TRIGGER coauthor_edge_publication_delete
+BEFORE DELETE ON Publication
+BEGIN
+    UPDATE CoAuthorEdge SET papers = papers - 1
+    WHERE period = COALESCE(CAST(strftime('%Y', OLD.pub_date) AS INTEGER), 0)
+      AND (member_a, member_b) IN (SELECT a.member_id, b.member_id FROM Authorship a
+                                   JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+                                   WHERE a.pub_id = OLD.pub_id);
+    DELETE FROM CoAuthorEdge WHERE papers <= 0 AND period = COALESCE(CAST(strftime('%Y', OLD.pub_date) AS INTEGER), 0);
+END;
@@ -0,0 +1,211 @@
+-- Mentorship overlap rule in the database. The base schema declared
+-- mentee_id UNIQUE, which allowed one mentorship per mentee ever. The rule is
+-- that a mentee has at most one mentor at a time: sequential mentorships
+-- are fine, overlapping ones are not. The routes used to check for overlap
+-- with a read before the write, which two workers could both pass. The
+-- triggers below check in the INSERT/UPDATE itself, with one probe of
+-- idx_mentorship_mentee_range.
+--
+-- SQLite can't drop a column constraint, so the table is rebuilt (create,
+-- copy, drop, rename). Dropping it drops its indexes and triggers, which are
+-- recreated unchanged after the new overlap triggers. The LabMember trigger
+-- that reads Mentorship is dropped first so the rename does not trip over it.
+
+DROP TRIGGER IF EXISTS check_labmember_type_update_for_mentorship;
+
+CREATE TABLE Mentorship_new (
+    mentor_id TEXT,
+    mentee_id TEXT,
+    start_date DATE,
+    end_date DATE,
+    notes TEXT,
+    start_ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', start_date) AS INTEGER)) VIRTUAL,
+    end_ts INTEGER GENERATED ALWAYS AS (COALESCE(CAST(strftime('%s', end_date) AS INTEGER), 9223372036854775807)) VIRTUAL,
+    PRIMARY KEY(mentor_id, mentee_id),
+    FOREIGN KEY(mentor_id) REFERENCES LabMember(member_id) ON DELETE CASCADE,
+    FOREIGN KEY(mentee_id) REFERENCES LabMember(member_id) ON DELETE CASCADE
+);
+
+INSERT INTO Mentorship_new(mentor_id, mentee_id, start_date, end_date, notes)
+SELECT mentor_id, mentee_id, start_date, end_date, notes FROM Mentorship;
+
+DROP TABLE Mentorship;
+ALTER TABLE Mentorship_new RENAME TO Mentorship;
+
+CREATE INDEX idx_mentorship_mentee_range ON Mentorship(mentee_id, end_ts, start_ts);
+
+-- [start_date, end_date] ranges are inclusive days, as the forms always
+-- checked them; an open end never ends. The message prefix is what
+-- app/constraints.py matches on.
+CREATE TRIGGER check_mentorship_overlap
+BEFORE INSERT ON Mentorship
+BEGIN
+    SELECT RAISE(ABORT, 'Mentorship overlap: the mentee already has a mentorship in this period')
+    FROM Mentorship m
+    WHERE m.mentee_id = NEW.mentee_id
+      AND m.end_ts >= CAST(strftime('%s', NEW.start_date) AS INTEGER)
+      AND m.start_ts <= COALESCE(CAST(strftime('%s', NEW.end_date) AS INTEGER), 9223372036854775807)
+    LIMIT 1;
+END;
+
+CREATE TRIGGER check_mentorship_overlap_update
+BEFORE UPDATE OF mentee_id, start_date, end_date ON Mentorship
+BEGIN
+    SELECT RAISE(ABORT, 'Mentorship overlap: the mentee already has a mentorship in this period')
+    FROM Mentorship m
+    WHERE m.mentee_id = NEW.mentee_id
+      AND m.end_ts >= CAST(strftime('%s', NEW.start_date) AS INTEGER)
+      AND m.start_ts <= COALESCE(CAST(strftime('%s', NEW.end_date) AS INTEGER), 9223372036854775807)
+      AND NOT (m.mentor_id = OLD.mentor_id AND m.mentee_id = OLD.mentee_id)
+    LIMIT 1;
+END;
+
+-- unchanged from the base schema and migrations 004 and 006
+CREATE TRIGGER check_mentorship_types
+BEFORE INSERT ON Mentorship
+FOR EACH ROW
+BEGIN
+    -- if mentor is student and mentee is faculty, abort
+    SELECT CASE
+        WHEN (
+            (SELECT member_type FROM LabMember WHERE member_id = NEW.mentor_id) = 'student'
+            AND
+            (SELECT member_type FROM LabMember WHERE member_id = NEW.mentee_id) = 'faculty'
+        ) THEN RAISE(ABORT, 'Students cannot mentor faculty')
+    END;
+END;
+
+CREATE TRIGGER check_mentorship_types_update
+BEFORE UPDATE ON Mentorship
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN (
+            (SELECT member_type FROM LabMember WHERE member_id = NEW.mentor_id) = 'student'
+            AND
+            (SELECT member_type FROM LabMember WHERE member_id = NEW.mentee_id) = 'faculty'
+        ) THEN RAISE(ABORT, 'Students cannot mentor faculty')
+    END;
+END;
+
+CREATE TRIGGER check_labmember_type_update_for_mentorship
+BEFORE UPDATE ON LabMember
+FOR EACH ROW
+WHEN NEW.member_type = 'student'
+BEGIN
+    SELECT CASE
+        WHEN (
+            EXISTS(SELECT 1 FROM Mentorship m JOIN LabMember lm ON m.mentee_id = lm.member_id
+                   WHERE m.mentor_id = NEW.member_id AND lm.member_type = 'faculty')
+        ) THEN RAISE(ABORT, 'Changing member_type would make a student mentor a faculty member')
+    END;
+END;
+
+CREATE TRIGGER check_mentorship_cycle
+BEFORE INSERT ON Mentorship
+BEGIN
+    SELECT CASE
+        WHEN NEW.mentor_id = NEW.mentee_id
+          OR EXISTS (SELECT 1 FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id AND descendant_id = NEW.mentor_id)
+        THEN RAISE(ABORT, 'Mentorship cycle: the mentee is already above the mentor in the lineage')
+    END;
+END;
+
+CREATE TRIGGER check_mentorship_cycle_update
+BEFORE UPDATE OF mentor_id, mentee_id ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id
+BEGIN
+    SELECT CASE
+        WHEN NEW.mentor_id = NEW.mentee_id
+          OR EXISTS (SELECT 1 FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id AND descendant_id = NEW.mentor_id)
+        THEN RAISE(ABORT, 'Mentorship cycle: the mentee is already above the mentor in the lineage')
+    END;
+END;
+
+CREATE TRIGGER changelog_mentorship_insert
+AFTER INSERT ON Mentorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Mentorship', 'I', json_array(NEW.mentor_id, NEW.mentee_id));
+END;
+
+CREATE TRIGGER changelog_mentorship_update
+AFTER UPDATE ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id
+     OR OLD.mentee_id IS NOT NEW.mentee_id
+     OR OLD.start_date IS NOT NEW.start_date
+     OR OLD.end_date IS NOT NEW.end_date
+     OR OLD.notes IS NOT NEW.notes
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk)
+        SELECT 'Mentorship', 'D', json_array(OLD.mentor_id, OLD.mentee_id) WHERE OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id;
+    INSERT INTO ChangeLog(tbl, op, pk, cols) VALUES ('Mentorship', CASE WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id THEN 'I' ELSE 'U' END, json_array(NEW.mentor_id, NEW.mentee_id),
+        rtrim(CASE WHEN OLD.mentor_id IS NOT NEW.mentor_id THEN 'mentor_id,' ELSE '' END
+            || CASE WHEN OLD.mentee_id IS NOT NEW.mentee_id THEN 'mentee_id,' ELSE '' END
+            || CASE WHEN OLD.start_date IS NOT NEW.start_date THEN 'start_date,' ELSE '' END
+            || CASE WHEN OLD.end_date IS NOT NEW.end_date THEN 'end_date,' ELSE '' END
+            || CASE WHEN OLD.notes IS NOT NEW.notes THEN 'notes,' ELSE '' END, ','));
+END;
+
+CREATE TRIGGER changelog_mentorship_delete
+AFTER DELETE ON Mentorship
+BEGIN
+    INSERT INTO ChangeLog(tbl, op, pk) VALUES ('Mentorship', 'D', json_array(OLD.mentor_id, OLD.mentee_id));
+END;
+
+CREATE TRIGGER mentorship_closure_insert
+AFTER INSERT ON Mentorship
+BEGIN
+    INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+    SELECT up.id, down.id, up.depth + 1 + down.depth, up.paths * down.paths
+    FROM (SELECT NEW.mentor_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = NEW.mentor_id) up,
+         (SELECT NEW.mentee_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id) down
+    WHERE 1
+    ON CONFLICT(ancestor_id, descendant_id, depth) DO UPDATE SET paths = paths + excluded.paths;
+END;
+
+CREATE TRIGGER mentorship_closure_delete
+AFTER DELETE ON Mentorship
+BEGIN
+    UPDATE MentorshipClosure SET paths = MentorshipClosure.paths - d.paths
+    FROM (SELECT up.id AS ancestor_id, down.id AS descendant_id, up.depth + 1 + down.depth AS depth, SUM(up.paths * down.paths) AS paths
+          FROM (SELECT OLD.mentor_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id) up,
+               (SELECT OLD.mentee_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = OLD.mentee_id) down
+          GROUP BY 1, 2, 3) d
+    WHERE MentorshipClosure.ancestor_id = d.ancestor_id AND MentorshipClosure.descendant_id = d.descendant_id
+      AND MentorshipClosure.depth = d.depth;
+    DELETE FROM MentorshipClosure
+    WHERE paths <= 0
+      AND (ancestor_id = OLD.mentor_id
+           OR ancestor_id IN (SELECT ancestor_id FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id));
+END;
+
+CREATE TRIGGER mentorship_closure_update
+AFTER UPDATE OF mentor_id, mentee_id ON Mentorship
+WHEN OLD.mentor_id IS NOT NEW.mentor_id OR OLD.mentee_id IS NOT NEW.mentee_id
+BEGIN
+    UPDATE MentorshipClosure SET paths = MentorshipClosure.paths - d.paths
+    FROM (SELECT up.id AS ancestor_id, down.id AS descendant_id, up.depth + 1 + down.depth AS depth, SUM(up.paths * down.paths) AS paths
+          FROM (SELECT OLD.mentor_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id) up,
+               (SELECT OLD.mentee_id AS id, 0 AS depth, 1 AS paths
+                UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = OLD.mentee_id) down
+          GROUP BY 1, 2, 3) d
+    WHERE MentorshipClosure.ancestor_id = d.ancestor_id AND MentorshipClosure.descendant_id = d.descendant_id
+      AND MentorshipClosure.depth = d.depth;
+    DELETE FROM MentorshipClosure
+    WHERE paths <= 0
+      AND (ancestor_id = OLD.mentor_id
+           OR ancestor_id IN (SELECT ancestor_id FROM MentorshipClosure WHERE descendant_id = OLD.mentor_id));
+    INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+    SELECT up.id, down.id, up.depth + 1 + down.depth, up.paths * down.paths
+    FROM (SELECT NEW.mentor_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT ancestor_id, depth, paths FROM MentorshipClosure WHERE descendant_id = NEW.mentor_id) up,
+         (SELECT NEW.mentee_id AS id, 0 AS depth, 1 AS paths
+          UNION ALL SELECT descendant_id, depth, paths FROM MentorshipClosure WHERE ancestor_id = NEW.mentee_id) down
+    WHERE 1
+    ON CONFLICT(ancestor_id, descendant_id, depth) DO UPDATE SET paths = paths + excluded.paths;
+END;
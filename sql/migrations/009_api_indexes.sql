@@ -0,0 +1,13 @@
+-- Reverse lookups for the read API (app/api.py). include= resolves related
+-- rows with one "WHERE <column> IN (...)" per relation, and filters are only
+-- offered on leading index columns, so the second half of each composite key
+-- and the foreign keys the schema left unindexed get an index here. The
+-- primary key is appended so a filtered page still comes off the index in
+-- key order, which is the keyset pagination order.
+
+CREATE INDEX idx_workson_project ON WorksOn(project_id, member_id);
+CREATE INDEX idx_projectgrant_grant ON ProjectGrant(grant_id, project_id);
+CREATE INDEX idx_authorship_member ON Authorship(member_id, pub_id);
+CREATE INDEX idx_project_leader ON Project(leader_id, project_id);
+CREATE INDEX idx_project_status ON Project(status, project_id);
+CREATE INDEX idx_labmember_type ON LabMember(member_type, member_id);
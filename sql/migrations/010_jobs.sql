@@ -0,0 +1,28 @@
+-- Background jobs (app/jobs.py). A row per submitted job; the web process
+-- inserts it as 'queued', the worker process that runs it moves it through
+-- 'running' to 'done', 'failed' or 'cancelled' and records progress along
+-- the way. Cancelling a job that has started only sets cancel_requested; the
+-- worker stops at its next progress report. owner is host:pid of the process
+-- whose pool holds the job, so a restart can tell its own orphans apart from
+-- jobs of other live processes. Jobs are not application data and are not
+-- in the ChangeLog.
+
+CREATE TABLE Job (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued' CHECK(status IN ('queued','running','done','failed','cancelled')),
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result_file TEXT,
+    error TEXT,
+    owner TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    started_at INTEGER,
+    finished_at INTEGER
+);
+
+-- the jobs list (newest first) and the restart sweep over unfinished jobs
+CREATE INDEX idx_job_created ON Job(created_at);
+CREATE INDEX idx_job_status ON Job(status, owner);
@@ -0,0 +1,38 @@
+-- Re-create the equipment concurrency triggers for databases that applied 001
+-- before its fix. In a BEFORE UPDATE trigger, NEW.use_start_ts reads as NULL
+-- when the statement only sets use_end (and the other way round), so an edit
+-- that only moved a booking's end passed the 3-user check unseen. The bounds
+-- of the new row now come from NEW.use_start/NEW.use_end, as in 008.
+
+DROP TRIGGER IF EXISTS check_equipment_concurrency;
+CREATE TRIGGER check_equipment_concurrency
+BEFORE INSERT ON EquipmentUse
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN (
+            (SELECT COUNT(*) FROM EquipmentUse eu
+             WHERE eu.equip_id = NEW.equip_id
+               AND eu.use_end_ts > CAST(strftime('%s', NEW.use_start) AS INTEGER)
+               AND eu.use_start_ts < COALESCE(CAST(strftime('%s', NEW.use_end) AS INTEGER), 9223372036854775807)
+            ) >= 3
+        ) THEN RAISE(ABORT, 'Equipment concurrency limit exceeded (max 3 users)')
+    END;
+END;
+
+DROP TRIGGER IF EXISTS check_equipment_concurrency_update;
+CREATE TRIGGER check_equipment_concurrency_update
+BEFORE UPDATE ON EquipmentUse
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN (
+            (SELECT COUNT(*) FROM EquipmentUse eu
+             WHERE eu.equip_id = NEW.equip_id
+               AND eu.use_id != OLD.use_id
+               AND eu.use_end_ts > CAST(strftime('%s', NEW.use_start) AS INTEGER)
+               AND eu.use_start_ts < COALESCE(CAST(strftime('%s', NEW.use_end) AS INTEGER), 9223372036854775807)
+            ) >= 3
+        ) THEN RAISE(ABORT, 'Equipment concurrency limit exceeded (max 3 users)')
+    END;
+END;
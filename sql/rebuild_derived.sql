@@ -0,0 +1,34 @@
+-- Recomputes columns and tables that triggers normally keep in sync. Run after
+-- loading data with the triggers disabled (init_db.bulk_load) or to repair drift.
+
+UPDATE GrantFund SET allocated_total = COALESCE(
+    (SELECT SUM(amount_allocated) FROM ProjectGrant WHERE ProjectGrant.grant_id = GrantFund.grant_id), 0);
+
+-- one occupancy row per equipment, then the derived Equipment.status
+DELETE FROM EquipmentOccupancy WHERE equip_id NOT IN (SELECT equip_id FROM Equipment);
+INSERT OR REPLACE INTO EquipmentOccupancy(equip_id, active_count, active_use_ids, valid_until, computed_at)
+SELECT equip_id, active_count, active_use_ids, valid_until, computed_at FROM equipment_occupancy_now;
+UPDATE Equipment SET status = (SELECT CASE WHEN o.active_count > 0 THEN 'in use' ELSE 'available' END
+                               FROM EquipmentOccupancy o WHERE o.equip_id = Equipment.equip_id)
+WHERE status IS NOT 'retired';
+
+-- mentorship lineage (sql/migrations/006)
+DELETE FROM MentorshipClosure;
+WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+    SELECT mentor_id, mentee_id, 1 FROM Mentorship
+    UNION ALL
+    SELECT w.ancestor_id, m.mentee_id, w.depth + 1
+    FROM walk w JOIN Mentorship m ON m.mentor_id = w.descendant_id
+    WHERE w.depth < 1000
+)
+INSERT INTO MentorshipClosure(ancestor_id, descendant_id, depth, paths)
+SELECT ancestor_id, descendant_id, depth, COUNT(*) FROM walk GROUP BY ancestor_id, descendant_id, depth;
+
+-- co-authorship graph (sql/migrations/007)
+DELETE FROM CoAuthorEdge;
+INSERT INTO CoAuthorEdge(member_a, member_b, period, papers)
+SELECT a.member_id, b.member_id, COALESCE(CAST(strftime('%Y', p.pub_date) AS INTEGER), 0), COUNT(*)
+FROM Authorship a
+JOIN Authorship b ON b.pub_id = a.pub_id AND b.member_id > a.member_id
+JOIN Publication p ON p.pub_id = a.pub_id
+GROUP BY 1, 2, 3;
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+import init_db  # noqa: E402
+from app.app import create_app  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # an empty, fully migrated database
+    path = str(tmp_path / 'lab.db')
+    conn = sqlite3.connect(path)
+    init_db.run_sql_file(conn, os.path.join(init_db.SQL_DIR, 'schema_sqlite.sql'))
+    init_db.apply_migrations(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def app(db_path, tmp_path):
+    return create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'OCCUPANCY_SWEEPER': False,
+                       'JOBS_DIR': str(tmp_path / 'jobs')})
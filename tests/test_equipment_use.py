@@ -0,0 +1,18 @@
+import sqlite3
+
+from app.archive import archive_bookings
+
+
+def test_new_booking_does_not_reuse_an_archived_id(app, db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("INSERT INTO LabMember (member_id, name, join_date, member_type) VALUES ('S1', 'Student', '2020-01-01', 'student')")
+    conn.execute("INSERT INTO Equipment (equip_id, name, status) VALUES ('E1', 'Scope', 'available')")
+    conn.execute("INSERT INTO EquipmentUse (use_id, equip_id, member_id, use_start, use_end, purpose) "
+                 "VALUES ('U7', 'E1', 'S1', '2020-01-01 09:00:00', '2020-01-01 10:00:00', 'old')")
+    assert archive_bookings(conn, horizon_days=30) == 1
+
+    resp = app.test_client().post('/equipmentuse/new', data={
+        'equip_id': 'E1', 'member_id': 'S1', 'use_start': '2030-01-01T09:00', 'use_end': '2030-01-01T10:00', 'purpose': 'new'})
+    assert resp.status_code == 302
+    assert conn.execute("SELECT use_id FROM EquipmentUse").fetchall() == [('U8',)]
+    conn.close()
@@ -0,0 +1,14 @@
+from app.events import events
+
+
+def test_stream_limit_ignores_the_apps_own_listeners(app, monkeypatch):
+    monkeypatch.setattr(events, 'max_subscribers', 1)
+    own = events.subscribe('equipment', capped=False)
+    client = app.test_client()
+    first = client.get('/equipment/stream?ids=E1')
+    try:
+        assert first.status_code == 200
+        assert client.get('/equipment/stream?ids=E1').status_code == 503
+    finally:
+        first.close()
+        events.unsubscribe(own)
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from app.jobs import KINDS
+from app.models import db
+
+
+def _queue(app, kind, params):
+    # a queued job as submit() records it, without starting a worker pool
+    with app.app_context():
+        params = KINDS[kind].prepare(params)
+        db.session.execute(text("INSERT INTO Job(job_id, kind, params, owner) VALUES ('j1', :k, :p, 'test')"),
+                           {'k': kind, 'p': json.dumps(params)})
+        db.session.commit()
+    return params
+
+
+@pytest.mark.parametrize('kind, params, shown', [
+    ('collaboration', {'k': '5'}, 'k=5'),
+    ('grant_burndown', {'grant_ids': 'G1,G2', 'ending_within': '90'}, 'grant_ids=G1,G2'),
+])
+def test_status_page_of_queued_job(app, kind, params, shown):
+    _queue(app, kind, params)
+    resp = app.test_client().get('/jobs/j1')
+    assert resp.status_code == 200
+    body = resp.get_data(as_text=True)
+    assert shown in body
+    assert 'queued' in body
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+from app.writes import writes
+
+
+@pytest.fixture
+def locked(db_path, monkeypatch):
+    # another connection holds the write lock for the whole test
+    monkeypatch.setattr(writes, 'deadline', 0.2)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    yield
+    conn.execute('ROLLBACK')
+    conn.close()
+
+
+def test_read_only_post_does_not_wait_for_the_write_lock(app, locked):
+    resp = app.test_client().post('/project/status/batch', json={'start': '2024-01-01', 'end': '2024-01-02'})
+    assert resp.status_code == 200
+    assert resp.get_json()['projects'] == []
+
+
+def test_admin_select_does_not_wait_for_the_write_lock(app, locked):
+    resp = app.test_client().post('/admin/sql', data={'sql': 'SELECT name FROM sqlite_master'})
+    body = resp.get_data(as_text=True)
+    assert 'locked' not in body
+    assert 'EquipmentUse' in body
+
+
+def test_write_post_still_begins_immediate(app, locked):
+    resp = app.test_client().post('/equipment/new', data={
+        'name': 'Scope', 'type': 'microscope', 'purchase_date': '2024-01-01', 'status': 'available', 'location': 'Lab 1', 'notes': 'n'})
+    assert resp.status_code == 503